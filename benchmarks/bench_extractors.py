@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the html content extractors on a corpus of saved html pages.
+
+    python benchmarks/bench_extractors.py --corpus path/to/saved/pages --rounds 3
+
+Without --corpus a synthetic corpus of pages with navigation, sidebar and footer boilerplate is used.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_researcher.tools.scraper.extractors import get_extractor
+
+
+def synthetic_page(index, paragraphs=60, links=150):
+    nav = "".join(f"<li><a href='/section/{i}'>Section {i} navigation link</a></li>" for i in range(links))
+    article = "".join(f"<p>Paragraph {i} of article {index}. " + "The market for research agents keeps growing. " * 8
+                      + "</p>" for i in range(paragraphs))
+    sidebar = "".join(f"<p><a href='/related/{i}'>Related story number {i} you may also like</a></p>"
+                      for i in range(40))
+    return (f"<html><head><title>Article {index}</title><script>var x = {index};</script></head><body>"
+            f"<header><nav><ul>{nav}</ul></nav></header>"
+            f"<div class='layout'><div class='content'><h1>Article {index}</h1>{article}</div>"
+            f"<div class='sidebar'>{sidebar}</div></div>"
+            f"<footer><p>Copyright footer text of the site, all rights reserved, contact us.</p></footer>"
+            f"</body></html>").encode("utf-8")
+
+
+def load_corpus(corpus_dir, size):
+    if corpus_dir:
+        return [path.read_bytes() for path in sorted(Path(corpus_dir).glob("**/*.htm*"))]
+    return [synthetic_page(i) for i in range(size)]
+
+
+def bench(name, pages, rounds):
+    extractor = get_extractor(name)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        outputs = [extractor.extract(page) for page in pages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    input_bytes = sum(len(page) for page in pages)
+    output_chars = sum(len(output) for output in outputs)
+    return {"extractor": name, "pages": len(pages), "seconds": round(best, 3),
+            "pages_per_sec": round(len(pages) / best, 1), "input_mb_per_sec": round(input_bytes / best / 2 ** 20, 2),
+            "avg_output_chars": output_chars // max(1, len(pages))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="directory of saved .html pages")
+    parser.add_argument("--size", type=int, default=200, help="number of synthetic pages without --corpus")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.corpus, args.size)
+    print(json.dumps([bench(name, pages, args.rounds) for name in ("bs", "lxml")], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Compare the recall and the latency of the ivf and hnsw index types of FaissStorage against the flat baseline.
+
+The vectors are either clustered random vectors (--data synthetic), or the local hashing embeddings of chunks of the
+synthetic mock corpus (--data corpus). Queries are searched one at a time, like FaissStorage does, and recall@k is
+the overlap of the top k with the exact top k of the flat index.
+
+    python benchmarks/bench_faiss_index.py --sizes 10000 100000 --nprobe 8 16 32 --ef-search 32 64 128
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import quote_plus
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_researcher.memory.embeddings import HashingEmbeddings
+from insight_researcher.memory.faiss_index import FaissIndexBuilder
+from insight_researcher.tools.mock_corpus import SyntheticCorpus
+
+
+def synthetic_vectors(n, dim, clusters, noise, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=n)] + noise * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def corpus_vectors(n, dim, seed):
+    corpus = SyntheticCorpus(seed=seed, page_size=4000)
+    embeddings = HashingEmbeddings(dimension=dim)
+    texts = []
+    page = 0
+    while len(texts) < n:
+        query = f"topic {page % 50} market research"
+        text = corpus.page(f"{SyntheticCorpus.BASE_URL}/search/{quote_plus(query)}/{page}")
+        texts.extend(text[i:i + 1000] for i in range(0, len(text), 900))
+        page += 1
+    return np.asarray(embeddings.embed_documents(texts[:n]), dtype=np.float32)
+
+
+def search_one_by_one(index, queries, k):
+    latencies = []
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.asarray(latencies) * 1000
+    return ids, {"mean_ms": round(float(latencies.mean()), 4), "p99_ms": round(float(np.percentile(latencies, 99)), 4)}
+
+
+def recall(ids, truth):
+    return round(float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids, truth)])), 4)
+
+
+def bench_size(vectors, queries, args):
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    truth, latency = search_one_by_one(flat, queries, args.k)
+    results = [dict(index_type="flat", build_seconds=0.0, recall=1.0, **latency)]
+
+    cases = [("ivf", {"ivf_nprobe": nprobe}) for nprobe in args.nprobe]
+    cases += [("hnsw", {"hnsw_ef_search": ef_search, "hnsw_m": args.hnsw_m}) for ef_search in args.ef_search]
+    built = {}
+    for index_type, params in cases:
+        builder = FaissIndexBuilder(index_type, ivf_min_train_size=0, **params)
+        # the search parameters do not change the index, build each type once
+        key = (index_type, params.get("hnsw_m"))
+        if key not in built:
+            start = time.perf_counter()
+            built[key] = (builder.build(flat, index_type), time.perf_counter() - start)
+        index, build_seconds = built[key]
+        builder.configure(index)
+        ids, latency = search_one_by_one(index, queries, args.k)
+        results.append(dict(index_type=index_type, **params, build_seconds=round(build_seconds, 3),
+                            recall=recall(ids, truth), **latency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 50000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--data", choices=["synthetic", "corpus"], default="synthetic")
+    parser.add_argument("--clusters", type=int, default=200, help="clusters of the synthetic vectors")
+    parser.add_argument("--noise", type=float, default=1.0, help="spread of the synthetic clusters")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[8, 16, 32])
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[32, 64, 128])
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # FaissStorage searches one query at a time under its lock
+    output = []
+    for size in args.sizes:
+        if args.data == "corpus":
+            data = corpus_vectors(size + args.queries, args.dim, args.seed)
+        else:
+            data = synthetic_vectors(size + args.queries, args.dim, args.clusters, args.noise,
+                                     args.seed)
+        vectors, queries = data[:size], data[size:]
+        for result in bench_size(vectors, queries, args):
+            result["size"] = size
+            output.append(result)
+            print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
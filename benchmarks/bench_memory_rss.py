@@ -0,0 +1,132 @@
+"""
+Peak and retained RSS of a long-lived process running many research tasks, like the research server.
+
+Every task gets its own Memory, ingests the synthetic mock corpus pages of a few sub-queries with the local hashing
+embeddings, searches its chunks and logs the chat messages of its LLM calls with a large research context each.
+The tasks run in waves of --concurrency at once, and the RSS is sampled after every wave.
+
+The "compact" mode is the current Memory: compressed page store, chunks kept by reference to their page, capped
+message log, and release() when a task ends. The "legacy" mode puts back the previous layout on the same code:
+plain dict of the pages, InMemoryDocstore holding a copy of every chunk, unbounded message list and no release,
+the task is only dropped. Each mode runs in a fresh process.
+
+    python benchmarks/bench_memory_rss.py --tasks 16 --concurrency 4 --pages 100 --page-size 20000
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ["compact", "legacy"]
+
+
+def max_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except OSError:
+        return None
+
+
+def use_legacy_layout(memory):
+    from langchain.docstore.in_memory import InMemoryDocstore
+    from insight_researcher.memory import faiss_storage
+    faiss_storage.ChunkDocstore = lambda pages, _dict=None: InMemoryDocstore(_dict)
+    memory.context = {}
+    memory.messages = []
+    memory.faiss_storage.pages = memory.context
+
+
+def run_task(task, args, corpus, cfg):
+    from insight_researcher.memory import Memory
+    from insight_researcher.tools.mock_corpus import SyntheticCorpus
+    memory = Memory(cfg, f"bench_rss_{os.getpid()}_{task}")
+    if args.mode == "legacy":
+        use_legacy_layout(memory)
+    queries = [f"topic {task} aspect {i}" for i in range(max(1, args.pages // args.pages_per_query))]
+    for query in queries:
+        urls = [f"{SyntheticCorpus.BASE_URL}/search/{task}-{query.replace(' ', '-')}/{i}"
+                for i in range(args.pages_per_query)]
+        new_urls = memory.get_new_urls(urls)
+        pages = [{"url": url, "raw_content": corpus.page(url)} for url in new_urls]
+        memory.add_memory(pages)
+        docs = memory.get_similar_docs_by_query(query, pages)
+        context = "\n".join(doc.page_content for doc in memory.retrieve_memory_docs(query) + docs)
+        # the prompt of every LLM call carries the research context
+        memory.add_messages([{"role": "system", "content": "You are a research assistant."},
+                             {"role": "user", "content": (context * args.context_repeat)[:args.prompt_chars]},
+                             {"role": "assistant", "content": "x" * 2000}])
+    if args.mode == "compact":
+        memory.release()
+
+
+def run_mode(args):
+    os.environ.update({"EMBEDDING_BACKEND": "local", "LOCAL_EMBEDDING_DIM": str(args.dim),
+                       "MEMORY_PERSIST": "false", "KNOWLEDGE_BASE": "false", "SIMILARITY_THRESHOLD": "0.3",
+                       "EMBEDDING_CACHE": "false"})
+    from insight_researcher.config import Config
+    from insight_researcher.tools.mock_corpus import SyntheticCorpus
+    cfg = Config()
+    corpus = SyntheticCorpus(seed=args.seed, page_size=args.page_size)
+    gc.collect()
+    result = {"mode": args.mode, "rss_after_import_mb": current_rss_mb(), "rss_after_wave_mb": []}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for wave in range(0, args.tasks, args.concurrency):
+            list(executor.map(lambda task: run_task(task, args, corpus, cfg),
+                              range(wave, min(args.tasks, wave + args.concurrency))))
+            gc.collect()
+            result["rss_after_wave_mb"].append(current_rss_mb())
+    result.update(seconds=round(time.perf_counter() - start, 2), peak_rss_mb=max_rss_mb(),
+                  retained_rss_mb=current_rss_mb())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=MODES, help="run one mode in this process, all of them in subprocesses "
+                                                      "if omitted")
+    parser.add_argument("--tasks", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4, help="tasks running at once")
+    parser.add_argument("--pages", type=int, default=100, help="pages per task")
+    parser.add_argument("--pages-per-query", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=20000, help="characters per page")
+    parser.add_argument("--prompt-chars", type=int, default=30000, help="characters of the context of a prompt")
+    parser.add_argument("--context-repeat", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+    output = []
+    argv = [f"--{key.replace('_', '-')}={value}" for key, value in vars(args).items()
+            if key not in ("mode", "output")]
+    for mode in MODES:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode] + argv,
+                              capture_output=True, text=True, check=True)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        output.append(result)
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
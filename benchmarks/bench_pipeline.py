@@ -0,0 +1,281 @@
+"""
+End-to-end offline benchmark of the research pipeline: Agent runs the outline and the full report flows against a
+fake retriever, a local HTTP server serving a generated page corpus, the local hashing embeddings and MockLLM.
+
+Every case of the sweep runs in a fresh process, so the peak RSS, the caches and the FAISS index of one case do not
+leak into the next one. Stage times are summed over all the calls of the stage, so a stage that runs on several
+threads can add up to more than the wall time.
+
+    python benchmarks/bench_pipeline.py --sub-queries 2 4 8 --pages 5 10 --chapters 3 9 --output bench.json
+
+Compare two commits by running the same sweep on both and diffing the "median" entries of the JSON files.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_researcher import Agent
+from insight_researcher.llm.mock_provider import MockLLM
+from local_server import LocalCorpusServer
+
+WORDS = ("market growth revenue agent model data risk investment platform adoption enterprise customer "
+         "technology research regulation competition startup funding workflow automation benchmark cost").split()
+
+
+def make_corpus_page(query, index, paragraphs=20, seed=0):
+    """
+    Deterministic HTML page about the query: every paragraph mixes the query words with random filler words
+    """
+    rng = random.Random(f"{seed}-{query}-{index}")
+    terms = query.split()
+    body = []
+    for i in range(paragraphs):
+        sentence = " ".join(rng.choice(terms if rng.random() < 0.3 else WORDS) for _ in range(80))
+        body.append(f"<p>{sentence}.</p>")
+    return (f"<html><head><title>{query} {index}</title></head><body><nav><a href='/'>home</a></nav>"
+            f"<h1>{query} {index}</h1>{''.join(body)}<footer>footer</footer></body></html>").encode("utf-8")
+
+
+class BenchMockLLM(MockLLM):
+    """
+    MockLLM with the number of sub queries and outline chapters given by the benchmark case
+    """
+
+    def __init__(self, sub_queries, chapters):
+        self.sub_queries = sub_queries
+        self.chapters = chapters
+
+    def get_sub_queries(self, query=None, agent_role_prompt=None):
+        return [f"{query} aspect {i}" for i in range(self.sub_queries)]
+
+    def generate_outline(self, query=None, agent_role_prompt=None, websocket=None):
+        lines = [f"# {query} report", ""]
+        for i in range(self.chapters):
+            section, leaf = divmod(i, 3)
+            if leaf == 0:
+                lines += ["", f"## {section + 1}. {query} part {section + 1}"]
+            lines += [f"### {section + 1}.{leaf + 1} {query} chapter {i}", f"{query} chapter {i} details"]
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """
+    Sums the seconds and counts the calls of the wrapped methods by stage, the methods may run on many threads
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += seconds
+            total["calls"] += 1
+
+    def wrap(self, obj, name, stage):
+        func = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        setattr(obj, name, timed)
+        return obj
+
+    def report(self):
+        return {stage: {"seconds": round(total["seconds"], 4), "calls": total["calls"]}
+                for stage, total in sorted(self.stages.items())}
+
+
+def make_retriever(server, timer, paragraphs, search_latency, seed):
+    """
+    Retriever class stand-in: search results point at pages of the local server, generated for the query
+    """
+
+    class CorpusRetriever:
+        def __init__(self, query):
+            self.query = query
+
+        def search(self, max_results=5):
+            if search_latency:
+                time.sleep(search_latency)
+            slug = hashlib.md5(self.query.encode("utf-8")).hexdigest()[:8]
+            results = []
+            for i in range(max_results):
+                path = f"/page/{slug}-{i}"
+                server.pages.setdefault(path, make_corpus_page(self.query, i, paragraphs, seed))
+                results.append({"href": server.url(path), "body": ""})
+            return results
+
+    return lambda query: timer.wrap(CorpusRetriever(query), "search", "search")
+
+
+def max_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(case):
+    """
+    Run one benchmark case in this process
+    Args:
+        case: dict of report_type, sub_queries, pages, chapters, paragraphs, latency, search_latency, seed
+
+    Returns: metrics of the case
+    """
+    rss_after_import = max_rss_mb()
+    timer = StageTimer()
+    with LocalCorpusServer(latency=case["latency"]) as server:
+        agent = Agent(f"benchmark query {case['seed']}", report_type=case["report_type"])
+        agent.llm.mock_llm = BenchMockLLM(case["sub_queries"], case["chapters"])
+        agent.tool.retriever = make_retriever(server, timer, case["paragraphs"], case["search_latency"],
+                                              case["seed"])
+        memory = agent.memory
+        for obj, name, stage in [(agent.llm, "choose_agent", "choose_agent"),
+                                 (agent.llm, "get_sub_queries", "sub_queries"),
+                                 (agent.tool, "scrape_sites_by_query", "research"),
+                                 (memory, "add_memory", "ingest"),
+                                 (memory, "add_memory_stream", "ingest"),
+                                 (memory.embeddings, "embed_documents", "embed"),
+                                 (memory.embeddings, "embed_query", "embed"),
+                                 (memory, "get_similar_docs_by_query", "relevance"),
+                                 (memory, "retrieve_memory_docs", "relevance"),
+                                 (memory, "pack_context", "pack_context"),
+                                 (agent.llm, "generate_outline", "outline_llm"),
+                                 (agent.llm, "generate_chapter", "chapter_llm")]:
+            timer.wrap(obj, name, stage)
+
+        # the phases of Agent.run, without writing the report files
+        start = time.perf_counter()
+        agent.agent, agent.role = agent.llm.choose_agent(agent.query)
+        outline = agent.generate_outline()
+        outline_seconds = time.perf_counter() - start
+        report, report_seconds = outline, 0.0
+        if case["report_type"] == "full_report":
+            report_start = time.perf_counter()
+            report = agent.generate_report(outline)
+            report_seconds = time.perf_counter() - report_start
+        wall = time.perf_counter() - start
+        pages = server.requests
+
+    store = memory.faiss_storage.store
+    chunks = store.index.ntotal if store is not None else 0
+    embed_seconds = timer.stages.get("embed", {}).get("seconds", 0.0)
+    return {
+        "wall_seconds": round(wall, 4),
+        "outline_seconds": round(outline_seconds, 4),
+        "report_seconds": round(report_seconds, 4),
+        "stages": timer.report(),
+        "pages": pages,
+        "chunks": chunks,
+        "report_chars": len(report),
+        "pages_per_sec": round(pages / wall, 2) if wall else None,
+        "chunks_per_embed_sec": round(chunks / embed_seconds, 1) if embed_seconds else None,
+        "rss_after_import_mb": rss_after_import,
+        "peak_rss_mb": max_rss_mb(),
+    }
+
+
+def run_case_in_subprocess(case, args):
+    env = dict(os.environ)
+    env.update({
+        "MOCK_LLM": "true",
+        "EMBEDDING_BACKEND": "local",
+        "PAGE_CACHE": "false",
+        "SEARCH_CACHE": "false",
+        "MAX_SEARCH_RESULTS_PER_QUERY": str(case["pages"]),
+        "SIMILARITY_THRESHOLD": str(args.similarity_threshold),
+    })
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env["CACHE_DIR"] = cache_dir
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                              env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"benchmark case {case} failed:\n{proc.stderr[-2000:]}")
+    if args.verbose:
+        sys.stderr.write(proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs):
+    summary = {key: statistics.median(run[key] for run in runs)
+               for key in ("wall_seconds", "outline_seconds", "report_seconds", "peak_rss_mb")}
+    summary["stages"] = {stage: round(statistics.median(run["stages"].get(stage, {}).get("seconds", 0.0)
+                                                        for run in runs), 4)
+                         for stage in runs[0]["stages"]}
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--report-type", nargs="+", default=["outline_report", "full_report"],
+                        choices=["outline_report", "full_report"])
+    parser.add_argument("--sub-queries", nargs="+", type=int, default=[3])
+    parser.add_argument("--pages", nargs="+", type=int, default=[5], help="search results (pages) per query")
+    parser.add_argument("--chapters", nargs="+", type=int, default=[9], help="outline leaves of the full report")
+    parser.add_argument("--paragraphs", type=int, default=20, help="paragraphs per page")
+    parser.add_argument("--latency", type=float, default=0.02, help="server side latency per page in seconds")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="latency per search in seconds")
+    parser.add_argument("--similarity-threshold", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the benchmark runs")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    results = []
+    for report_type, sub_queries, pages, chapters in itertools.product(args.report_type, args.sub_queries,
+                                                                       args.pages, args.chapters):
+        if report_type == "outline_report":
+            if chapters != args.chapters[0]:
+                continue  # the outline flow does not depend on the chapters
+            chapters = 0
+        case = {"report_type": report_type, "sub_queries": sub_queries, "pages": pages, "chapters": chapters,
+                "paragraphs": args.paragraphs, "latency": args.latency, "search_latency": args.search_latency,
+                "seed": args.seed}
+        runs = [run_case_in_subprocess(case, args) for _ in range(args.repeat)]
+        result = {"case": case, "median": summarize(runs), "runs": runs}
+        results.append(result)
+        print(f"{report_type:15s} sub_queries={sub_queries:<3d} pages={pages:<3d} chapters={chapters:<3d} "
+              f"wall={result['median']['wall_seconds']:.3f}s peak_rss={result['median']['peak_rss_mb']}MB")
+
+    output = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "results": results}
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(output, file, indent=2, ensure_ascii=False)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare the pages/sec of the thread pool and the asyncio scraping engines against a local HTTP server.
+
+    python benchmarks/bench_scraper.py --pages 200 --latency 0.05 --concurrency 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from insight_researcher.config import Config
+from insight_researcher.tools.scraper import Scraper
+from local_server import LocalCorpusServer
+
+
+def bench(engine, urls, concurrency, per_host, rounds):
+    cfg = Config()
+    cfg.scraper_engine = engine
+    cfg.scraper_max_connections = concurrency
+    cfg.scraper_max_per_host = per_host
+    cfg.scraper_timeout = 30
+    cfg.page_cache = False
+    scraper = Scraper(cfg)
+    scraper.run(urls[:1])  # warm up connections and the engine loop
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        results = scraper.run(urls)
+        elapsed = time.perf_counter() - start
+        ok = sum(1 for result in results if result["raw_content"])
+        best = elapsed if best is None else min(best, elapsed)
+    if scraper.engine is not None:
+        scraper.engine.close()
+    return {"engine": engine, "pages": len(urls), "ok": ok, "seconds": round(best, 3),
+            "pages_per_sec": round(len(urls) / best, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="server side latency per request in seconds")
+    parser.add_argument("--concurrency", type=int, default=20, help="thread pool size / global in-flight limit")
+    parser.add_argument("--per-host", type=int, default=20, help="per host limit of the async engine")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with LocalCorpusServer(latency=args.latency) as server:
+        urls = [server.url(f"/page/{i}") for i in range(args.pages)]
+        results = [bench(engine, urls, args.concurrency, args.per_host, args.rounds) for engine in ("thread", "async")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
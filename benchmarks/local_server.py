@@ -0,0 +1,63 @@
+"""
+Local HTTP server serving a fixed page corpus, used by the benchmarks instead of the live web
+"""
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def make_page(index, paragraphs=20):
+    body = "".join(f"<p>Paragraph {i} of page {index}. " + "Insight researcher benchmark sentence. " * 12 + "</p>"
+                   for i in range(paragraphs))
+    return (f"<html><head><title>Page {index}</title><style>p {{margin: 0}}</style></head>"
+            f"<body><nav><a href='/'>home</a></nav><h1>Page {index}</h1>{body}<footer>footer</footer></body></html>"
+            ).encode("utf-8")
+
+
+class LocalCorpusServer:
+    """
+    Serves /page/<n> from an in-memory corpus over keep-alive HTTP/1.1, with an optional per-request latency
+    """
+    def __init__(self, pages=None, latency=0.0):
+        self.pages = pages if pages is not None else {}
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                body = server.pages.get(self.path)
+                if body is None:
+                    index = self.path.rsplit("/", 1)[-1]
+                    body = make_page(index)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
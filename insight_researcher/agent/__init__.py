@@ -1,3 +1,4 @@
 from .agent import Agent
+from .resources import SharedResources
 
-__all__ = ['Agent']
\ No newline at end of file
+__all__ = ['Agent', 'SharedResources']
\ No newline at end of file
@@ -1,27 +1,55 @@
+import asyncio
+import re
 from insight_researcher.config import Config
 from insight_researcher.llm import LLM
 from insight_researcher.memory import Memory
 from insight_researcher.tools import Tool
 from markdown_to_json import dictify
 from collections import OrderedDict
-from insight_researcher import log, cur_timestamp, write_report_to_file
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from insight_researcher import log, write_report_to_file
+from insight_researcher.utils import tracer, new_task_id, EventEmitter
 
 
 class Agent:
     """
     Insight Researcher
     """
+    # what may precede a leaf on its line in the outline: indentation and a list marker
+    _LEAF_PREFIX = re.compile(r"\s*(?:#+|[-*+]|\d+[.)])?\s*")
 
-    def __init__(self, query, report_type="full_report"):
-        self.task_id = cur_timestamp
+    def __init__(self, query, report_type="full_report", task_id=None, resources=None, websocket=None,
+                 on_event=None):
+        """
+        Args:
+            query: research query
+            report_type: outline_report or full_report
+            task_id: unique id of the task, names the report and trace files, generated if None
+            resources: SharedResources shared with other tasks, e.g. by the research server, built per task if None
+            websocket: the events of the task are sent to it with send_json(Event.to_dict()), if not None
+            on_event: callable receiving every Event of the task, see EVENT_TYPES, if not None
+        """
+        self.task_id = task_id or new_task_id()
         self.query = query
         self.report_type = report_type
         self.agent = None
         self.role = None
-        self.cfg = Config()
-        self.memory = Memory(self.cfg, self.task_id)
-        self.tool = Tool(self.cfg, self.memory)
-        self.llm = LLM(self.cfg, self.memory)
+        self.events = EventEmitter(self.task_id, sinks=[websocket, on_event])
+        self._trace_id = None
+        if resources is not None:
+            self.cfg = resources.cfg
+            self.memory = Memory(self.cfg, self.task_id, embeddings=resources.embeddings,
+                                 knowledge_base=resources.knowledge_base, events=self.events)
+            self.tool = Tool(self.cfg, self.memory, retriever=resources.retriever, scraper=resources.scraper,
+                             url_registry=resources.url_registry, events=self.events)
+            self.llm = LLM(self.cfg, self.memory, response_cache=resources.response_cache, events=self.events)
+        else:
+            self.cfg = Config()
+            self.memory = Memory(self.cfg, self.task_id, events=self.events)
+            self.tool = Tool(self.cfg, self.memory, events=self.events)
+            self.llm = LLM(self.cfg, self.memory, events=self.events)
+        tracer.configure(self.cfg.tracing)
 
     def run(self):
         """
@@ -29,15 +57,59 @@ class Agent:
         Returns:
             Report
         """
-        if self.report_type not in ['outline_report', 'full_report']:
-            raise ValueError(
-                f"unsupported report_type: {self.report_type}, report_type must be one of ['outline_report', 'full_report']")
+        try:
+            if self.report_type not in ['outline_report', 'full_report']:
+                raise ValueError(f"unsupported report_type: {self.report_type}, "
+                                 f"report_type must be one of ['outline_report', 'full_report']")
+            with tracer.span("agent.run", task_id=self.task_id, query=self.query,
+                             report_type=self.report_type) as span:
+                self._trace_id = span.trace_id
+                report = self._run()
+            self.events.emit("result", output=report)
+            return report
+        except Exception as e:
+            self.events.emit("error", output=str(e))
+            raise
+        finally:
+            self.memory.persist()
+            self._export_trace()
+            # a long-lived process runs many tasks, do not wait for the garbage collector to free this one
+            self.memory.release()
+
+    async def stream(self):
+        """
+        Runs the Insight Researcher in a worker thread and yields its events as they happen
+        Returns:
+            async iterator of Event, ending with the "result" or the "error" event
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def sink(event):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        self.events.add_sink(sink)
+        future = loop.run_in_executor(None, self.run)
+        try:
+            while True:
+                event = await queue.get()
+                yield event
+                if event.type in ("result", "error"):
+                    break
+            # the error was sent as the last event
+            await asyncio.wait([future])
+            future.exception()
+        finally:
+            self.events.remove_sink(sink)
 
-        task_id = cur_timestamp
+    def _run(self):
         log.info(f"🔎 Running research for '{self.query}'...")
         # Generate Agent
-        self.agent, self.role = self.llm.choose_agent(self.query)
+        with tracer.span("agent.choose_agent") as span:
+            self.agent, self.role = self.llm.choose_agent(self.query)
+            span.set(agent=self.agent)
         log.info(f'{self.agent}\n{self.role}')
+        self._send_progress(f"{self.agent} is researching '{self.query}'")
 
         outline = self.generate_outline()
         log.debug(f"Finished writing outline...\n{outline}")
@@ -49,26 +121,66 @@ class Agent:
         write_report_to_file(self.task_id, report)
         return report
 
+    def _export_trace(self):
+        if not self.cfg.tracing:
+            return
+        suffix = "json" if self.cfg.trace_format == "chrome" else "jsonl"
+        path = Path(self.cfg.trace_dir) / f"{self.task_id}.{suffix}"
+        try:
+            # other tasks of the process may be tracing concurrently, only export the spans of this one
+            count = tracer.export(path, self.cfg.trace_format, trace_id=self._trace_id)
+            log.info(f"Exported {count} trace spans to {path}")
+        except Exception as e:
+            log.error(f"Error in exporting trace: {e}")
+
+    def _send_progress(self, message):
+        self.events.emit("logs", output=message)
+
     def generate_outline(self):
         """
         generate outline
         Returns: outline
         """
         # Generate Sub-Queries including original query
-        sub_queries = self.llm.get_sub_queries(self.query, self.role) + [self.query]
+        with tracer.span("agent.sub_queries") as span:
+            sub_queries = self.llm.get_sub_queries(self.query, self.role) + [self.query]
+            span.set(count=len(sub_queries))
         log.info(f"🧠 I will conduct my research based on the following queries: {sub_queries}...")
-        context = []
-        # Run Sub-Queries
-        for sub_query in sub_queries:
-            log.info(f"🔎 Running research for '{sub_query}'...")
-            scraped_sites = self.tool.scrape_sites_by_query(sub_query)
-            similar_contents = self.memory.get_similar_content_by_query(sub_query, scraped_sites)
-            context.append(similar_contents)
+        self.events.emit("sub_queries", queries=sub_queries)
+        self._send_progress(f"🧠 I will conduct my research based on the following queries: {sub_queries}...")
+        # Run Sub-Queries concurrently, executor.map keeps the contexts in sub-query order
+        with ThreadPoolExecutor(max_workers=max(1, self.cfg.research_concurrency)) as executor:
+            query_docs = list(zip(sub_queries, executor.map(tracer.propagate(self._research_sub_query),
+                                                          sub_queries)))
+        # dedupe the chunks shared by sub-queries and keep the prompt within the model's context window
+        context = self.memory.pack_context(query_docs, self.llm.get_context_token_budget(self.cfg.smart_llm_model),
+                                           self.cfg.smart_llm_model)
         log.info(f"✍️ Writing report for research task: {self.query}...")
-        outline = self.llm.generate_outline(query=self.query, agent_role_prompt=self.role, context="\n".join(context))
+        self._send_progress(f"✍️ Writing outline for research task: {self.query}...")
+        with tracer.span("agent.write_outline", context_chars=len(context)):
+            outline = self.llm.generate_outline(query=self.query, agent_role_prompt=self.role, context=context)
         log.warning(f"Total running cost for outline: ${self.llm.get_total_cost():.3f}")
+        self._log_embedding_stats()
         return outline
 
+    def _research_sub_query(self, sub_query):
+        """
+        search and scrape the sub query, then pick the contents similar to it
+        Args:
+            sub_query: one of the sub queries generated by llm
+
+        Returns: chunks similar to the sub query
+        """
+        log.info(f"🔎 Running research for '{sub_query}'...")
+        self._send_progress(f"🔎 Running research for '{sub_query}'...")
+        with tracer.span("agent.research", query=sub_query) as span:
+            scraped_sites = self.tool.scrape_sites_by_query(sub_query)
+            with tracer.span("memory.relevance", pages=len(scraped_sites)) as relevance_span:
+                docs = self.memory.get_similar_docs_by_query(sub_query, scraped_sites)
+                relevance_span.set(chunks=len(docs))
+            span.set(pages=len(scraped_sites), chunks=len(docs))
+        return docs
+
     def generate_report(self, outline):
         """
         generate full report based on the outline
@@ -78,18 +190,107 @@ class Agent:
         Returns: full long report
         """
         leaf_chapters = self._get_outline_leaves(outline)
-        report = outline
-        for chapter, query in leaf_chapters.items():
-            log.info(f"🔎 Running research for '{chapter}\n{query}'...")
-            self.tool.scrape_sites_by_query(query)
-            context = self.memory.retrieve_memory(query)
-            log.info(f"✍️ Writing content for chapter: {chapter}\n{query}...")
-            chapter_content = self.llm.generate_chapter(chapter=chapter, query=query, agent_role_prompt=self.role,
-                                                        context=context)
-            report = report.replace(query, chapter_content)
+        chapters, queries = list(leaf_chapters.keys()), list(leaf_chapters.values())
+        # Research and write the chapters concurrently, then stitch them into the outline in one pass
+        with ThreadPoolExecutor(max_workers=max(1, self.cfg.chapter_concurrency)) as executor:
+            chapter_contents = list(executor.map(tracer.propagate(self._write_chapter), chapters, queries))
+        report = self._assemble_report(outline, queries, chapter_contents)
         log.warning(f"Total running cost for full report: ${self.llm.get_total_cost():.3f}")
+        self._log_embedding_stats()
         return report
 
+    def _log_embedding_stats(self):
+        stats = self.memory.get_embedding_cache_stats()
+        if stats is not None:
+            log.info(f"Embedding cache hits: {stats['hits']}, misses: {stats['misses']}, "
+                     f"hit rate: {stats['hit_rate']:.1%}")
+        metrics = self.memory.get_embedding_metrics()
+        if metrics is not None:
+            log.info(f"Embedding requests: {metrics['requests']}, texts: {metrics['texts']}, "
+                     f"tokens: {metrics['tokens']}, {metrics['texts_per_sec']:.1f} texts/s, "
+                     f"{metrics['tokens_per_sec']:.0f} tokens/s, "
+                     f"rate limit wait: {metrics['rate_limit_wait_seconds']:.1f}s")
+        stats = self.memory.get_near_duplicate_stats()
+        if stats is not None:
+            log.info(f"Near duplicate chunks dropped: {stats['dropped']} of {stats['checked']} "
+                     f"({stats['drop_rate']:.1%}, {stats['dropped_chars']} chars)")
+        if self.tool.url_registry is not None:
+            stats = self.tool.url_registry.stats()
+            log.info(f"Url registry urls: {stats['urls']}, failing: {stats['failing']}, skipped: {stats['skipped']}")
+        if self.memory.knowledge_base is not None:
+            stats = self.memory.knowledge_base.stats()
+            log.info(f"Knowledge base sources: {stats['sources']}, chunks: {stats['chunks']}, "
+                     f"served sources: {stats['served_sources']}, reused vectors: {stats['reused_vectors']}")
+
+    def _write_chapter(self, chapter, query):
+        """
+        research the chapter query and write the chapter content
+        Args:
+            chapter: chapter path of the outline leaf, e.g. "title - 1. xxx - 1.1 xxx"
+            query: the leaf text of the outline, used as search query of the chapter
+
+        Returns: chapter content
+        """
+        log.info(f"🔎 Running research for '{chapter}\n{query}'...")
+        with tracer.span("agent.chapter", chapter=chapter):
+            self.tool.scrape_sites_by_query(query)
+            context = self.memory.pack_context([(query, self.memory.retrieve_memory_docs(query))],
+                                               self.llm.get_context_token_budget(self.cfg.fast_llm_model),
+                                               self.cfg.fast_llm_model)
+            log.info(f"✍️ Writing content for chapter: {chapter}\n{query}...")
+            self._send_progress(f"✍️ Writing content for chapter: {chapter}...")
+            # chapters written concurrently interleave their tokens, every chapter_token event names its chapter
+            with tracer.span("agent.write_chapter", context_chars=len(context)) as span:
+                content = self.llm.generate_chapter(chapter=chapter, query=query, agent_role_prompt=self.role,
+                                                    context=context)
+                span.set(chars=len(content))
+            self.events.emit("chapter", chapter=chapter, output=content)
+            return content
+
+    @staticmethod
+    def _assemble_report(outline, queries, chapter_contents):
+        """
+        replace each outline leaf with its chapter content in a single scan of the outline
+        Args:
+            outline: Markdown formatted outline
+            queries: outline leaves in document order
+            chapter_contents: chapter contents in the same order as queries
+
+        Returns: full report
+        """
+        parts = []
+        missing = []
+        pos = 0
+        for query, content in zip(queries, chapter_contents):
+            idx = Agent._find_leaf(outline, query, pos)
+            if idx < 0:
+                log.warning(f"Chapter query not found at the start of an outline line: {query}")
+                missing.append(content)
+                continue
+            parts.append(outline[pos:idx])
+            parts.append(content)
+            pos = idx + len(query)
+        parts.append(outline[pos:])
+        if missing:
+            # the chapters are written and paid for, keep them even if their leaf is not found
+            log.warning(f"{len(missing)} chapter queries not found in outline, append their chapters to the report")
+            parts.extend("\n\n" + content for content in missing)
+        return "".join(parts)
+
+    @staticmethod
+    def _find_leaf(outline, query, pos):
+        """
+        Returns: index of the leaf text at or after pos, -1 if not found
+        """
+        idx = outline.find(query, pos)
+        # 叶子节点文本位于行首（可带缩进、标题或列表符号），跳过恰好出现在其他行中间的同名文本
+        while idx >= 0:
+            line_start = outline.rfind("\n", 0, idx) + 1
+            if Agent._LEAF_PREFIX.fullmatch(outline, line_start, idx):
+                return idx
+            idx = outline.find(query, idx + 1)
+        return -1
+
     def _get_leaf_key_values(self, json_obj, current_path='', result=None):
         if result is None:
             result = OrderedDict()
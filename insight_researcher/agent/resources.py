@@ -0,0 +1,35 @@
+from insight_researcher.config import Config
+from insight_researcher.llm import get_response_cache
+from insight_researcher.memory import get_embeddings, get_knowledge_base
+from insight_researcher.tools import get_tool_retriever, get_tool_scraper, get_url_registry
+
+
+class SharedResources:
+    """
+    The long-lived parts of an Agent that do not depend on the task, built once and shared by concurrent tasks:
+    the config, the embeddings with their cache, executor and rate limits, the retriever with the search cache,
+    the scraper with its connection pools and page cache, the LLM response cache, the knowledge base and the url registry.
+    Memory, Tool and LLM stay per task, they hold the task's documents, vectors and costs.
+    """
+
+    def __init__(self, cfg=None):
+        """
+        Args:
+            cfg: config shared by the tasks, Config() if None
+        """
+        self.cfg = cfg if cfg is not None else Config()
+        self.embeddings = get_embeddings(self.cfg)
+        self.retriever = get_tool_retriever(self.cfg)
+        self.scraper = get_tool_scraper(self.cfg)
+        self.response_cache = get_response_cache(self.cfg)
+        self.knowledge_base = get_knowledge_base(self.cfg, self.embeddings)
+        self.url_registry = get_url_registry(self.cfg)
+
+    def close(self):
+        engine = getattr(self.scraper, "engine", None)
+        if engine is not None:
+            engine.close()
+        if self.knowledge_base is not None:
+            self.knowledge_base.close()
+        if self.url_registry is not None:
+            self.url_registry.close()
@@ -1,5 +1,6 @@
 import os
 from dotenv import load_dotenv
+from insight_researcher.utils.logs import PROJECT_ROOT
 load_dotenv()
 
 
@@ -21,7 +22,82 @@ class Config:
                                                   "(KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0")
         self.max_search_results_per_query = int(os.getenv('MAX_SEARCH_RESULTS_PER_QUERY', 5))
         self.memory_backend = os.getenv('MEMORY_BACKEND', "local")
+        # append the chunks of a task to mem/<task_id>/ as they are added, and checkpoint the index at the end
+        self.memory_persist = True if 'true' == os.getenv('MEMORY_PERSIST', 'False').lower() else False
+        # corpus shared by all the tasks, chunks deduplicated by content hash, sources re-fetched once stale
+        self.knowledge_base = True if 'true' == os.getenv('KNOWLEDGE_BASE', 'False').lower() else False
+        self.knowledge_base_dir = os.getenv('KNOWLEDGE_BASE_DIR', str(PROJECT_ROOT / "knowledge_base"))
+        self.knowledge_base_ttl = int(os.getenv('KNOWLEDGE_BASE_TTL', 7 * 24 * 3600))
+        # fresh sources similar to a query needed to answer it without searching the web
+        self.knowledge_base_min_sources = int(os.getenv('KNOWLEDGE_BASE_MIN_SOURCES', 3))
+        # compressed page contents kept in RAM per task, the oldest pages are spilled to mem/<task_id>/ beyond it
+        self.page_store_max_mb = int(os.getenv('PAGE_STORE_MAX_MB', 64))
+        self.message_log_max_chars = int(os.getenv('MESSAGE_LOG_MAX_CHARS', 100000))
         self.total_words = int(os.getenv('TOTAL_WORDS', 1000))
         self.report_format = os.getenv('REPORT_FORMAT', "APA")
         self.max_iterations = int(os.getenv('MAX_ITERATIONS', 3))
         self.mock_llm = True if 'true' == os.getenv('MOCK_LLM', 'False').lower() else False
+        self.mock_search = True if 'true' == os.getenv('MOCK_SEARCH', 'False').lower() else False
+        self.mock_scrape = True if 'true' == os.getenv('MOCK_SCRAPE', 'False').lower() else False
+        self.mock_seed = int(os.getenv('MOCK_SEED', 0))
+        self.mock_page_size = int(os.getenv('MOCK_PAGE_SIZE', 5000))  # characters per synthetic page
+        self.mock_search_results = int(os.getenv('MOCK_SEARCH_RESULTS', 0))  # 0 means max_search_results_per_query
+        self.mock_search_latency = float(os.getenv('MOCK_SEARCH_LATENCY', 0))
+        self.mock_scrape_latency = float(os.getenv('MOCK_SCRAPE_LATENCY', 0))
+        self.mock_latency_jitter = float(os.getenv('MOCK_LATENCY_JITTER', 0))
+        self.research_concurrency = int(os.getenv('RESEARCH_CONCURRENCY', 4))
+        self.chapter_concurrency = int(os.getenv('CHAPTER_CONCURRENCY', 4))
+        self.cache_dir = os.getenv('CACHE_DIR', str(PROJECT_ROOT / "cache"))
+        self.page_cache = True if 'true' == os.getenv('PAGE_CACHE', 'True').lower() else False
+        self.page_cache_ttl = int(os.getenv('PAGE_CACHE_TTL', 24 * 3600))
+        self.page_cache_max_mb = int(os.getenv('PAGE_CACHE_MAX_MB', 512))
+        self.embedding_cache = True if 'true' == os.getenv('EMBEDDING_CACHE', 'True').lower() else False
+        self.embedding_cache_max_mb = int(os.getenv('EMBEDDING_CACHE_MAX_MB', 1024))
+        self.embedding_backend = os.getenv('EMBEDDING_BACKEND', "openai")
+        self.local_embedding_dim = int(os.getenv('LOCAL_EMBEDDING_DIM', 512))
+        self.embedding_max_batch_size = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', 2048))
+        self.embedding_max_batch_tokens = int(os.getenv('EMBEDDING_MAX_BATCH_TOKENS', 100000))
+        self.embedding_concurrency = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+        self.embedding_rpm = int(os.getenv('EMBEDDING_RPM', 3000))  # 0 means no limit
+        self.embedding_tpm = int(os.getenv('EMBEDDING_TPM', 1000000))  # 0 means no limit
+        self.relevance_mode = os.getenv('RELEVANCE_MODE', "index")
+        self.faiss_index_type = os.getenv('FAISS_INDEX_TYPE', "flat")  # flat, ivf or hnsw
+        self.faiss_ivf_nlist = int(os.getenv('FAISS_IVF_NLIST', 0))  # 0 means 4 * sqrt(vectors)
+        self.faiss_ivf_nprobe = int(os.getenv('FAISS_IVF_NPROBE', 16))
+        self.faiss_ivf_min_train_size = int(os.getenv('FAISS_IVF_MIN_TRAIN_SIZE', 4096))
+        self.faiss_hnsw_m = int(os.getenv('FAISS_HNSW_M', 32))
+        self.faiss_hnsw_ef_construction = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', 80))
+        self.faiss_hnsw_ef_search = int(os.getenv('FAISS_HNSW_EF_SEARCH', 64))
+        # drop the chunks similar to a chunk seen before above this SimHash similarity, before embedding them
+        self.near_duplicate_filter = True if 'true' == os.getenv('NEAR_DUPLICATE_FILTER', 'True').lower() else False
+        self.near_duplicate_threshold = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.9))
+        self.similarity_threshold = float(os.getenv('SIMILARITY_THRESHOLD', 0.78))
+        # canonical urls fetched before and failing urls, shared by the tasks in cache_dir
+        self.url_registry = True if 'true' == os.getenv('URL_REGISTRY', 'True').lower() else False
+        self.url_max_failures = int(os.getenv('URL_MAX_FAILURES', 3))  # consecutive failures before skipping
+        self.url_failure_ttl = int(os.getenv('URL_FAILURE_TTL', 30 * 24 * 3600))
+        self.scraper_engine = os.getenv('SCRAPER_ENGINE', "async")
+        self.scraper_max_connections = int(os.getenv('SCRAPER_MAX_CONNECTIONS', 20))
+        self.scraper_max_per_host = int(os.getenv('SCRAPER_MAX_PER_HOST', 4))
+        self.scraper_timeout = float(os.getenv('SCRAPER_TIMEOUT', 4))
+        self.scraper_extractor = os.getenv('SCRAPER_EXTRACTOR', "lxml")
+        self.streaming_ingest = True if 'true' == os.getenv('STREAMING_INGEST', 'True').lower() else False
+        self.ingest_queue_size = int(os.getenv('INGEST_QUEUE_SIZE', 32))
+        self.embed_batch_size = int(os.getenv('EMBED_BATCH_SIZE', 64))
+        self.embed_flush_interval = float(os.getenv('EMBED_FLUSH_INTERVAL', 0.2))
+        self.context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 0))  # 0 means derived from TOKEN_MAX
+        self.prompt_reserved_tokens = int(os.getenv('PROMPT_RESERVED_TOKENS', 1000))
+        self.context_diversity = float(os.getenv('CONTEXT_DIVERSITY', 0.3))
+        self.llm_cache = True if 'true' == os.getenv('LLM_CACHE', 'False').lower() else False
+        self.llm_cache_ttl = int(os.getenv('LLM_CACHE_TTL', 0))  # 0 means never expire
+        self.search_cache = True if 'true' == os.getenv('SEARCH_CACHE', 'True').lower() else False
+        # per retriever ttl, e.g. SEARCH_CACHE_TTL_TAVILY, falls back to SEARCH_CACHE_TTL
+        self.search_cache_ttl = int(os.getenv(f'SEARCH_CACHE_TTL_{self.retriever.upper()}',
+                                              os.getenv('SEARCH_CACHE_TTL', 24 * 3600)))
+        self.tracing = True if 'true' == os.getenv('TRACING', 'False').lower() else False
+        self.trace_format = os.getenv('TRACE_FORMAT', "jsonl")  # jsonl or chrome
+        self.trace_dir = os.getenv('TRACE_DIR', str(PROJECT_ROOT / "traces"))
+        self.server_host = os.getenv('SERVER_HOST', "127.0.0.1")
+        self.server_port = int(os.getenv('SERVER_PORT', 8000))
+        self.server_max_jobs = int(os.getenv('SERVER_MAX_JOBS', 4))  # research jobs running at once
+        self.server_max_finished_jobs = int(os.getenv('SERVER_MAX_FINISHED_JOBS', 1000))  # kept for status queries
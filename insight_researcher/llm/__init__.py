@@ -1,3 +1,3 @@
-from .llm import LLM
+from .llm import LLM, get_response_cache
 
-__all__ = ['LLM']
\ No newline at end of file
+__all__ = ['LLM', 'get_response_cache']
\ No newline at end of file
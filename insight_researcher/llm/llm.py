@@ -1,18 +1,43 @@
 from .prompts import *
 import json
 from insight_researcher import log
+from insight_researcher.utils.events import EventEmitter
 from colorama import Fore, Style
 from .mock_provider import MockLLM
 from .openai_provider import OpenAIGPTAPI
+from .response_cache import ResponseCache
+from .token_counter import TOKEN_MAX
+
+
+def get_response_cache(cfg):
+    """
+    Returns: the LLM response cache configured by cfg, None if disabled
+    """
+    if cfg.llm_cache:
+        return ResponseCache(cfg.cache_dir, ttl=cfg.llm_cache_ttl or None)
+    return None
 
 
 class LLM:
-    def __init__(self, cfg, memory):
+    def __init__(self, cfg, memory, response_cache=None, events=None):
+        """
+        response_cache: response cache shared with other tasks, built from cfg if None
+        events: EventEmitter of the task, receives the outline and chapter tokens and the costs
+        """
         self.cfg = cfg
         self.mock_llm = MockLLM()
-        self.openai_llm = OpenAIGPTAPI(memory)
+        if response_cache is None:
+            response_cache = get_response_cache(cfg)
+        self.events = events if events is not None else EventEmitter()
+        self.openai_llm = OpenAIGPTAPI(memory, response_cache=response_cache, events=self.events)
         self.memory = memory
 
+    def _on_token(self, type, **data):
+        """ Returns: callable emitting the streamed pieces as events of the type, None (console) without sinks """
+        if not self.events.active:
+            return None
+        return lambda text: self.events.emit(type, output=text, **data)
+
     def choose_agent(self, query):
         """
         Chooses the agent automatically
@@ -58,6 +83,9 @@ class LLM:
         return sub_queries
 
     def generate_report(self, query, context, agent_role_prompt, report_type, websocket=None):
+        """
+        websocket: deprecated, see OpenAIGPTAPI.send_chat_completion_request
+        """
         generate_prompt = get_report_by_type(report_type)
         report = ""
         try:
@@ -79,8 +107,14 @@ class LLM:
         return report
 
     def generate_outline(self, query, agent_role_prompt, context="", websocket=None):
+        """
+        The outline is streamed as outline_token events, websocket is deprecated,
+        see OpenAIGPTAPI.send_chat_completion_request
+        """
         if self.cfg.mock_llm:
-            return self.mock_llm.generate_outline(query, agent_role_prompt)
+            outline = self.mock_llm.generate_outline(query, agent_role_prompt)
+            self.events.emit("outline_token", output=outline)
+            return outline
         outline = ""
         try:
             outline_prompt = generate_outline_prompt(query, context)
@@ -94,14 +128,23 @@ class LLM:
                 llm_provider=self.cfg.llm_provider,
                 stream=True,
                 websocket=websocket,
+                on_token=self._on_token("outline_token"),
                 max_tokens=self.cfg.smart_token_limit
             )
         except Exception as e:
-            log.error(f"Error in generate_report: {e}")
+            log.error(f"Error in generate_outline: {e}")
 
         return outline
 
     def generate_chapter(self, chapter, query, agent_role_prompt, context="", websocket=None):
+        """
+        The chapter is streamed as chapter_token events, websocket is deprecated,
+        see OpenAIGPTAPI.send_chat_completion_request
+        """
+        if self.cfg.mock_llm:
+            content = self.mock_llm.generate_chapter(chapter, query, agent_role_prompt, context)
+            self.events.emit("chapter_token", chapter=chapter, output=content)
+            return content
         content = ""
         try:
             log.info(f"ask llm to generate_chapter for '{chapter}'")
@@ -115,6 +158,7 @@ class LLM:
                 llm_provider=self.cfg.llm_provider,
                 stream=True,
                 websocket=websocket,
+                on_token=self._on_token("chapter_token", chapter=chapter),
                 max_tokens=self.cfg.smart_token_limit
             )
         except Exception as e:
@@ -122,5 +166,15 @@ class LLM:
 
         return content
 
+    def get_context_token_budget(self, model):
+        """
+        Tokens left for the research context in a prompt of the model, after reserving the completion
+        (smart_token_limit) and the instructions of the prompt template
+        """
+        budget = TOKEN_MAX.get(model, 8192) - self.cfg.smart_token_limit - self.cfg.prompt_reserved_tokens
+        if self.cfg.context_token_budget:
+            budget = min(budget, self.cfg.context_token_budget)
+        return max(budget, 0)
+
     def get_total_cost(self):
         return self.openai_llm.get_total_cost()
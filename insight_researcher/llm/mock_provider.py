@@ -38,4 +38,7 @@ intellectual property landscape of AI Agent
 ### 3.3 技术创新与应用案例
 technology innovation and use cases in AI Agent industry
 
-"""
\ No newline at end of file
+"""
+
+    def generate_chapter(self, chapter=None, query=None, agent_role_prompt=None, context="", websocket=None):
+        return f"{query}的相关研究内容（mock），基于{len(context)}个字符的上下文生成。"
@@ -8,7 +8,12 @@ from tenacity import (
     stop_after_attempt,
     wait_random_exponential,
 )
+import threading
+import warnings
 from insight_researcher import log
+from insight_researcher.utils.tracing import tracer
+from insight_researcher.utils.events import EventEmitter, TokenBuffer
+from .response_cache import ResponseCache, CACHED_USAGE
 from .token_counter import (
     TOKEN_COSTS,
     count_message_tokens,
@@ -17,9 +22,11 @@ from .token_counter import (
 
 
 class OpenAIGPTAPI:
-    def __init__(self, memory):
+    def __init__(self, memory, response_cache: ResponseCache = None, events: EventEmitter = None):
         self._cost_manager = CostManager()
         self.memory = memory
+        self.response_cache = response_cache
+        self.events = events if events is not None else EventEmitter()
 
     @retry(
         wait=wait_random_exponential(min=1, max=60),
@@ -28,57 +35,112 @@ class OpenAIGPTAPI:
         retry=retry_if_exception_type(APIConnectionError),
     )
     def send_chat_completion_request(self, messages, model, temperature=1.0, max_tokens=None, stream=False,
-                                           llm_provider=None, websocket=None):
+                                           llm_provider=None, websocket=None, on_token=None):
+        """
+        Args:
+            websocket: deprecated, use on_token. Object with send_json(dict) receiving the streamed pieces
+                as {"type": "report", "output": piece} messages
+            on_token: callable receiving the streamed response piece by piece (see TokenBuffer),
+                the pieces are printed to the console if None
+        """
+        if websocket is not None:
+            on_token = self._websocket_sink(websocket, on_token)
+        with tracer.span("llm.chat", model=model, stream=stream):
+            return self._send_chat_completion_request(messages, model, temperature, max_tokens, stream,
+                                                      llm_provider, on_token)
+
+    def _send_chat_completion_request(self, messages, model, temperature, max_tokens, stream, llm_provider,
+                                      on_token):
         log.debug(self.format_messages(messages))
         # validate input
         if model is None:
             raise ValueError("Model cannot be None")
         if max_tokens is not None and max_tokens > 8001:
             raise ValueError(f"Max tokens cannot be more than 8001, but got {max_tokens}")
+        cache_key, cached = None, None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(messages, model, llm_provider, temperature, max_tokens)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                log.info(f"LLM response cache hit for model {model}")
+            tracer.current().set(cached=cached is not None)
         if not stream:
-            result = lc_openai.ChatCompletion.create(
-                model=model,  # Change model here to use different models
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                provider=llm_provider,  # Change provider here to use a different API
-            )
-            response = result["choices"][0]["message"]["content"]
-            self._calc_and_update_costs(messages, response, model)
+            if cached is not None:
+                response, usage = cached, CACHED_USAGE
+            else:
+                result = lc_openai.ChatCompletion.create(
+                    model=model,  # Change model here to use different models
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    provider=llm_provider,  # Change provider here to use a different API
+                )
+                response, usage = result["choices"][0]["message"]["content"], None
+            self._record_costs(messages, response, model, usage)
+            self._cache_response(cache_key, cached, response)
             msg = {"role": "assistant", "model": model, "content": response}
             log.debug(self.format_messages(msg))
             messages.append(msg)
             self.memory.add_messages(messages)
             return response
         else:
-            paragraph = ""
-            response = ""
+            parts = []
+            buffer = TokenBuffer(on_token if on_token is not None else self._print_piece)
+            usage = None
 
-            for chunk in lc_openai.ChatCompletion.create(
+            if cached is not None:
+                # replay the cached response through the same streaming path
+                chunks, usage = ResponseCache.replay_chunks(cached), CACHED_USAGE
+            else:
+                chunks = lc_openai.ChatCompletion.create(
                     model=model,
                     messages=messages,
                     temperature=temperature,
                     max_tokens=max_tokens,
                     provider=llm_provider,
                     stream=True,
-            ):
+                )
+            for chunk in chunks:
                 content = chunk["choices"][0].get("delta", {}).get("content")
-                if content is not None:
-                    response += content
-                    paragraph += content
-                    if "\n" in paragraph:
-                        if websocket is not None:
-                            websocket.send_json({"type": "report", "output": paragraph})
-                        else:
-                            print(f"{Fore.GREEN}{paragraph}{Style.RESET_ALL}")
-                        paragraph = ""
-            self._calc_and_update_costs(messages, response, model)
+                if content:
+                    parts.append(content)
+                    buffer.write(content)
+            # the last paragraph has no trailing newline
+            buffer.flush()
+            response = "".join(parts)
+            self._record_costs(messages, response, model, usage)
+            self._cache_response(cache_key, cached, response)
             msg = {"role": "assistant", "model": model, "content": response}
             log.debug(self.format_messages(msg))
             messages.append(msg)
             self.memory.add_messages(messages)
             return response
 
+    @staticmethod
+    def _websocket_sink(websocket, on_token=None):
+        # 5: the caller of send_chat_completion_request, through the retry wrapper
+        warnings.warn("the websocket parameter is deprecated, pass on_token or an Agent event sink instead",
+                      DeprecationWarning, stacklevel=5)
+
+        def sink(text):
+            websocket.send_json({"type": "report", "output": text})
+            if on_token is not None:
+                on_token(text)
+        return sink
+
+    @staticmethod
+    def _print_piece(text):
+        print(f"{Fore.GREEN}{text}{Style.RESET_ALL}", end="", flush=True)
+
+    def _record_costs(self, messages, response, model, usage):
+        usage = self._calc_and_update_costs(messages, response, model, usage=usage)
+        tracer.current().set(**usage)
+        self.events.emit("cost", model=model, total_cost=self.get_total_cost(), **usage)
+
+    def _cache_response(self, cache_key, cached, response):
+        if cache_key is not None and cached is None and response:
+            self.response_cache.put(cache_key, response)
+
     def format_messages(self, messages):
         if isinstance(messages, list):
             return '\n' + '\n'.join(f'{msg["role"]}:\n{msg["content"]}' for msg in messages)
@@ -91,20 +153,28 @@ class OpenAIGPTAPI:
         try:
             prompt_tokens = int(usage["prompt_tokens"])
             completion_tokens = int(usage["completion_tokens"])
-            self._cost_manager.update_cost(prompt_tokens, completion_tokens, model)
+            return self._cost_manager.update_cost(prompt_tokens, completion_tokens, model)
         except Exception as e:
             log.error("updating costs failed!", e)
+        return 0.0
 
-    def _calc_and_update_costs(self, messages: list[dict], rsp: str, model: str) -> dict:
+    def _calc_and_update_costs(self, messages: list[dict], rsp: str, model: str, usage: dict = None) -> dict:
+        if usage and "prompt_tokens" in usage and "completion_tokens" in usage:
+            # only a response replayed from the cache comes with its usage (zero), the langchain adapter does not
+            # return the provider's usage, so the live calls are counted locally
+            cost = self._update_costs(usage, model)
+            return {"prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"],
+                    "cost": cost}
         usage = {}
         try:
             prompt_tokens = count_message_tokens(messages, model)
             completion_tokens = count_string_tokens(rsp, model)
             usage["prompt_tokens"] = prompt_tokens
             usage["completion_tokens"] = completion_tokens
-            self._update_costs(usage, model)
+            usage["cost"] = self._update_costs(usage, model)
         except Exception as e:
             log.error("usage calculation failed!", e)
+        return usage
 
     def get_total_cost(self):
         return self._cost_manager.total_cost
@@ -118,6 +188,7 @@ class CostManager:
         self.total_completion_tokens = 0
         self.total_cost = 0
         self.total_budget = 0
+        self._lock = threading.Lock()  # chapters are written concurrently
 
     def update_cost(self, prompt_tokens, completion_tokens, model):
         """
@@ -127,13 +198,18 @@ class CostManager:
         prompt_tokens (int): The number of tokens used in the prompt.
         completion_tokens (int): The number of tokens used in the completion.
         model (str): The model used for the API call.
+
+        Returns:
+        float: The cost of the API call.
         """
-        self.total_prompt_tokens += prompt_tokens
-        self.total_completion_tokens += completion_tokens
         cost = ((prompt_tokens * TOKEN_COSTS[model]["prompt"] + completion_tokens * TOKEN_COSTS[model]["completion"])
                 / 1000)
-        self.total_cost += cost
+        with self._lock:
+            self.total_prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+            self.total_cost += cost
         log.warning(
             f"Total running cost: ${self.total_cost:.3f} | "
             f"Current cost: ${cost:.3f}, prompt_tokens: {prompt_tokens}, completion_tokens: {completion_tokens}"
         )
+        return cost
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from insight_researcher.utils.cache import SqliteCache
+from insight_researcher import log
+
+# usage of a completion replayed from the cache, recorded as a zero cost call
+CACHED_USAGE = {"prompt_tokens": 0, "completion_tokens": 0}
+
+
+class ResponseCache:
+    """
+    Exact-match cache of chat completions, keyed by model, provider, messages, temperature and max_tokens.
+    It is best effort: a cache error is logged and counts as a miss, a paid completion is never lost to it.
+    """
+
+    def __init__(self, cache_dir, ttl=None, max_bytes=None):
+        self.cache = SqliteCache(Path(cache_dir) / "llm_responses.sqlite", ttl=ttl, max_bytes=max_bytes)
+
+    @staticmethod
+    def key(messages, model, llm_provider, temperature, max_tokens):
+        request = {
+            "model": model,
+            "provider": llm_provider,
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in messages],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        return hashlib.sha256(json.dumps(request, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        try:
+            entry = self.cache.get(key)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to read the LLM response cache: {e}")
+            return None
+        return None if entry is None else entry.value
+
+    def put(self, key, response):
+        try:
+            self.cache.put(key, response)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to cache the LLM response: {e}")
+
+    @staticmethod
+    def replay_chunks(response):
+        """
+        Yields the cached response as stream chunks, one line per chunk, so it goes through
+        the same token buffering path as a live stream
+        """
+        for line in response.splitlines(keepends=True):
+            yield {"choices": [{"delta": {"content": line}}]}
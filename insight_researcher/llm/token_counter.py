@@ -1,4 +1,8 @@
+import re
+import threading
+import time
 import tiktoken
+from insight_researcher import log
 
 TOKEN_COSTS = {
     "gpt-3.5-turbo": {"prompt": 0.0015, "completion": 0.002},
@@ -36,47 +40,95 @@ TOKEN_MAX = {
 }
 
 
+TOKENS_PER_MESSAGE_AND_NAME = {
+    "gpt-3.5-turbo-0613": (3, 1),
+    "gpt-3.5-turbo-16k-0613": (3, 1),
+    "gpt-3.5-turbo-1106": (3, 1),
+    "gpt-4-0314": (3, 1),
+    "gpt-4-32k-0314": (3, 1),
+    "gpt-4-0613": (3, 1),
+    "gpt-4-32k-0613": (3, 1),
+    "gpt-4-1106-preview": (3, 1),
+    # every message follows <|start|>{role/name}\n{content}<|end|>\n, if there's a name, the role is omitted
+    "gpt-3.5-turbo-0301": (4, -1),
+}
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding when its BPE file cannot be loaded, e.g. in offline runs:
+    every CJK character, digit and punctuation mark counts as one token, every other word as one token.
+    """
+    name = "approximate"
+    _pattern = re.compile(r"[\u4e00-\u9fff]|\d|[^\W\d\u4e00-\u9fff]+|[^\w\s]")
+
+    def encode_ordinary(self, text):
+        return self._pattern.findall(text)
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+
+# seconds before loading a tokenizer that failed to load is tried again
+ENCODING_RETRY_SECONDS = 60
+_encodings = {}  # model -> loaded tiktoken encoding
+_encoding_failures = {}  # model -> time of the last failed load
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Return the memoized tiktoken encoding of the model, cl100k_base for unknown models.
+    Only a loaded encoding is memoized: when loading fails, e.g. a transient download error, the counts are
+    approximated and loading is tried again ENCODING_RETRY_SECONDS later.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        failed_at = _encoding_failures.get(model)
+        if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_SECONDS:
+            return ApproximateEncoding()
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                log.debug(f"Tokenizer of model {model} not found. Using cl100k_base encoding.")
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            _encoding_failures[model] = time.monotonic()
+            log.warning(f"Failed to load the tokenizer of model {model}, token counts are approximated: {e}")
+            return ApproximateEncoding()
+        _encodings[model] = encoding
+        _encoding_failures.pop(model, None)
+        return encoding
+
+
+def _get_message_token_params(model):
+    if model in TOKENS_PER_MESSAGE_AND_NAME:
+        return TOKENS_PER_MESSAGE_AND_NAME[model]
+    # gpt-3.5-turbo and gpt-4 aliases may update over time, count them as their 0613 snapshots
+    if "gpt-3.5-turbo" in model:
+        return TOKENS_PER_MESSAGE_AND_NAME["gpt-3.5-turbo-0613"]
+    if "gpt-4" in model:
+        return TOKENS_PER_MESSAGE_AND_NAME["gpt-4-0613"]
+    raise NotImplementedError(
+        f"num_tokens_from_messages() is not implemented for model {model}. "
+        f"See https://github.com/openai/openai-python/blob/main/chatml.md "
+        f"for information on how messages are converted to tokens."
+    )
+
+
 def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
     """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model in {
-        "gpt-3.5-turbo-0613",
-        "gpt-3.5-turbo-16k-0613",
-        "gpt-3.5-turbo-1106",
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-        "gpt-4-1106-preview",
-    }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif "gpt-3.5-turbo" in model:
-        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return count_message_tokens(messages, model="gpt-3.5-turbo-0613")
-    elif "gpt-4" in model:
-        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return count_message_tokens(messages, model="gpt-4-0613")
-    else:
-        raise NotImplementedError(
-            f"num_tokens_from_messages() is not implemented for model {model}. "
-            f"See https://github.com/openai/openai-python/blob/main/chatml.md "
-            f"for information on how messages are converted to tokens."
-        )
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
+    tokens_per_message, tokens_per_name = _get_message_token_params(model)
+    keys = [key for message in messages for key in message.keys()]
+    values = [value for message in messages for value in message.values()]
+    num_tokens = tokens_per_message * len(messages)
+    num_tokens += sum(count_strings_tokens(values, model))
+    num_tokens += tokens_per_name * keys.count("name")
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
@@ -92,8 +144,21 @@ def count_string_tokens(string: str, model_name: str) -> int:
     Returns:
         int: The number of tokens in the text string.
     """
-    encoding = tiktoken.encoding_for_model(model_name)
-    return len(encoding.encode(string))
+    return len(get_encoding(model_name).encode_ordinary(string))
+
+
+def count_strings_tokens(strings: list[str], model_name: str) -> list[int]:
+    """
+    Returns the number of tokens of each text string, encoded as one batch.
+
+    Args:
+        strings (list[str]): The text strings.
+        model_name (str): The name of the encoding to use. (e.g., "gpt-3.5-turbo")
+
+    Returns:
+        list[int]: The number of tokens of each text string.
+    """
+    return [len(tokens) for tokens in get_encoding(model_name).encode_ordinary_batch(strings)]
 
 
 def get_max_completion_tokens(messages: list[dict], model: str, default: int) -> int:
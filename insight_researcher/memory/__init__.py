@@ -1,4 +1,6 @@
 from .memory import Memory
+from .embeddings import get_embeddings
+from .knowledge_base import KnowledgeBase, get_knowledge_base
 
-__all__ = ['Memory']
+__all__ = ['Memory', 'get_embeddings', 'KnowledgeBase', 'get_knowledge_base']
 
@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from insight_researcher import log
+
+
+class ChunkStore:
+    """
+    Append-only, pickle-free persistence of the vectors and chunks of a FaissStorage.
+    vectors.f32 holds the raw float32 vectors in index order, chunks.sqlite holds one row per vector
+    (position, docstore id, text, metadata as JSON). Every append writes and fsyncs the vectors before it commits
+    the rows, so the committed rows are the checkpoint: after a crash, vectors beyond the committed rows are a torn
+    tail and cut off on open. An append that fails rolls its rows back and cuts its vectors off before raising,
+    so the store stays consistent for the next append. index.faiss is an optional snapshot of the faiss index (written atomically by
+    snapshot_index) that saves rebuilding an hnsw/ivf index on load, the vectors appended after it are re-added.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: directory of the store, created if missing
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.vector_path = self.path / "vectors.f32"
+        self.index_path = self.path / "index.faiss"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path / "chunks.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, "
+                           "page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self.count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+        self._truncate_torn_tail()
+
+    def _truncate_torn_tail(self):
+        committed = self.count * (self.dim or 0) * 4
+        if self.vector_path.exists() and self.vector_path.stat().st_size > committed:
+            log.warning(f"Cut {self.vector_path.stat().st_size - committed} uncommitted bytes off {self.vector_path}")
+            with open(self.vector_path, "r+b") as f:
+                f.truncate(committed)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, vectors, ids: List[str], documents: List[Document]):
+        """
+        Args:
+            vectors: float32 array of shape (n, dim), in index order after the already stored ones
+            ids: docstore ids of the vectors
+            documents: chunks of the vectors
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            dim = self.dim
+            try:
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+                with open(self.vector_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                rows = [(self.count + i, _id, document.page_content,
+                         json.dumps(document.metadata, ensure_ascii=False, default=str))
+                        for i, (_id, document) in enumerate(zip(ids, documents))]
+                self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+                self._conn.commit()
+            except BaseException:
+                # the next append would write after the orphan vectors and shift every later position
+                self._conn.rollback()
+                self.dim = dim
+                self._truncate_torn_tail()
+                raise
+            self.count += len(rows)
+
+    def load(self) -> Tuple[np.ndarray, List[Tuple[str, Document]]]:
+        """
+        Returns: the committed vectors as an array of shape (count, dim), and the (docstore id, chunk) pairs in
+        the same order
+        """
+        with self._lock:
+            if not self.count:
+                return np.zeros((0, self.dim or 0), dtype=np.float32), []
+            vectors = np.fromfile(self.vector_path, dtype=np.float32, count=self.count * self.dim)
+            rows = self._conn.execute("SELECT doc_id, page_content, metadata FROM chunks ORDER BY position").fetchall()
+        docs = [(_id, Document(page_content=content, metadata=json.loads(metadata))) for _id, content, metadata in rows]
+        return vectors.reshape(self.count, self.dim), docs
+
+    def snapshot_index(self, index):
+        """ write the faiss index atomically, it is only used on load when it is not ahead of the committed rows """
+        tmp_path = self.index_path.with_suffix(".tmp")
+        faiss.write_index(index, str(tmp_path))
+        os.replace(tmp_path, self.index_path)
+
+    def load_index_snapshot(self):
+        """ Returns: the index snapshot, None if missing or not matching the committed rows """
+        if not self.index_path.exists():
+            return None
+        try:
+            index = faiss.read_index(str(self.index_path))
+        except RuntimeError as e:
+            log.warning(f"Ignore the unreadable index snapshot {self.index_path}: {e}")
+            return None
+        if index.ntotal > self.count or index.d != self.dim:
+            return None
+        return index
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def clean(self):
+        """ close the store and delete its files """
+        self.close()
+        for file in self.path.glob("*"):
+            if file.name.startswith(("vectors.f32", "index.", "chunks.sqlite")):
+                file.unlink(missing_ok=True)
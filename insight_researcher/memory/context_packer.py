@@ -0,0 +1,56 @@
+import numpy as np
+from insight_researcher.llm.token_counter import count_strings_tokens
+
+
+class ContextPacker:
+    """
+    Packs candidate chunks into a prompt context under a token budget.
+    Chunks are picked greedily by maximal marginal relevance (MMR): relevance to the queries minus
+    similarity to the chunks already picked, so near-identical chunks do not crowd out the others.
+    A chunk that does not fit the remaining budget is skipped and smaller ones may still fill it.
+    """
+
+    def __init__(self, token_budget, model, diversity=0.3):
+        """
+        Args:
+            token_budget: max tokens of the packed context
+            model: model whose tokenizer counts the tokens
+            diversity: 0 ranks by relevance only, 1 by novelty only
+        """
+        self.token_budget = token_budget
+        self.model = model
+        self.diversity = diversity
+
+    def pack(self, texts, relevance, vectors):
+        """
+        Args:
+            texts: formatted chunks, as they will appear in the prompt
+            relevance: relevance score of each chunk
+            vectors: embedding of each chunk, used for the diversity term
+
+        Returns: indices of the selected chunks in selection order
+        """
+        if not texts:
+            return []
+        tokens = count_strings_tokens(texts, self.model)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        similarity = vectors @ vectors.T
+        relevance = np.asarray(relevance, dtype=np.float32)
+
+        selected = []
+        used_tokens = 0
+        redundancy = np.zeros(len(texts), dtype=np.float32)
+        available = np.ones(len(texts), dtype=bool)
+        while available.any():
+            scores = (1 - self.diversity) * relevance - self.diversity * redundancy
+            scores[~available] = -np.inf
+            i = int(np.argmax(scores))
+            available[i] = False
+            if used_tokens + tokens[i] > self.token_budget:
+                continue
+            selected.append(i)
+            used_tokens += tokens[i]
+            redundancy = np.maximum(redundancy, similarity[i])
+        return selected
@@ -0,0 +1,71 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from insight_researcher.utils.cache import SqliteCache
+from insight_researcher import log
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by an on-disk cache keyed by the hash of model and text.
+    The same instance serves FaissStorage and the relevance filter, and the cache file is shared
+    across tasks, so a chunk is only ever sent to the embedding API once.
+    The writes are best effort, the vectors are returned even if they could not be cached.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_dir, model=None, max_bytes=None):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.cache = SqliteCache(Path(cache_dir) / "embeddings.sqlite", max_bytes=max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self.cache.get_many(keys)
+        vectors = {key: np.frombuffer(entry.value, dtype=np.float32).tolist() for key, entry in found.items()}
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        self._count(len(texts) - len(missing), len(missing))
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self._put_many((key, np.asarray(vector, dtype=np.float32).tobytes(), None)
+                           for key, vector in new_vectors.items())
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._count(1, 0)
+            return np.frombuffer(entry.value, dtype=np.float32).tolist()
+        self._count(0, 1)
+        vector = self.embeddings.embed_query(text)
+        self._put_many([(key, np.asarray(vector, dtype=np.float32).tobytes(), None)])
+        return vector
+
+    def _put_many(self, items):
+        try:
+            self.cache.put_many(items)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to cache embeddings: {e}")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
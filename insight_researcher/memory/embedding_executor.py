@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+from insight_researcher.llm.token_counter import count_strings_tokens
+from insight_researcher.utils.tracing import tracer
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window limiting requests per minute and tokens per minute
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Blocks until a request of the given tokens fits both budgets
+        Returns: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= self.window:
+                    self._tokens -= self._events.popleft()[1]
+                requests_ok = self.requests_per_minute is None or len(self._events) < self.requests_per_minute
+                # a single request above the token budget is let through once the window is empty
+                tokens_ok = (self.tokens_per_minute is None or self._tokens + tokens <= self.tokens_per_minute
+                             or not self._events)
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return waited
+                delay = self.window - (now - self._events[0][0])
+            time.sleep(delay)
+            waited += delay
+
+
+class EmbeddingExecutor(Embeddings):
+    """
+    Embeddings wrapper that splits the texts into batches up to the provider's input limits and embeds
+    several batches concurrently, within the requests-per-minute and tokens-per-minute budgets.
+    One executor is shared by FaissStorage and the relevance filter, so the limits hold for the whole task.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size=2048, max_batch_tokens=100000, max_concurrency=4,
+                 requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            embeddings: the embedding backend, it should send one request per call of up to max_batch_size texts
+            max_batch_size: max texts per request
+            max_batch_tokens: max tokens per request
+            max_concurrency: max requests in flight
+            requests_per_minute: requests budget, None for no limit
+            tokens_per_minute: tokens budget, None for no limit
+        """
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding")
+        self._lock = threading.Lock()
+        self._metrics = {"requests": 0, "texts": 0, "tokens": 0, "request_seconds": 0.0,
+                         "rate_limit_wait_seconds": 0.0}
+        self._started_at = None
+        self._busy_until = None
+
+    def _batches(self, texts, tokens):
+        batch, batch_tokens = [], 0
+        for i, (text, n_tokens) in enumerate(zip(texts, tokens)):
+            if batch and (len(batch) >= self.max_batch_size or batch_tokens + n_tokens > self.max_batch_tokens):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += n_tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def _embed_batch(self, texts, n_tokens):
+        with tracer.span("embedding.request", model=self.model, texts=len(texts), tokens=n_tokens) as span:
+            waited = self.rate_limiter.acquire(n_tokens)
+            start = time.monotonic()
+            vectors = self.embeddings.embed_documents(texts)
+            end = time.monotonic()
+            span.set(rate_limit_wait_seconds=round(waited, 3))
+        with self._lock:
+            self._metrics["requests"] += 1
+            self._metrics["texts"] += len(texts)
+            self._metrics["tokens"] += n_tokens
+            self._metrics["request_seconds"] += end - start
+            self._metrics["rate_limit_wait_seconds"] += waited
+            self._started_at = start if self._started_at is None else min(self._started_at, start)
+            self._busy_until = end if self._busy_until is None else max(self._busy_until, end)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        tokens = count_strings_tokens(texts, self.model)
+        # the requests are spans of the calling task, not traces of their own
+        embed_batch = tracer.propagate(self._embed_batch)
+        futures = [(batch, self._executor.submit(embed_batch, [texts[i] for i in batch], batch_tokens))
+                   for batch, batch_tokens in self._batches(texts, tokens)]
+        vectors = [None] * len(texts)
+        for batch, future in futures:
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        self.rate_limiter.acquire(count_strings_tokens([text], self.model)[0])
+        return self.embeddings.embed_query(text)
+
+    def metrics(self):
+        """
+        Returns: request/text/token counts, time spent in requests and waiting for the rate limits,
+        and the throughput over the span between the first request start and the last request end
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            elapsed = (self._busy_until - self._started_at) if self._started_at is not None else 0.0
+        metrics["texts_per_sec"] = metrics["texts"] / elapsed if elapsed else 0.0
+        metrics["tokens_per_sec"] = metrics["tokens"] / elapsed if elapsed else 0.0
+        return metrics
@@ -0,0 +1,88 @@
+from typing import List
+
+import numpy as np
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+from .embedding_cache import CachedEmbeddings
+from .embedding_executor import EmbeddingExecutor
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local CPU embeddings: sublinear term frequencies of hashed character n-grams, L2 normalized.
+    Character n-grams work for Chinese and English text alike, and the hashing is vectorized with NumPy
+    over all the texts of a call, so it needs no network, no model files and no fitting.
+    """
+
+    def __init__(self, dimension=512, ngram_range=(2, 4)):
+        """
+        Args:
+            dimension: size of the vectors
+            ngram_range: min and max n of the character n-grams
+        """
+        self.dimension = dimension
+        self.ngram_range = ngram_range
+        self.model = f"hashing-{dimension}-{ngram_range[0]}-{ngram_range[1]}"
+
+    def _hash_ngrams(self, text):
+        codes = np.frombuffer(" ".join(text.lower().split()).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        hashes = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            if len(codes) < n:
+                continue
+            h = np.full(len(codes) - n + 1, n, dtype=np.uint64)
+            for k in range(n):
+                # polynomial rolling hash, uint64 arithmetic wraps around
+                h = h * np.uint64(1000003) + codes[k:len(codes) - n + 1 + k]
+            hashes.append(h * np.uint64(0x9E3779B97F4A7C15))
+        return np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashed = [self._hash_ngrams(text) for text in texts]
+        rows = np.repeat(np.arange(len(texts)), [len(h) for h in hashed])
+        hashes = np.concatenate(hashed)
+        columns = (hashes >> np.uint64(33)) % np.uint64(self.dimension)
+        signs = np.where((hashes >> np.uint64(32)) & np.uint64(1), 1.0, -1.0)
+        flat = np.bincount(rows * self.dimension + columns.astype(np.int64), weights=signs,
+                           minlength=len(texts) * self.dimension)
+        matrix = flat.reshape(len(texts), self.dimension)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+        return matrix.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def get_embeddings(cfg):
+    """
+    Gets the embeddings backend of Memory
+    Args:
+        cfg: Config, EMBEDDING_BACKEND is "openai" or "local"
+
+    Returns:
+        embeddings: langchain Embeddings
+    """
+    match cfg.embedding_backend:
+        case "openai":
+            # requests are batched up to the provider's input limit by the executor
+            embeddings = EmbeddingExecutor(OpenAIEmbeddings(chunk_size=cfg.embedding_max_batch_size),
+                                           max_batch_size=cfg.embedding_max_batch_size,
+                                           max_batch_tokens=cfg.embedding_max_batch_tokens,
+                                           max_concurrency=cfg.embedding_concurrency,
+                                           requests_per_minute=cfg.embedding_rpm or None,
+                                           tokens_per_minute=cfg.embedding_tpm or None)
+            if cfg.embedding_cache:
+                # FaissStorage and the relevance filter share this instance, so every chunk is embedded once
+                embeddings = CachedEmbeddings(embeddings, cfg.cache_dir,
+                                              max_bytes=cfg.embedding_cache_max_mb * 1024 * 1024)
+        case "local":
+            # computing the vectors is cheaper than looking them up, no cache and no executor needed
+            embeddings = HashingEmbeddings(dimension=cfg.local_embedding_dim)
+        case _:
+            raise Exception("Embedding backend not found.")
+
+    return embeddings
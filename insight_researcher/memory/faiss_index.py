@@ -0,0 +1,115 @@
+import math
+
+import faiss
+from insight_researcher import log
+
+INDEX_TYPES = ["flat", "ivf", "hnsw"]
+
+
+class FaissIndexBuilder:
+    """
+    Keeps the faiss index of a FaissStorage in the configured type:
+    flat: exact brute-force scan, the LangChain default;
+    ivf: inverted lists over k-means cells, trained automatically once min_train_size vectors exist
+         (flat until then) and retrained when the memory has grown enough for twice the cells;
+    hnsw: graph index, no training, built as soon as the first vectors are added.
+    All types are L2 like the LangChain flat index and keep the sequential ids of the vectors, so the docstore
+    mapping and the source ranges of FaissStorage stay valid, and they can reconstruct the stored vectors.
+    A persisted index of another type is migrated on load by re-adding its vectors to a new index.
+    """
+
+    def __init__(self, index_type="flat", ivf_nlist=0, ivf_nprobe=16, ivf_min_train_size=4096, hnsw_m=32,
+                 hnsw_ef_construction=80, hnsw_ef_search=64):
+        """
+        Args:
+            index_type: flat, ivf or hnsw
+            ivf_nlist: number of ivf cells, 0 to derive it from the number of vectors (4 * sqrt(n))
+            ivf_nprobe: cells scanned per ivf search, higher is slower with better recall
+            ivf_min_train_size: vectors needed before the ivf index is trained
+            hnsw_m: neighbors per hnsw node
+            hnsw_ef_construction: hnsw build time search depth
+            hnsw_ef_search: hnsw query time search depth, higher is slower with better recall
+        """
+        if index_type not in INDEX_TYPES:
+            raise Exception("Faiss index type not found.")
+        self.index_type = index_type
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf_min_train_size = ivf_min_train_size
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(index_type=cfg.faiss_index_type, ivf_nlist=cfg.faiss_ivf_nlist, ivf_nprobe=cfg.faiss_ivf_nprobe,
+                   ivf_min_train_size=cfg.faiss_ivf_min_train_size, hnsw_m=cfg.faiss_hnsw_m,
+                   hnsw_ef_construction=cfg.faiss_hnsw_ef_construction, hnsw_ef_search=cfg.faiss_hnsw_ef_search)
+
+    @staticmethod
+    def type_of(index):
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf"
+        if isinstance(index, faiss.IndexHNSW):
+            return "hnsw"
+        return "flat"
+
+    def _nlist(self, ntotal):
+        if self.ivf_nlist:
+            return self.ivf_nlist
+        return max(1, int(4 * math.sqrt(ntotal)))
+
+    def _target_type(self, ntotal):
+        if self.index_type == "ivf" and ntotal < max(self.ivf_min_train_size, self._nlist(ntotal)):
+            return "flat"
+        return self.index_type
+
+    def _needs_retrain(self, index):
+        # with derived cells, retrain when the memory has grown enough to double them
+        return self.type_of(index) == "ivf" and not self.ivf_nlist and self._nlist(index.ntotal) >= 2 * index.nlist
+
+    def maybe_migrate(self, index):
+        """
+        Args:
+            index: current faiss index of the store
+
+        Returns: the index itself, or a new index of the configured type holding the same vectors in the same order
+        """
+        target = self._target_type(index.ntotal)
+        if self.type_of(index) != target or self._needs_retrain(index):
+            index = self.build(index, target)
+        return self.configure(index)
+
+    def build(self, index, index_type):
+        """
+        Returns: a new index of index_type with the vectors of index, in the same order
+        """
+        vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else None
+        match index_type:
+            case "flat":
+                new_index = faiss.IndexFlatL2(index.d)
+            case "hnsw":
+                new_index = faiss.IndexHNSWFlat(index.d, self.hnsw_m)
+                new_index.hnsw.efConstruction = self.hnsw_ef_construction
+            case "ivf":
+                new_index = faiss.IndexIVFFlat(faiss.IndexFlatL2(index.d), index.d, self._nlist(index.ntotal))
+                new_index.train(vectors)
+            case _:
+                raise Exception("Faiss index type not found.")
+        self.configure(new_index)
+        if vectors is not None:
+            new_index.add(vectors)
+        log.info(f"Migrated faiss index of {index.ntotal} vectors from {self.type_of(index)} to {index_type}")
+        return new_index
+
+    def configure(self, index):
+        """ set the search parameters, they are not persisted with the index """
+        match self.type_of(index):
+            case "ivf":
+                index.nprobe = self.ivf_nprobe
+                if index.direct_map.type == faiss.DirectMap.NoMap:
+                    # FaissStorage reads the stored vectors back by position
+                    index.make_direct_map()
+            case "hnsw":
+                index.hnsw.efSearch = self.hnsw_ef_search
+        return index
@@ -1,10 +1,17 @@
-from typing import List
+from typing import Dict, List, Tuple
 from pathlib import Path
 from insight_researcher import log, PROJECT_ROOT
+from insight_researcher.utils.tracing import tracer
+from .faiss_index import FaissIndexBuilder
+from .chunk_store import ChunkStore
+from .page_store import PageStore, ChunkDocstore
 from langchain.vectorstores.faiss import FAISS
 from langchain.schema import Document
 import faiss
+import numpy as np
 import pickle
+import threading
+import uuid
 
 
 class FaissStorage:
@@ -12,88 +19,246 @@ class FaissStorage:
     The memory storage with Faiss as ANN search engine
     """
 
-    def __init__(self, task_id, embeddings):
+    def __init__(self, task_id, embeddings, index_builder: FaissIndexBuilder = None, persist=False,
+                 pages: PageStore = None):
+        """
+        Args:
+            task_id: task id, names the persist directory
+            embeddings: embeddings of the chunks and queries
+            index_builder: keeps the faiss index in the configured type, flat if None
+            persist: append every added chunk to the on-disk ChunkStore, a task with stored chunks is recovered
+            pages: pages of the chunks, the chunks found in them are stored by reference instead of as text
+        """
         self.task_id: str = task_id
         self.mem_path: Path = Path(PROJECT_ROOT / f"mem/{self.task_id}/")
         self._initialized: bool = False
         self.embeddings = embeddings
         self.store: FAISS = None  # Faiss engine
+        self.index_builder = index_builder if index_builder is not None else FaissIndexBuilder()
+        self.pages = pages if pages is not None else PageStore()
+        self.chunk_store: ChunkStore = None  # on-disk copy of the vectors and chunks, None if not persisted
+        self._lock = threading.Lock()  # faiss index is not safe for concurrent add/search
+        self._source_ranges: Dict[str, List[Tuple[int, int]]] = {}  # source url -> [(start, count)] in the index
+        self._chunk_positions: Dict[Tuple[str, int], int] = {}  # (source url, chunk id) -> position in the index
+        if persist:
+            self.chunk_store = ChunkStore(self.mem_path)
+            if self.chunk_store.count:
+                self.recover_memory(task_id)
 
     @property
     def is_initialized(self) -> bool:
         return self._initialized
 
     def recover_memory(self, task_id: str) -> List[Document]:
+        """
+        load the chunks persisted by the task, the chunks added from now on are persisted for it too
+        Returns: the recovered chunks
+        """
         self.task_id = task_id
-        self.mem_path = Path(PROJECT_ROOT / f"mem/{self.task_id}/")
-        self.mem_path.mkdir(parents=True, exist_ok=True)
+        mem_path = Path(PROJECT_ROOT / f"mem/{self.task_id}/")
+        if self.chunk_store is None or mem_path != self.mem_path:
+            if self.chunk_store is not None:
+                self.chunk_store.close()
+            self.mem_path = mem_path
+            self.chunk_store = ChunkStore(self.mem_path)
         self.store = self._load()
+        if self.store is None:
+            return []
+        # an index persisted with another index type is migrated to the configured one
+        self.store.index = self.index_builder.maybe_migrate(self.store.index)
+        self._source_ranges = {}
+        self._chunk_positions = {}
+        for position, _id in sorted(self.store.index_to_docstore_id.items()):
+            self._add_chunk_position(self.store.docstore.search(_id).metadata, position)
         documents = []
-        for _id, document in self.store.docstore._dict.items():
-            documents.append(document)
+        for _id in self.store.docstore._dict:
+            documents.append(self.store.docstore.search(_id))
         self._initialized = True
 
         return documents
 
     def _get_index_and_store_fname(self):
+        # files of the legacy pickle format, only read to migrate them
         index_fpath = Path(self.mem_path / f'{self.task_id}.index')
         storage_fpath = Path(self.mem_path / f'{self.task_id}.pkl')
         return index_fpath, storage_fpath
 
-    def _write(self, docs, metadatas):
-        store = FAISS.from_texts(docs, self.embeddings, metadatas=metadatas)
+    def _write(self, text_embeddings, metadatas, ids):
+        store = FAISS(self.embeddings, faiss.IndexFlatL2(len(text_embeddings[0][1])), ChunkDocstore(self.pages), {})
+        store.add_embeddings(text_embeddings=text_embeddings, metadatas=metadatas, ids=ids)
         return store
 
     def _load(self):
+        vectors, docs = self.chunk_store.load()
+        if not docs:
+            return self._load_legacy()
+        # the snapshot saves rebuilding an hnsw/ivf index, the chunks appended after it are added on top
+        index = self.chunk_store.load_index_snapshot()
+        if index is None:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+        if index.ntotal < len(vectors):
+            index.add(vectors[index.ntotal:])
+        return FAISS(self.embeddings, index, ChunkDocstore(self.pages, {_id: doc for _id, doc in docs}),
+                     {position: _id for position, (_id, doc) in enumerate(docs)})
+
+    def _load_legacy(self):
         index_file, store_file = self._get_index_and_store_fname()
         if not (index_file.exists() and store_file.exists()):
-            log.info("Missing at least one of index_file/store_file, load failed and return None")
+            log.info("Missing persisted chunks, load failed and return None")
             return None
         index = faiss.read_index(str(index_file))
         with open(str(store_file), "rb") as f:
             store = pickle.load(f)
         store.index = index
+        # rewrite the memory in the append-only format, the pickle is never read again
+        ids = [store.index_to_docstore_id[position] for position in range(index.ntotal)]
+        self.chunk_store.append(index.reconstruct_n(0, index.ntotal), ids,
+                                [store.docstore.search(_id) for _id in ids])
+        index_file.unlink(missing_ok=True)
+        store_file.unlink(missing_ok=True)
+        log.info(f"Migrated the pickled memory of task {self.task_id} to {self.mem_path}")
         return store
 
     def persist(self):
-        # create faiss persist directory
-        if not self.mem_path.exists():
-            self.mem_path.mkdir(parents=True, exist_ok=True)
-        index_file, store_file = self._get_index_and_store_fname()
-        store = self.store
-        index = self.store.index
-        faiss.write_index(store.index, str(index_file))
-        store.index = None
-        with open(store_file, "wb") as f:
-            pickle.dump(store, f)
-        store.index = index
-        log.debug(f'Agent {self.role_id} persist memory into local')
+        """
+        checkpoint the memory: the chunks are already appended to the ChunkStore as they are added, this writes
+        a snapshot of the faiss index so that loading does not rebuild it.
+        Without continuous persistence, this persists all the chunks added so far and keeps persisting the new ones.
+        """
+        with self._lock:
+            if not self.store:
+                return
+            if self.chunk_store is None:
+                self.chunk_store = ChunkStore(self.mem_path)
+                ids = [self.store.index_to_docstore_id[position] for position in range(self.store.index.ntotal)]
+                self.chunk_store.append(self.store.index.reconstruct_n(0, self.store.index.ntotal), ids,
+                                        [self.store.docstore.search(_id) for _id in ids])
+            self.chunk_store.snapshot_index(self.store.index)
+        log.debug(f'Agent {self.task_id} persist memory into local')
 
-    def add(self, documents: List[Document]) -> bool:
-        """ add message into memory storage"""
+    def add(self, documents: List[Document], vectors=None) -> bool:
+        """
+        add message into memory storage
+        Args:
+            documents: chunks to add
+            vectors: vectors of the chunks, e.g. from the knowledge base, the chunks are embedded if None
+        """
 
+        if not documents:
+            return
         docs = [document.page_content for document in documents]
         metadatas = [document.metadata for document in documents]
-        if not self.store:
-            # init Faiss
-            self.store = self._write(docs, metadatas)
-            self._initialized = True
-        else:
-            self.store.add_texts(texts=docs, metadatas=metadatas)
-        # self.persist()
+        if vectors is None:
+            # embedding is network bound, do it outside the lock so concurrent adds only serialize on the index
+            with tracer.span("memory.embed", chunks=len(docs), chars=sum(len(doc) for doc in docs)):
+                vectors = self.embeddings.embed_documents(docs)
+        text_embeddings = list(zip(docs, vectors))
+        ids = [str(uuid.uuid4()) for _ in documents]
+        with self._lock, tracer.span("faiss.add", chunks=len(docs)) as span:
+            start = self.store.index.ntotal if self.store else 0
+            if not self.store:
+                # init Faiss
+                self.store = self._write(text_embeddings, metadatas, ids)
+                self._initialized = True
+            else:
+                self.store.add_embeddings(text_embeddings=text_embeddings, metadatas=metadatas, ids=ids)
+            # train ivf once enough vectors exist, or build hnsw from the first ones
+            self.store.index = self.index_builder.maybe_migrate(self.store.index)
+            # faiss appends the vectors in order, remember where each page's chunks landed
+            for offset, metadata in enumerate(metadatas):
+                self._add_chunk_position(metadata, start + offset)
+            span.set(ntotal=self.store.index.ntotal, index_type=FaissIndexBuilder.type_of(self.store.index))
+            if self.chunk_store is not None:
+                # appended in index order under the index lock, a cheap continuous checkpoint
+                with tracer.span("memory.persist", chunks=len(docs)):
+                    self.chunk_store.append(np.asarray([vector for _, vector in text_embeddings], dtype=np.float32),
+                                            ids, documents)
         log.info(f"Agent {self.task_id}'s memory_storage add a message")
 
+    def _add_chunk_position(self, metadata, position):
+        source = metadata.get("source")
+        ranges = self._source_ranges.setdefault(source, [])
+        if ranges and ranges[-1][0] + ranges[-1][1] == position:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + 1)
+        else:
+            ranges.append((position, 1))
+        if metadata.get("chunk_id") is not None:
+            # chunks of a page may be skipped (near duplicates), the chunk id is not an offset in its ranges
+            self._chunk_positions[(source, metadata["chunk_id"])] = position
+
+    def search_by_sources(self, query, sources, similarity_threshold=None) -> List[Tuple[Document, float]]:
+        """
+        rank the stored chunks of the given sources by cosine similarity to the query,
+        only the query is embedded, the chunk vectors are read back from the index
+        Args:
+            query: query text
+            sources: source urls whose chunks are searched
+            similarity_threshold: drop the chunks whose similarity is not above it
+
+        Returns: (document, similarity) pairs in descending similarity
+        """
+        if not self.store:
+            return []
+        with tracer.span("faiss.search_by_sources", sources=len(sources)) as span:
+            embedding = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            with self._lock:
+                ranges = [r for source in dict.fromkeys(sources) for r in self._source_ranges.get(source, [])]
+                if not ranges:
+                    return []
+                vectors = np.vstack([self.store.index.reconstruct_n(start, count) for start, count in ranges])
+                docs = [self.store.docstore.search(self.store.index_to_docstore_id[position])
+                        for start, count in ranges for position in range(start, start + count)]
+            norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(embedding)
+            similarity = vectors @ embedding / np.where(norms == 0, 1, norms)
+            result = []
+            for i in np.argsort(-similarity):
+                if similarity_threshold is not None and similarity[i] <= similarity_threshold:
+                    break
+                result.append((docs[i], float(similarity[i])))
+            span.set(candidates=len(docs), results=len(result))
+        return result
+
+    def get_vectors(self, documents: List[Document]) -> List:
+        """
+        read the stored vectors of the given chunks back from the index
+        Returns: one vector per document, None for the documents that are not indexed
+        """
+        vectors = []
+        with self._lock:
+            for document in documents:
+                position = self._chunk_positions.get((document.metadata.get("source"),
+                                                      document.metadata.get("chunk_id")))
+                vectors.append(None if position is None else self.store.index.reconstruct(position))
+        return vectors
+
     def search_similar(self, query, k=4) -> List[Document]:
         """search for dissimilar messages"""
         if not self.store:
             return []
-        resp = self.store.similarity_search_with_score(
-            query=query,
-            k=k
-        )
+        with tracer.span("faiss.search", k=k):
+            embedding = self.embeddings.embed_query(query)
+            with self._lock:
+                resp = self.store.similarity_search_with_score_by_vector(
+                    embedding=embedding,
+                    k=k
+                )
         return [item for item, score in resp]
 
+    def release(self):
+        """ free the index, the chunks and the vectors, the persisted ones are kept """
+        with self._lock:
+            if self.chunk_store is not None:
+                self.chunk_store.close()
+                self.chunk_store = None
+            self.store = None
+            self._source_ranges = {}
+            self._chunk_positions = {}
+            self._initialized = False
+
     def clean(self):
+        if self.chunk_store is not None:
+            self.chunk_store.clean()
+            self.chunk_store = None
         index_fpath, storage_fpath = self._get_index_and_store_fname()
         if index_fpath and index_fpath.exists():
             index_fpath.unlink(missing_ok=True)
@@ -101,5 +266,7 @@ class FaissStorage:
             storage_fpath.unlink(missing_ok=True)
 
         self.store = None
+        self._source_ranges = {}
+        self._chunk_positions = {}
         self._initialized = False
         
\ No newline at end of file
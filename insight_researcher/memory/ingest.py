@@ -0,0 +1,97 @@
+import queue
+import threading
+from insight_researcher import log
+from insight_researcher.utils.tracing import tracer
+
+
+class IngestPipeline:
+    """
+    Streaming scrape -> split -> embed pipeline of one batch of urls.
+    Each page is split as soon as the scraper yields it, and its chunks are embedded and indexed in batches
+    while the other pages are still downloading. The stages are connected by bounded queues, so a slow
+    embedding stage blocks the splitter and in turn the scraper instead of buffering without limit.
+    """
+    _DONE = object()
+
+    def __init__(self, memory, queue_size=32, batch_size=64, flush_interval=0.2):
+        """
+        Args:
+            memory: the Memory to ingest into
+            queue_size: capacity of the page queue and the chunk queue
+            batch_size: number of chunks per embedding call
+            flush_interval: seconds to wait for more chunks before embedding a partial batch
+        """
+        self.memory = memory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._errors = []
+
+    def run(self, pages):
+        """
+        Args:
+            pages: iterable of {"url": "url1", "raw_content": "content1"}, consumed as it is produced
+
+        Returns: list of the pages in arrival order
+        """
+        page_queue = queue.Queue(maxsize=self.queue_size)
+        chunk_queue = queue.Queue(maxsize=self.queue_size * 4)
+        splitter = threading.Thread(target=tracer.propagate(self._split_worker), args=(page_queue, chunk_queue),
+                                    daemon=True)
+        embedder = threading.Thread(target=tracer.propagate(self._embed_worker), args=(chunk_queue,), daemon=True)
+        splitter.start()
+        embedder.start()
+        collected = []
+        try:
+            for page in pages:
+                collected.append(page)
+                page_queue.put(page)
+        finally:
+            page_queue.put(self._DONE)
+            splitter.join()
+            embedder.join()
+        if self._errors:
+            raise self._errors[0]
+        return collected
+
+    def _split_worker(self, page_queue, chunk_queue):
+        while True:
+            page = page_queue.get()
+            if page is self._DONE:
+                chunk_queue.put(self._DONE)
+                return
+            if self._errors:
+                continue  # keep draining so that the producer never blocks on a dead stage
+            try:
+                self.memory.record_pages([page])
+                for document in self.memory.split_pages([page]):
+                    chunk_queue.put(document)
+            except Exception as e:
+                log.error(f"Error in splitting page {page.get('url')}: {e}")
+                self._errors.append(e)
+
+    def _embed_worker(self, chunk_queue):
+        batch = []
+        while True:
+            try:
+                item = chunk_queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                self._flush(batch)
+                batch = []
+                continue
+            if item is self._DONE:
+                self._flush(batch)
+                return
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+
+    def _flush(self, batch):
+        if not batch or self._errors:
+            return
+        try:
+            self.memory.add_chunks(batch)
+        except Exception as e:
+            log.error(f"Error in embedding {len(batch)} chunks: {e}")
+            self._errors.append(e)
@@ -0,0 +1,300 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from insight_researcher import log
+from insight_researcher.utils.tracing import tracer
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class KnowledgeBase:
+    """
+    Corpus shared by all the tasks, so that research on recurring themes does not search, scrape and embed the
+    same sources again. Chunks are stored once per content hash with their vector, whatever the source and the
+    task they came from, and every source records its fetch time, its page text (zlib compressed) and the ordered
+    hashes of its chunks.
+    A source is fresh for ttl seconds after its last fetch, only fresh sources are served to the tasks.
+    The vectors of one embedding model are not comparable with another's, each model gets its own database
+    under the knowledge base directory. The chunk vectors are also held in an in-process inner product index
+    for the source search, chunks written by other processes are picked up on the next start.
+    A source keeps all the chunks of its page, the chunks a task dropped as near duplicates are stored without
+    a vector (an empty blob) and embedded by the first task that keeps them, see add_vectors.
+    The database is shared by the processes of the same directory, a writer waits up to busy_timeout seconds
+    for the others.
+    """
+
+    def __init__(self, path, embeddings, ttl=7 * 24 * 3600, busy_timeout=30):
+        """
+        Args:
+            path: knowledge base directory, created if missing
+            embeddings: embeddings of the tasks, the stored vectors are theirs
+            ttl: seconds a fetched source stays fresh, stale sources are fetched again by the tasks
+            busy_timeout: seconds to wait for the lock of another connection before raising "database is locked"
+        """
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.path = Path(path) / f"{self.model.replace('/', '_')}.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.served_sources = 0
+        self.reused_vectors = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, page_content TEXT NOT NULL, "
+                           "vector BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sources (url TEXT PRIMARY KEY, title TEXT, "
+                           "fetched_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS source_chunks (url TEXT NOT NULL, chunk_id INTEGER NOT NULL, "
+                           "hash TEXT NOT NULL, PRIMARY KEY (url, chunk_id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_source_chunks_hash ON source_chunks (hash)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content BLOB NOT NULL)")
+        self._index = None  # normalized chunk vectors, built on the first add or search
+        self._hashes: List[str] = []  # position in the index -> chunk hash
+        self._positions: Dict[str, int] = {}
+        self._load_index()
+
+    def _load_index(self):
+        rows = self._conn.execute("SELECT hash, vector FROM chunks WHERE length(vector) > 0 ORDER BY rowid").fetchall()
+        if not rows:
+            return
+        self._add_to_index([row[0] for row in rows],
+                           np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]))
+        log.info(f"Loaded {len(rows)} chunks of the knowledge base {self.path}")
+
+    def _add_to_index(self, hashes, vectors):
+        vectors = np.array(vectors, dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        if self._index is None:
+            self._index = faiss.IndexFlatIP(vectors.shape[1])
+        for hash_ in hashes:
+            self._positions[hash_] = len(self._hashes)
+            self._hashes.append(hash_)
+        self._index.add(vectors)
+
+    @contextmanager
+    def _transaction(self):
+        """ one write transaction, IMMEDIATE waits for the write lock up front, rolled back on error """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self._conn.execute("COMMIT")
+        except BaseException:
+            # never leave the connection inside a transaction, every later BEGIN would fail
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _vector(blob):
+        return np.frombuffer(blob, dtype=np.float32) if blob else None
+
+    def get_vectors(self, texts: List[str]) -> List:
+        """
+        Returns: the stored vector of every text, None for the texts not in the knowledge base or without a vector
+        """
+        hashes = [content_hash(text) for text in texts]
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite limits the number of bound variables of one statement
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                rows = self._conn.execute(f"SELECT hash, vector FROM chunks WHERE length(vector) > 0 AND hash IN "
+                                          f"({','.join('?' * len(batch))})", batch).fetchall()
+                found.update((hash_, self._vector(vector)) for hash_, vector in rows)
+            self.reused_vectors += sum(1 for hash_ in hashes if hash_ in found)
+        return [found.get(hash_) for hash_ in hashes]
+
+    def start_fetch(self, url_content_list):
+        """
+        store the text of fetched pages and forget the chunks of their previous fetch, the chunks of the new one
+        are added next
+        Args:
+            url_content_list: url-content pairs of the fetched pages with content
+        """
+        pages = {url_content["url"]: url_content["raw_content"] for url_content in url_content_list}
+        urls = list(pages)
+        with self._lock, self._transaction():
+            for i in range(0, len(urls), 500):
+                batch = urls[i:i + 500]
+                self._conn.execute(f"DELETE FROM source_chunks WHERE url IN ({','.join('?' * len(batch))})", batch)
+            self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?)",
+                                   [(url, zlib.compress(content.encode("utf-8"))) for url, content in pages.items()])
+
+    def add_chunks(self, documents: List[Document], vectors):
+        """
+        record the chunks of fetched pages, see start_fetch
+        Args:
+            documents: all the chunks of the pages, with source, chunk_id and title metadata, in chunk order per source
+            vectors: vectors of the chunks, None for the chunks that were not embedded
+        """
+        now = time.time()
+        with self._lock, tracer.span("knowledge_base.add", chunks=len(documents)) as span:
+            with self._transaction():
+                chunks = []
+                for document, vector in zip(documents, vectors):
+                    url, chunk_id = document.metadata.get("source"), document.metadata.get("chunk_id")
+                    if url is None or chunk_id is None:
+                        continue
+                    hash_ = content_hash(document.page_content)
+                    self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                                       (url, document.metadata.get("title", ""), now))
+                    self._conn.execute("INSERT OR REPLACE INTO source_chunks VALUES (?, ?, ?)",
+                                       (url, chunk_id, hash_))
+                    chunks.append((hash_, document.page_content, vector))
+                new_hashes, new_vectors = self._store_chunks(chunks)
+            # the in-process index only gets the committed vectors
+            if new_hashes:
+                self._add_to_index(new_hashes, new_vectors)
+            span.set(new_chunks=len(new_hashes))
+
+    def add_vectors(self, documents: List[Document], vectors):
+        """
+        store the vectors of chunks recorded without one, e.g. after embedding the chunks served by get_pages
+        """
+        with self._lock:
+            with self._transaction():
+                new_hashes, new_vectors = self._store_chunks(
+                    [(content_hash(document.page_content), document.page_content, vector)
+                     for document, vector in zip(documents, vectors) if vector is not None])
+            if new_hashes:
+                self._add_to_index(new_hashes, new_vectors)
+
+    def _store_chunks(self, chunks):
+        """
+        write the chunks, inside a transaction
+        Args:
+            chunks: (hash, page_content, vector or None) tuples
+        Returns: the hashes and the vectors to add to the index once committed
+        """
+        new_hashes, new_vectors, seen = [], [], set()
+        for hash_, page_content, vector in chunks:
+            if hash_ in self._positions or hash_ in seen:
+                continue
+            seen.add(hash_)
+            blob = np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else b""
+            # a chunk stored without a vector gets the first one given
+            self._conn.execute("INSERT INTO chunks VALUES (?, ?, ?) ON CONFLICT(hash) DO UPDATE SET "
+                               "vector = excluded.vector WHERE length(chunks.vector) = 0",
+                               (hash_, page_content, blob))
+            if vector is not None:
+                new_hashes.append(hash_)
+                new_vectors.append(vector)
+        return new_hashes, new_vectors
+
+    def _fresh_sources(self, urls):
+        urls = list(dict.fromkeys(urls))
+        fresh = {}
+        for i in range(0, len(urls), 500):
+            batch = urls[i:i + 500]
+            rows = self._conn.execute(f"SELECT url, title FROM sources WHERE fetched_at > ? AND url IN "
+                                      f"({','.join('?' * len(batch))})", [time.time() - self.ttl] + batch).fetchall()
+            fresh.update(rows)
+        return fresh
+
+    def search_sources(self, query, k=5, similarity_threshold=None) -> List[str]:
+        """
+        Args:
+            query: research query
+            k: max number of sources
+            similarity_threshold: a source is only returned when one of its chunks is more similar than it
+
+        Returns: the fresh sources holding the chunks most similar to the query, most similar first
+        """
+        with tracer.span("knowledge_base.search", k=k) as span:
+            if self._index is None:
+                return []
+            embedding = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+            faiss.normalize_L2(embedding)
+            with self._lock:
+                # a chunk may belong to no fresh source, look at more chunks than sources needed
+                scores, positions = self._index.search(embedding, min(self._index.ntotal, k * 8))
+                hashes = [self._hashes[position] for score, position in zip(scores[0], positions[0])
+                          if position >= 0 and (similarity_threshold is None or score > similarity_threshold)]
+                if not hashes:
+                    return []
+                rows = self._conn.execute(f"SELECT hash, url FROM source_chunks WHERE hash IN "
+                                          f"({','.join('?' * len(hashes))})", hashes).fetchall()
+                urls_of = {}
+                for hash_, url in rows:
+                    urls_of.setdefault(hash_, []).append(url)
+                fresh = self._fresh_sources(url for urls in urls_of.values() for url in urls)
+            sources = []
+            for hash_ in hashes:
+                for url in urls_of.get(hash_, []):
+                    if url in fresh and url not in sources:
+                        sources.append(url)
+            span.set(sources=len(sources[:k]))
+        return sources[:k]
+
+    def fresh_sources(self, urls) -> List[str]:
+        """ Returns: the urls that have a fresh copy in the knowledge base """
+        with self._lock:
+            fresh = self._fresh_sources(urls)
+        return [url for url in urls if url in fresh]
+
+    def get_pages(self, urls):
+        """
+        Args:
+            urls: source urls
+
+        Returns: (pages, documents, vectors) of the fresh sources among the urls, pages are formatted like the
+        scraper's output, documents are the chunks of the pages located in them by start_index,
+        the vector of a chunk is None if it was never embedded
+        """
+        pages, documents, vectors = [], [], []
+        with self._lock:
+            for url, title in self._fresh_sources(urls).items():
+                rows = self._conn.execute("SELECT c.page_content, c.vector FROM source_chunks s JOIN chunks c "
+                                          "ON s.hash = c.hash WHERE s.url = ? ORDER BY s.chunk_id", (url,)).fetchall()
+                if not rows:
+                    continue
+                page = self._conn.execute("SELECT content FROM pages WHERE url = ?", (url,)).fetchone()
+                # the sources stored before the page text are rebuilt from their chunks, overlaps included
+                content = zlib.decompress(page[0]).decode("utf-8") if page else "\n".join(row[0] for row in rows)
+                pages.append({"url": url, "raw_content": content, "title": title})
+                start = 0
+                for chunk_id, (page_content, vector) in enumerate(rows):
+                    metadata = {"source": url, "chunk_id": chunk_id, "title": title}
+                    index = content.find(page_content, start)
+                    if index >= 0:
+                        # the next chunk may overlap this one, search it from just after this start
+                        metadata["start_index"] = index
+                        start = index + 1
+                    documents.append(Document(page_content=page_content, metadata=metadata))
+                    vectors.append(self._vector(vector))
+            self.served_sources += len(pages)
+        return pages, documents, vectors
+
+    def stats(self):
+        with self._lock:
+            sources = self._conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+            return {"sources": sources, "chunks": len(self._hashes), "served_sources": self.served_sources,
+                    "reused_vectors": self.reused_vectors}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_knowledge_base(cfg, embeddings):
+    """
+    Returns: the knowledge base shared by the tasks, None if KNOWLEDGE_BASE is disabled
+    """
+    if not cfg.knowledge_base:
+        return None
+    return KnowledgeBase(cfg.knowledge_base_dir, embeddings, ttl=cfg.knowledge_base_ttl)
@@ -1,5 +1,9 @@
+import hashlib
+import threading
 from typing import List
 
+import numpy as np
+
 from .retriever import SearchAPIRetriever
 from langchain.retrievers import (
     ContextualCompressionRetriever,
@@ -9,31 +13,56 @@ from langchain.retrievers.document_compressors import (
     EmbeddingsFilter,
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from insight_researcher import log
+from insight_researcher import log, PROJECT_ROOT
+from insight_researcher.utils.tracing import tracer
+from insight_researcher.utils.url import canonicalize_url
+from insight_researcher.utils.events import EventEmitter
 from .faiss_storage import FaissStorage
+from .faiss_index import FaissIndexBuilder
+from .embedding_cache import CachedEmbeddings
+from .embedding_executor import EmbeddingExecutor
+from .embeddings import get_embeddings
+from .knowledge_base import get_knowledge_base
+from .near_duplicates import NearDuplicateFilter
+from .page_store import PageStore
+from .message_log import MessageLog
+from .ingest import IngestPipeline
+from .context_packer import ContextPacker
 from langchain.schema import Document
 
 
 class Memory:
-    def __init__(self, cfg, task_id):
+    def __init__(self, cfg, task_id, embeddings=None, knowledge_base=None, events=None):
         """
-        self.documents = []  # scraper page content list: [{"url": "url1", "raw_content": "content1"}, {"url": "url2", "raw_content": "content2"}]
-        self.context = {}  # scraper page content dict: {"url1": "content1", "url2": "content2"}
-        self.messages = [] # OpenAI chat messages, not used currently, for future
+        embeddings: embeddings shared with other tasks (and their caches and rate limits), built from cfg if None
+        knowledge_base: KnowledgeBase shared with other tasks, built from cfg if None (None if it is disabled)
+        events: EventEmitter of the task, receives the indexed chunks
+        self.context = PageStore()  # scraper page content map: {"url1": "content1", "url2": "content2"}, compressed
+        self.messages = MessageLog()  # OpenAI chat messages, capped in size, not used currently, for future
+        self.documents  # scraper page content list: [{"url": "url1", "raw_content": "content1"}, ...], read only
         """
         self.task_id = task_id
         self.cfg = cfg
-        self.embeddings = OpenAIEmbeddings()
-        self.documents = []
-        self.context = {}
-        self.messages = []
-        self.faiss_storage = FaissStorage(task_id, self.embeddings)
+        self.events = events if events is not None else EventEmitter(task_id)
+        self._lock = threading.RLock()  # sub queries are researched concurrently and share this memory
+        self.embeddings = embeddings if embeddings is not None else get_embeddings(cfg)
+        self.context = PageStore(PROJECT_ROOT / f"mem/{task_id}/pages.sqlite",
+                                 max_bytes=cfg.page_store_max_mb * 1024 * 1024)
+        self.messages = MessageLog(cfg.message_log_max_chars)
+        self._url_keys = set()  # canonical urls of the pages in context, variants of a url are scraped once
+        self.knowledge_base = knowledge_base if knowledge_base is not None else get_knowledge_base(cfg,
+                                                                                                   self.embeddings)
+        self.faiss_storage = FaissStorage(task_id, self.embeddings, FaissIndexBuilder.from_config(cfg),
+                                          persist=cfg.memory_persist, pages=self.context)
         self.top_k = cfg.max_search_results_per_query
+        # per task, the chunks of a report only need to be distinct from each other
+        self.near_duplicate_filter = NearDuplicateFilter(cfg.near_duplicate_threshold) \
+            if cfg.near_duplicate_filter else None
 
     def _get_contextual_retriever(self, pages):
         splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        relevance_filter = EmbeddingsFilter(embeddings=self.embeddings, similarity_threshold=0.78)
+        relevance_filter = EmbeddingsFilter(embeddings=self.embeddings,
+                                            similarity_threshold=self.cfg.similarity_threshold)
         pipeline_compressor = DocumentCompressorPipeline(
             transformers=[splitter, relevance_filter]
         )
@@ -45,16 +74,25 @@ class Memory:
         )
         return contextual_retriever
 
+    def _format_doc(self, doc):
+        return (f"Source: {doc.metadata.get('source')}\n"
+                f"Title: {doc.metadata.get('title')}\n"
+                f"Content: {doc.page_content}\n")
+
     def _pretty_print_docs(self, docs):
-        return f"\n".join(f"Source: {d.metadata.get('source')}\n"
-                          f"Title: {d.metadata.get('title')}\n"
-                          f"Content: {d.page_content}\n"
-                          for i, d in enumerate(docs) if i < self.top_k)
+        return f"\n".join(self._format_doc(d) for i, d in enumerate(docs) if i < self.top_k)
 
-    def _get_context(self, query, pages):
+    def _get_similar_docs(self, query, pages):
+        if self.cfg.relevance_mode == "index":
+            # pages are already chunked and indexed by add_memory, only the query needs to be embedded
+            scored_docs = self.faiss_storage.search_by_sources(query, [page["url"] for page in pages],
+                                                               self.cfg.similarity_threshold)
+            return [doc for doc, score in scored_docs]
         compressed_docs = self._get_contextual_retriever(pages)
-        relevant_docs = compressed_docs.get_relevant_documents(query)  # 这句代码开始真正执行相似度计算，比较耗时
-        return self._pretty_print_docs(relevant_docs)
+        return compressed_docs.get_relevant_documents(query)  # 这句代码开始真正执行相似度计算，比较耗时
+
+    def _get_context(self, query, pages):
+        return self._pretty_print_docs(self._get_similar_docs(query, pages))
 
     def add_memory(self, url_content_list):
         """
@@ -63,24 +101,188 @@ class Memory:
             [{"url": "url1", "raw_content": "content1"}, {"url": "url2", "raw_content": "content2"}]
 
         """
-        self.documents.extend(url_content_list)
+        self.record_pages(url_content_list)
+        self.add_chunks(self.split_pages(url_content_list))
+
+    def _kept_chunks(self, documents):
+        """
+        Returns: the indices of the documents that are not near duplicates of the chunks seen before
+        """
+        if self.near_duplicate_filter is None or not documents:
+            return list(range(len(documents)))
+        with tracer.span("memory.dedupe", chunks=len(documents)) as span:
+            kept = self.near_duplicate_filter.filter([document.page_content for document in documents])
+            span.set(dropped=len(documents) - len(kept))
+        return kept
+
+    def _embed_missing(self, documents, vectors):
+        """
+        embed the documents whose vector is None, in place
+        Returns: the indices of the embedded documents
+        """
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with tracer.span("memory.embed", chunks=len(missing),
+                             chars=sum(len(documents[i].page_content) for i in missing)):
+                embedded = self.embeddings.embed_documents([documents[i].page_content for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        return missing
+
+    def add_chunks(self, documents):
+        """
+        index the chunks of scraped pages, the near duplicates of the chunks seen before are dropped first,
+        the chunks already in the knowledge base reuse its vectors instead of being embedded,
+        and all of them are recorded in it for later tasks
+        Args:
+            documents: chunks of the pages, see split_pages
+        """
+        kept = self._kept_chunks(documents)
+        self._add_chunks(documents, kept)
+        if documents:
+            self.events.emit("chunks", chunks=len(kept), dropped=len(documents) - len(kept))
+
+    def _add_chunks(self, documents, kept):
+        kept_documents = [documents[i] for i in kept]
+        if self.knowledge_base is None:
+            self.faiss_storage.add(kept_documents)
+            return
+        if not documents:
+            return
+        vectors = self.knowledge_base.get_vectors([document.page_content for document in kept_documents])
+        self._embed_missing(kept_documents, vectors)
+        self.faiss_storage.add(kept_documents, vectors)
+        # the near duplicates are only such in this task, the knowledge base keeps the whole pages for the
+        # others and stores them without a vector
+        all_vectors = [None] * len(documents)
+        for i, vector in zip(kept, vectors):
+            all_vectors[i] = vector
+        self.knowledge_base.add_chunks(documents, all_vectors)
+
+    def add_known_pages(self, pages, documents, vectors):
+        """
+        add the pages served by the knowledge base, their chunks are indexed with the stored vectors
+        Args:
+            pages: url-content pairs, see add_memory
+            documents: chunks of the pages
+            vectors: vectors of the chunks
+        """
+        self.record_pages(pages, fetched=False)
+        kept = self._kept_chunks(documents)
+        kept_documents, kept_vectors = [documents[i] for i in kept], [vectors[i] for i in kept]
+        # chunks another task dropped as near duplicates were stored without a vector
+        embedded = self._embed_missing(kept_documents, kept_vectors)
+        if embedded:
+            self.knowledge_base.add_vectors([kept_documents[i] for i in embedded],
+                                            [kept_vectors[i] for i in embedded])
+        self.faiss_storage.add(kept_documents, kept_vectors)
+        if documents:
+            self.events.emit("chunks", chunks=len(kept), dropped=len(documents) - len(kept))
+
+    def add_memory_stream(self, url_content_iter):
+        """
+        Same as add_memory, but pages are split and embedded while the rest of them are still being scraped
+        Args:
+            url_content_iter: iterable of url-content pairs, e.g. Scraper.iter_run(urls)
+
+        Returns: the url-content pairs in arrival order
+        """
+        pipeline = IngestPipeline(self, queue_size=self.cfg.ingest_queue_size, batch_size=self.cfg.embed_batch_size,
+                                  flush_interval=self.cfg.embed_flush_interval)
+        return pipeline.run(url_content_iter)
+
+    def record_pages(self, url_content_list, fetched=True):
+        """
+        Args:
+            url_content_list: url-content pairs, see add_memory
+            fetched: the pages were just scraped, their chunks replace the previous ones in the knowledge base
+        """
+        if fetched and self.knowledge_base is not None:
+            self.knowledge_base.start_fetch([url_content for url_content in url_content_list
+                                             if url_content["raw_content"] is not None])
+        with self._lock:
+            for url_content in url_content_list:
+                self.context[url_content["url"]] = url_content["raw_content"]
+
+    @property
+    def documents(self):
+        """ the scraped pages in scraping order, their contents are decompressed on access """
+        return [{"url": url, "raw_content": content} for url, content in self.context.items() if content is not None]
+
+    def split_pages(self, url_content_list):
+        with tracer.span("memory.split", pages=len(url_content_list)) as span:
+            lc_documents = self._split_pages(url_content_list)
+            span.set(chunks=len(lc_documents))
+        return lc_documents
+
+    def _split_pages(self, url_content_list):
         lc_documents = []
         for url_content in url_content_list:
-            self.context.update({url_content["url"]: url_content["raw_content"]})
             if url_content["raw_content"] is not None:
                 # 之所以在这里才做非None判断，是因为self.context中的key要做已爬url去重，即使爬虫爬不到内容的url也要留着，防止无效重爬
                 splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+                start = -1
                 for idx, chunk in enumerate(splitter.split_text(url_content["raw_content"])):
+                    # the offset of the chunk in its page lets the docstore keep it by reference
+                    start = url_content["raw_content"].find(chunk, start + 1)
                     lc_documents.append(
-                        Document(page_content=chunk, metadata={"source": url_content["url"], "chunk_id": idx}))
-        self.faiss_storage.add(lc_documents)
+                        Document(page_content=chunk, metadata={"source": url_content["url"], "chunk_id": idx,
+                                                             "title": url_content.get("title", ""),
+                                                             "start_index": start}))
+        return lc_documents
 
     def get_similar_content_by_query(self, query, pages):
         return self._get_context(query, pages)
 
+    def get_similar_docs_by_query(self, query, pages):
+        """ Returns: the top_k chunks of the pages similar to the query """
+        return self._get_similar_docs(query, pages)[:self.top_k]
+
     def retrieve_memory(self, query):
-        docs = self.faiss_storage.search_similar(query, k=self.top_k)
-        return self._pretty_print_docs(docs)
+        return self._pretty_print_docs(self.retrieve_memory_docs(query))
+
+    def retrieve_memory_docs(self, query):
+        return self.faiss_storage.search_similar(query, k=self.top_k)
+
+    def pack_context(self, query_docs, token_budget, model):
+        """
+        dedupe the chunks retrieved for several queries, rank them by relevance with diversity (MMR)
+        and fill the context up to the token budget
+        Args:
+            query_docs: [(query, [Document])] pairs
+            token_budget: max tokens of the context
+            model: model whose tokenizer counts the tokens
+
+        Returns: formatted context
+        """
+        with tracer.span("memory.pack_context", token_budget=token_budget) as span:
+            context = self._pack_context(query_docs, token_budget, model)
+            span.set(chars=len(context))
+        return context
+
+    def _pack_context(self, query_docs, token_budget, model):
+        docs = {}
+        for query, query_doc_list in query_docs:
+            for doc in query_doc_list:
+                docs.setdefault(hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest(), doc)
+        docs = list(docs.values())
+        if not docs:
+            return ""
+        vectors = self.faiss_storage.get_vectors(docs)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # chunks re-split by the compression pipeline carry no index position, embed them (cached)
+            for i, vector in zip(missing, self.embeddings.embed_documents([docs[i].page_content for i in missing])):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+        vectors = np.vstack(vectors)
+        query_vectors = np.asarray([self.embeddings.embed_query(query) for query, _ in query_docs], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True) * np.linalg.norm(query_vectors, axis=1)
+        relevance = (vectors @ query_vectors.T / np.where(norms == 0, 1, norms)).max(axis=1)
+        texts = [self._format_doc(doc) for doc in docs]
+        packer = ContextPacker(token_budget, model, diversity=self.cfg.context_diversity)
+        selected = packer.pack(texts, relevance, vectors)
+        log.info(f"Packed {len(selected)} of {len(docs)} unique chunks into the context")
+        return "\n".join(texts[i] for i in selected)
 
     def get_new_urls(self, url_set_input):
         """ Gets the new urls from the given url set.
@@ -89,12 +291,55 @@ class Memory:
         """
 
         new_urls = []
-        for url in url_set_input:
-            if url not in self.context.keys():
-                log.info(f"✅ Adding source url to research: {url}")
-                new_urls.append(url)
+        with self._lock:
+            for url in url_set_input:
+                key = canonicalize_url(url)
+                if key not in self._url_keys and url not in self.context:
+                    self._url_keys.add(key)
+                    log.info(f"✅ Adding source url to research: {url}")
+                    new_urls.append(url)
+                    # 先占位，防止并发的其他子查询重复爬取同一个url，爬取完成后在add_memory中更新内容
+                    self.context[url] = None
 
         return new_urls
 
+    def get_embedding_cache_stats(self):
+        """ Returns: hit and miss counts of the embedding cache, None if the cache is disabled """
+        if isinstance(self.embeddings, CachedEmbeddings):
+            return self.embeddings.stats()
+        return None
+
+    def get_embedding_metrics(self):
+        """ Returns: throughput metrics of the embedding executor, None if there is no executor """
+        embeddings = self.embeddings.embeddings if isinstance(self.embeddings, CachedEmbeddings) else self.embeddings
+        if isinstance(embeddings, EmbeddingExecutor):
+            return embeddings.metrics()
+        return None
+
+    def get_near_duplicate_stats(self):
+        """ Returns: checked and dropped chunk counts of the near duplicate filter, None if it is disabled """
+        if self.near_duplicate_filter is not None:
+            return self.near_duplicate_filter.stats()
+        return None
+
+    def persist(self):
+        """ checkpoint the faiss index of a persisted memory, the chunks themselves are persisted as they are added """
+        if self.cfg.memory_persist:
+            self.faiss_storage.persist()
+
+    def release(self):
+        """
+        free the pages, chunks, vectors and messages of the task once it has ended, the persisted chunks and the
+        shared knowledge base are kept. The memory can still be used afterwards, it is empty.
+        """
+        with self._lock:
+            self.faiss_storage.release()
+            self.context.release()
+            self._url_keys = set()
+            self.messages.clear()
+            if self.near_duplicate_filter is not None:
+                self.near_duplicate_filter = NearDuplicateFilter(self.cfg.near_duplicate_threshold)
+        log.info(f"Released the memory of task {self.task_id}")
+
     def add_messages(self, messages):
         self.messages.extend(messages)
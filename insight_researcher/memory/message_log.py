@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+
+
+class MessageLog:
+    """
+    Chat messages of a task, capped in size: a message longer than max_chars is cut to its first max_chars
+    characters (the prompts carry the whole research context), and the oldest messages are dropped once the
+    log holds more than max_chars characters in total.
+    """
+
+    def __init__(self, max_chars=100000):
+        """
+        Args:
+            max_chars: max characters of the messages kept, 0 keeps no message
+        """
+        self.max_chars = max_chars
+        self.chars = 0
+        self.dropped = 0
+        self._messages = deque()
+        self._lock = threading.Lock()
+
+    def extend(self, messages):
+        with self._lock:
+            if self.max_chars <= 0:
+                self.dropped += sum(1 for _ in messages)
+                return
+            for message in messages:
+                content = message.get("content") or ""
+                if len(content) > self.max_chars:
+                    message = dict(message, content=content[:self.max_chars], truncated=True)
+                    content = message["content"]
+                self._messages.append(message)
+                self.chars += len(content)
+            while self._messages and self.chars > self.max_chars:
+                self.chars -= len(self._messages.popleft().get("content") or "")
+                self.dropped += 1
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._messages))
+
+    def __len__(self):
+        return len(self._messages)
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self.chars = 0
@@ -0,0 +1,92 @@
+import threading
+from typing import List
+
+import numpy as np
+
+FINGERPRINT_BITS = 64
+
+
+class NearDuplicateFilter:
+    """
+    Drops the chunks that are near duplicates of the chunks seen before, e.g. syndicated articles, mirrored press
+    releases and boilerplate blocks, so that they are never embedded, indexed nor packed into a prompt.
+    Every chunk gets a 64-bit SimHash of its character n-grams, chunks whose fingerprints differ in at most
+    max_distance bits are near duplicates. The fingerprints are split into max_distance + 1 bands: two
+    fingerprints within max_distance bits agree on at least one band, so only the fingerprints sharing a band
+    with the new one are compared instead of all of them.
+    """
+
+    def __init__(self, threshold=0.9, ngram=5):
+        """
+        Args:
+            threshold: similarity (1 - differing bits / 64) above which a chunk is a near duplicate,
+                1.0 drops the exact duplicates only
+            ngram: characters per shingle
+        """
+        self.threshold = threshold
+        self.ngram = ngram
+        self.max_distance = min(int((1 - threshold) * FINGERPRINT_BITS), FINGERPRINT_BITS // 2 - 1)
+        bands = self.max_distance + 1
+        bounds = [FINGERPRINT_BITS * i // bands for i in range(bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._buckets = [{} for _ in self._bands]  # band value -> fingerprints
+        self.checked = 0
+        self.dropped = 0
+        self.dropped_chars = 0
+        self._lock = threading.Lock()
+
+    def fingerprint(self, text) -> int:
+        codes = np.frombuffer(" ".join(text.lower().split()).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = min(self.ngram, len(codes))
+        if n == 0:
+            return 0
+        h = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        for k in range(n):
+            # polynomial rolling hash, uint64 arithmetic wraps around
+            h = h * np.uint64(1000003) + codes[k:len(codes) - n + 1 + k]
+        # a shingle counts once however often it repeats, then splitmix64 spreads it over all the bits
+        h = np.unique(h)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+        bits = np.unpackbits(h.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(h)
+        return int(np.packbits(majority, bitorder="little").view(np.uint64)[0])
+
+    def _find(self, fingerprint):
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            for other in buckets.get((fingerprint >> start) & mask, ()):
+                if (fingerprint ^ other).bit_count() <= self.max_distance:
+                    return True
+        return False
+
+    def _add(self, fingerprint):
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            buckets.setdefault((fingerprint >> start) & mask, []).append(fingerprint)
+
+    def filter(self, texts: List[str]) -> List[int]:
+        """
+        Args:
+            texts: chunks in arrival order, a chunk is also compared with the ones before it in the list
+
+        Returns: the indices of the texts to keep, the other ones are counted as dropped
+        """
+        fingerprints = [self.fingerprint(text) for text in texts]
+        kept = []
+        with self._lock:
+            for i, fingerprint in enumerate(fingerprints):
+                if self._find(fingerprint):
+                    self.dropped += 1
+                    self.dropped_chars += len(texts[i])
+                else:
+                    self._add(fingerprint)
+                    kept.append(i)
+            self.checked += len(texts)
+        return kept
+
+    def stats(self):
+        with self._lock:
+            return {"checked": self.checked, "dropped": self.dropped, "dropped_chars": self.dropped_chars,
+                    "drop_rate": self.dropped / self.checked if self.checked else 0.0}
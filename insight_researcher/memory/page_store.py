@@ -0,0 +1,174 @@
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from typing import Dict, Optional
+
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+ChunkRef = namedtuple("ChunkRef", ["source", "start", "length", "metadata"])
+_SPILLED = object()
+
+
+class PageStore:
+    """
+    url -> page content map of a task, the placeholder None marks a url being scraped or not scrapable.
+    The contents are kept zlib compressed, and once they exceed max_bytes the oldest ones are spilled to a
+    SQLite file, so a task holds a bounded amount of page text in RAM however many pages it scrapes.
+    The last decompressed pages are cached, the chunks of a page are usually read together.
+    """
+
+    def __init__(self, spill_path=None, max_bytes=None, level=6, cache_size=8):
+        """
+        Args:
+            spill_path: SQLite file of the spilled pages, created when the first page is spilled
+            max_bytes: compressed bytes kept in RAM, None means never spill
+            level: zlib compression level
+            cache_size: number of decompressed pages cached
+        """
+        self.spill_path = Path(spill_path) if spill_path is not None else None
+        self.max_bytes = max_bytes if spill_path is not None else None
+        self.level = level
+        self.cache_size = cache_size
+        self.raw_chars = 0
+        self.stored_bytes = 0
+        self.spilled = 0
+        self._pages: Dict[str, Optional[bytes]] = {}
+        self._cache = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return url in self._pages
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self):
+        return iter(list(self._pages))
+
+    def keys(self):
+        return list(self._pages)
+
+    def __getitem__(self, url):
+        if url not in self._pages:
+            raise KeyError(url)
+        return self.get(url)
+
+    def __setitem__(self, url, content):
+        data = zlib.compress(content.encode("utf-8"), self.level) if content is not None else None
+        with self._lock:
+            self._discard(url)
+            self._pages[url] = data
+            if data is not None:
+                self.raw_chars += len(content)
+                self.stored_bytes += len(data)
+                self._spill()
+
+    def get(self, url, default=None):
+        with self._lock:
+            if url in self._cache:
+                self._cache.move_to_end(url)
+                return self._cache[url]
+            data = self._pages.get(url)
+            if data is _SPILLED:
+                data = self._conn.execute("SELECT content FROM pages WHERE url = ?", (url,)).fetchone()[0]
+            if data is None:
+                return default
+            content = zlib.decompress(data).decode("utf-8")
+            self._cache[url] = content
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return content
+
+    def items(self):
+        for url in self.keys():
+            yield url, self.get(url)
+
+    def _discard(self, url):
+        data = self._pages.pop(url, None)
+        self._cache.pop(url, None)
+        if data is _SPILLED:
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+        elif data is not None:
+            self.stored_bytes -= len(data)
+
+    def _spill(self):
+        if self.max_bytes is None or self.stored_bytes <= self.max_bytes:
+            return
+        if self._conn is None:
+            self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.spill_path), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=OFF")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content BLOB)")
+        # spill down to 90% so that every page near the bound does not trigger a spill again
+        target = self.max_bytes * 0.9
+        rows = []
+        for url, data in self._pages.items():
+            if self.stored_bytes <= target:
+                break
+            if data is None or data is _SPILLED:
+                continue
+            rows.append((url, data))
+            self.stored_bytes -= len(data)
+        self._conn.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?)", rows)
+        for url, _ in rows:
+            self._pages[url] = _SPILLED
+        self.spilled += len(rows)
+
+    def stats(self):
+        with self._lock:
+            return {"pages": len(self._pages), "raw_chars": self.raw_chars, "stored_bytes": self.stored_bytes,
+                    "spilled": self.spilled}
+
+    def release(self):
+        """ forget all the pages and delete the spill file """
+        with self._lock:
+            self._pages = {}
+            self._cache.clear()
+            self.raw_chars = self.stored_bytes = self.spilled = 0
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self.spill_path.unlink(missing_ok=True)
+
+
+class ChunkDocstore(InMemoryDocstore):
+    """
+    Docstore of FaissStorage holding the chunks of the pages in the PageStore by reference: a chunk whose
+    start_index locates it in its page is kept as (source, start, length, metadata) and sliced out of the page
+    when it is searched, so the text of a page is held once. The other chunks are kept as documents.
+    """
+
+    def __init__(self, pages: PageStore, _dict=None):
+        super().__init__(_dict)
+        self.pages = pages
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = set(texts).intersection(self._dict)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        # updated in place, InMemoryDocstore copies the whole dict on every add
+        for _id, document in texts.items():
+            self._dict[_id] = self._compact(document)
+
+    def _compact(self, document):
+        source, start = document.metadata.get("source"), document.metadata.get("start_index")
+        if start is None or source not in self.pages:
+            return document
+        content = self.pages.get(source)
+        if content is None or content[start:start + len(document.page_content)] != document.page_content:
+            return document
+        return ChunkRef(source, start, len(document.page_content), document.metadata)
+
+    def search(self, search: str):
+        entry = self._dict.get(search)
+        if entry is None:
+            return f"ID {search} not found."
+        if isinstance(entry, ChunkRef):
+            content = self.pages.get(entry.source) or ""
+            return Document(page_content=content[entry.start:entry.start + entry.length], metadata=entry.metadata)
+        return entry
@@ -0,0 +1,3 @@
+from .server import ResearchService, create_app, run_server
+
+__all__ = ['ResearchService', 'create_app', 'run_server']
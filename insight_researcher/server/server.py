@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, WSMsgType
+from insight_researcher.config import Config
+from insight_researcher.agent import Agent, SharedResources
+from insight_researcher.utils import log, new_task_id
+
+REPORT_TYPES = ['outline_report', 'full_report']
+
+
+class WebSocketBridge:
+    """
+    The websocket parameter of Agent receives the task events synchronously from the research threads,
+    forward its send_json to the aiohttp websocket on the event loop
+    """
+
+    def __init__(self, ws, loop):
+        self.ws = ws
+        self.loop = loop
+
+    def send_json(self, data):
+        if not self.ws.closed:
+            asyncio.run_coroutine_threadsafe(self.ws.send_json(data), self.loop)
+
+
+class ResearchJob:
+    """
+    One research task submitted to the service
+    """
+
+    def __init__(self, query, report_type):
+        self.task_id = new_task_id()
+        self.query = query
+        self.report_type = report_type
+        self.status = "pending"  # pending, running, done or failed
+        self.report = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+
+    def to_dict(self, with_report=True):
+        job = {"task_id": self.task_id, "query": self.query, "report_type": self.report_type,
+               "status": self.status, "error": self.error, "created_at": self.created_at,
+               "finished_at": self.finished_at}
+        if with_report:
+            job["report"] = self.report
+        return job
+
+
+class ResearchService:
+    """
+    Long-running research service: accepts research jobs over HTTP and websocket and runs many of them at once
+    in one process. The jobs share the SharedResources (connection pools, page/search/embedding/LLM caches,
+    embedding rate limits, tokenizers), each job gets its own Agent, Memory and task id.
+    """
+
+    def __init__(self, resources=None, max_jobs=4, max_finished_jobs=1000):
+        """
+        Args:
+            resources: SharedResources of the jobs, built from Config() if None
+            max_jobs: number of jobs running at once, the others wait in the queue
+            max_finished_jobs: finished jobs kept for status queries, the oldest ones are forgotten first
+        """
+        self.resources = resources if resources is not None else SharedResources()
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="research")
+
+    def submit(self, query, report_type="full_report", websocket=None):
+        """
+        Args:
+            query: research query
+            report_type: outline_report or full_report
+            websocket: object with send_json(dict) receiving the events of the job
+
+        Returns: the ResearchJob, its future resolves when the job finishes
+        """
+        job = ResearchJob(query, report_type)
+        self.jobs[job.task_id] = job
+        self._forget_finished_jobs()
+        job.future = asyncio.wrap_future(self.executor.submit(self._run_job, job, websocket))
+        return job
+
+    def _run_job(self, job, websocket):
+        job.status = "running"
+        try:
+            agent = Agent(job.query, report_type=job.report_type, task_id=job.task_id, resources=self.resources,
+                          websocket=websocket)
+            job.report = agent.run()
+            job.status = "done"
+        except Exception as e:
+            log.error(f"Error in research job {job.task_id}: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+        return job
+
+    def _forget_finished_jobs(self):
+        finished = [task_id for task_id, job in self.jobs.items() if job.finished_at is not None]
+        for task_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[task_id]
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.resources.close()
+
+    @staticmethod
+    def _validate(data):
+        if not isinstance(data, dict) or not data.get("query"):
+            return "query is required"
+        if data.get("report_type", "full_report") not in REPORT_TYPES:
+            return f"report_type must be one of {REPORT_TYPES}"
+        return None
+
+    async def handle_submit(self, request):
+        """ POST /research {"query": "...", "report_type": "full_report"}, returns the job without waiting for it """
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": "invalid json"}, status=400)
+        error = self._validate(data)
+        if error is not None:
+            return web.json_response({"error": error}, status=400)
+        job = self.submit(data["query"], data.get("report_type", "full_report"))
+        return web.json_response(job.to_dict(with_report=False), status=202)
+
+    async def handle_status(self, request):
+        """ GET /research/{task_id}, returns the job with its report once it is done """
+        job = self.jobs.get(request.match_info["task_id"])
+        if job is None:
+            return web.json_response({"error": "task not found"}, status=404)
+        return web.json_response(job.to_dict())
+
+    async def handle_list(self, request):
+        """ GET /research, returns the known jobs without their reports """
+        return web.json_response([job.to_dict(with_report=False) for job in self.jobs.values()])
+
+    async def handle_websocket(self, request):
+        """
+        GET /ws, every {"query": "...", "report_type": "..."} message starts a job, the job streams its events
+        as {"type": ..., "task_id": ...} messages, see EVENT_TYPES, and ends with {"type": "done"}
+        """
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        bridge = WebSocketBridge(ws, asyncio.get_running_loop())
+        notifiers = set()
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(msg.data)
+            except json.JSONDecodeError:
+                data = None
+            error = self._validate(data)
+            if error is not None:
+                await ws.send_json({"type": "error", "output": error})
+                continue
+            job = self.submit(data["query"], data.get("report_type", "full_report"), websocket=bridge)
+            await ws.send_json({"type": "task", "task_id": job.task_id})
+            # wait for the job in the background, the client may start other jobs meanwhile
+            notifier = asyncio.create_task(self._notify_done(ws, job))
+            notifiers.add(notifier)
+            notifier.add_done_callback(notifiers.discard)
+        return ws
+
+    @staticmethod
+    async def _notify_done(ws, job):
+        await job.future
+        if not ws.closed:
+            await ws.send_json(dict(job.to_dict(), type="done"))
+
+
+def create_app(service):
+    app = web.Application()
+    app.add_routes([web.post("/research", service.handle_submit),
+                    web.get("/research", service.handle_list),
+                    web.get("/research/{task_id}", service.handle_status),
+                    web.get("/ws", service.handle_websocket)])
+
+    async def close_service(app):
+        service.close()
+
+    app.on_cleanup.append(close_service)
+    return app
+
+
+def run_server(cfg=None):
+    """
+    Runs the research service until interrupted
+    Args:
+        cfg: config of the service and of all its jobs, Config() if None
+    """
+    cfg = cfg if cfg is not None else Config()
+    service = ResearchService(SharedResources(cfg), max_jobs=cfg.server_max_jobs,
+                              max_finished_jobs=cfg.server_max_finished_jobs)
+    log.info(f"Research server listening on http://{cfg.server_host}:{cfg.server_port}, "
+             f"running up to {cfg.server_max_jobs} jobs at once")
+    web.run_app(create_app(service), host=cfg.server_host, port=cfg.server_port, print=None)
@@ -1,4 +1,5 @@
-from .tools import Tool
+from .tools import Tool, get_tool_retriever, get_tool_scraper
+from .url_registry import UrlRegistry, get_url_registry
 
-__all__ = ['Tool']
+__all__ = ['Tool', 'get_tool_retriever', 'get_tool_scraper', 'UrlRegistry', 'get_url_registry']
 
@@ -0,0 +1,84 @@
+import random
+import time
+from urllib.parse import quote_plus, unquote_plus, urlparse
+
+WORDS = ("market growth revenue agent model data risk investment platform adoption enterprise customer technology "
+         "research regulation competition startup funding workflow automation benchmark cost analysis forecast "
+         "strategy product service industry report survey trend demand supply network security privacy "
+         "infrastructure cloud open source language reasoning planning memory tool evaluation deployment").split()
+
+
+class SyntheticCorpus:
+    """
+    Seeded synthetic web corpus behind MOCK_SEARCH and MOCK_SCRAPE.
+    Search results and page texts are generated from the seed, the query and the url alone, so the mock
+    retriever and the mock scraper agree without sharing state and every run sees the same corpus.
+    Part of the results of every query point at a shared pool of pages, like popular sites on the real web,
+    so the url dedupe between sub queries is exercised too.
+    """
+    BASE_URL = "https://mock.insight-researcher.local"
+    SHARED_PAGES = 200
+    SHARED_RATIO = 0.2
+
+    def __init__(self, seed=0, page_size=5000, results=0, search_latency=0.0, scrape_latency=0.0, jitter=0.0):
+        """
+        Args:
+            seed: seed of the corpus
+            page_size: characters per page
+            results: results per search, 0 to return as many as requested
+            search_latency: seconds each search takes
+            scrape_latency: seconds each page download takes
+            jitter: the latencies vary uniformly by +/- this many seconds
+        """
+        self.seed = seed
+        self.page_size = page_size
+        self.results = results
+        self.search_latency = search_latency
+        self.scrape_latency = scrape_latency
+        self.jitter = jitter
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(seed=cfg.mock_seed, page_size=cfg.mock_page_size, results=cfg.mock_search_results,
+                   search_latency=cfg.mock_search_latency, scrape_latency=cfg.mock_scrape_latency,
+                   jitter=cfg.mock_latency_jitter)
+
+    def delay(self, latency):
+        """ sleep for the latency with jitter, it is called from many threads at once """
+        if latency or self.jitter:
+            time.sleep(max(0.0, latency + random.uniform(-self.jitter, self.jitter)))
+
+    def search(self, query, max_results=5):
+        """
+        Returns: search results like the real retrievers, [{"href": url, "title": title, "body": snippet}]
+        """
+        rng = random.Random(f"{self.seed}:search:{query}")
+        results = []
+        for i in range(self.results or max_results):
+            if rng.random() < self.SHARED_RATIO:
+                url = f"{self.BASE_URL}/page/{rng.randrange(self.SHARED_PAGES)}"
+            else:
+                url = f"{self.BASE_URL}/search/{quote_plus(query)}/{i}"
+            if any(result["href"] == url for result in results):
+                continue
+            results.append({"href": url, "title": f"{query} {i}", "body": self.page(url)[:200]})
+        return results
+
+    def page(self, url):
+        """
+        Returns: text of the page, None for the urls outside of the corpus
+        """
+        parsed = urlparse(url or "")
+        if f"{parsed.scheme}://{parsed.netloc}" != self.BASE_URL:
+            return None
+        parts = parsed.path.strip("/").split("/")
+        topic = unquote_plus(parts[1]).split() if len(parts) == 3 and parts[0] == "search" else []
+        rng = random.Random(f"{self.seed}:page:{url}")
+        vocabulary = WORDS + topic * 8  # pages are about the query that found them
+        paragraphs = []
+        size = 0
+        while size < self.page_size:
+            paragraph = " ".join(rng.choices(vocabulary, k=rng.randint(40, 120))).capitalize() + "."
+            paragraphs.append(paragraph)
+            size += len(paragraph) + 2
+        return "\n\n".join(paragraphs)[:self.page_size]
@@ -5,6 +5,8 @@ from .serper.serper import SerperSearch
 from .serpapi.serpapi import SerpApiSearch
 from .searx.searx import SearxSearch
 from .bing.bing import BingSearch
+from .mock.mock_search import MockSearch
 from .retriever import get_retriever
+from .search_cache import CachedRetriever
 
-__all__ = ["TavilySearch", "Duckduckgo", "SerperSearch", "SerpApiSearch", "GoogleSearch", "SearxSearch", "BingSearch", "get_retriever"]
+__all__ = ["TavilySearch", "Duckduckgo", "SerperSearch", "SerpApiSearch", "GoogleSearch", "SearxSearch", "BingSearch", "MockSearch", "get_retriever", "CachedRetriever"]
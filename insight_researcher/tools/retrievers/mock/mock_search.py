@@ -0,0 +1,28 @@
+# Mock Search Retriever
+
+from insight_researcher.tools.mock_corpus import SyntheticCorpus
+
+
+class MockSearch:
+    """
+    Mock Search Retriever, searches the seeded synthetic corpus instead of the web, needs no API key
+    """
+    corpus = SyntheticCorpus()
+
+    def __init__(self, query, corpus=None):
+        """
+        Args:
+            query: search query
+            corpus: SyntheticCorpus to search, the default corpus if None
+        """
+        self.query = query
+        if corpus is not None:
+            self.corpus = corpus
+
+    def search(self, max_results=5):
+        """
+        Searches the query, waiting for the injected latency of the corpus
+        Returns: [{"href": url, "title": title, "body": snippet}]
+        """
+        self.corpus.delay(self.corpus.search_latency)
+        return self.corpus.search(self.query, max_results=max_results)
@@ -33,6 +33,9 @@ def get_retriever(retriever):
         case "BingSearch":
             from insight_researcher.tools.retrievers import BingSearch
             retriever = BingSearch
+        case "mock":
+            from insight_researcher.tools.retrievers import MockSearch
+            retriever = MockSearch
 
         case _:
             raise Exception("Retriever not found.")
@@ -0,0 +1,73 @@
+# Search Result Cache
+
+# libraries
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from insight_researcher.utils.cache import SqliteCache
+from insight_researcher.utils.logs import log
+
+
+class CachedRetriever:
+    """
+    Wraps the retriever class returned by get_retriever with a persistent cache of search results,
+    keyed by retriever name, normalized query and max_results
+    """
+    def __init__(self, retriever, name, cache_dir, ttl):
+        """
+        Args:
+            retriever: retriever class, e.g. TavilySearch
+            name: retriever name in config, part of the cache key
+            cache_dir: directory of the cache file
+            ttl: seconds the cached results of this retriever stay fresh
+        """
+        self.retriever = retriever
+        self.name = name
+        self.cache = SqliteCache(Path(cache_dir) / "search.sqlite", ttl=ttl)
+
+    def __call__(self, query):
+        # mimic the retriever class: Tool calls retriever(query).search(max_results=...)
+        return CachedSearch(self, query)
+
+    def key(self, query, max_results):
+        normalized_query = " ".join(query.lower().split())
+        return hashlib.sha256(f"{self.name}\0{normalized_query}\0{max_results}".encode("utf-8")).hexdigest()
+
+
+class CachedSearch:
+    """
+    Search of one query through CachedRetriever, the real retriever is only created on a cache miss
+    """
+    def __init__(self, cached_retriever, query):
+        self.cached_retriever = cached_retriever
+        self.query = query
+
+    def search(self, max_results=7):
+        """
+        Searches the query, serving the results from the cache when possible. The cache is best effort,
+        an error of it is logged and the search goes on as a miss
+        Returns:
+            the search results of the retriever, a list of dicts with href
+        """
+        cache = self.cached_retriever.cache
+        key = self.cached_retriever.key(self.query, max_results)
+        try:
+            entry = cache.get(key)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to read the search cache: {e}")
+            entry = None
+        if entry is not None:
+            log.info(f"Search cache hit for '{self.query}'")
+            return json.loads(entry.value)
+        results = self.cached_retriever.retriever(self.query).search(max_results=max_results)
+        if results is None:
+            return results
+        # some retrievers return generators, materialize them before caching
+        results = list(results)
+        if results:
+            try:
+                cache.put(key, json.dumps(results, ensure_ascii=False))
+            except sqlite3.Error as e:
+                log.warning(f"Failed to cache the search results of '{self.query}': {e}")
+        return results
@@ -1,3 +1,4 @@
 from .scraper import Scraper
+from .mock_scraper import MockScraper
 
-__all__ = ["Scraper"]
\ No newline at end of file
+__all__ = ["Scraper", "MockScraper"]
\ No newline at end of file
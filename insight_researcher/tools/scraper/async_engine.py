@@ -0,0 +1,77 @@
+import asyncio
+import atexit
+import threading
+from collections import namedtuple
+import aiohttp
+
+FetchResult = namedtuple("FetchResult", ["status", "body", "encoding", "headers"])
+
+
+class AsyncFetchEngine:
+    """
+    aiohttp fetch engine running on its own event loop thread. The synchronous Scraper.run can be called
+    from any thread while every call shares one pool of keep-alive connections, bounded globally and per host.
+    """
+    def __init__(self, user_agent, max_connections=20, max_per_host=4, timeout=4):
+        self.user_agent = user_agent
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="scraper-fetch-loop", daemon=True).start()
+                atexit.register(self.close)
+            return self._loop
+
+    def _get_session(self):
+        # must be called inside the engine loop, aiohttp binds the session to the running loop
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host,
+                                             ttl_dns_cache=300, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"User-Agent": self.user_agent, "Accept-Encoding": "gzip, deflate"},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def fetch(self, url, headers=None):
+        """
+        GET the url, the body is decompressed by aiohttp according to Content-Encoding
+        Returns:
+            FetchResult
+        """
+        async with self._get_session().get(url, headers=headers) as response:
+            body = await response.read()
+            return FetchResult(response.status, body, response.charset, response.headers)
+
+    def submit(self, coro):
+        """
+        Schedules the coroutine on the engine loop
+        Returns:
+            concurrent.futures.Future of the coroutine result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """
+        Runs the coroutine on the engine loop and blocks the calling thread until it finishes
+        """
+        return self.submit(coro).result()
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,152 @@
+from collections import defaultdict
+from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
+
+TEXT_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'h5']
+
+
+def clean_text(raw_content):
+    """Strip every line and drop the empty ones"""
+    lines = (line.strip() for line in raw_content.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(chunk for chunk in chunks if chunk)
+
+
+class BeautifulSoupExtractor:
+    """
+    Extracts the text of every p/h1-h5 tag of the page with BeautifulSoup
+    """
+    def extract(self, html, encoding=None):
+        """Extract the readable text of the html page
+
+        Args:
+            html (bytes): The raw html
+            encoding (str): The encoding declared by the server, None to detect it
+
+        Returns:
+            str: The text of the page
+        """
+        soup = BeautifulSoup(html, 'lxml', from_encoding=encoding)
+
+        for script_or_style in soup(["script", "style"]):
+            script_or_style.extract()
+
+        return clean_text(self.get_content_from_url(soup))
+
+    def get_content_from_url(self, soup):
+        """Get the text from the soup
+
+        Args:
+            soup (BeautifulSoup): The soup to get the text from
+
+        Returns:
+            str: The text from the soup
+        """
+        return "".join(element.text + "\n" for element in soup.find_all(TEXT_TAGS))
+
+
+class LxmlExtractor:
+    """
+    Extracts only the main content of the page, working directly on the lxml tree.
+    Boilerplate elements are dropped first, then every text block scores its parent (and half of it its
+    grandparent) by its text length discounted by its link density. The best scored container and its
+    siblings of comparable score are kept, headed by the first h1 of the page if they hold no h1: the article
+    title often sits in a <header> next to the body, and <header> is not dropped for that reason.
+    """
+    BOILERPLATE_TAGS = ["script", "style", "noscript", "nav", "footer", "aside", "form", "iframe",
+                        "svg", "button", "select", "template"]
+    BLOCK_TAGS = TEXT_TAGS + ["li", "pre", "blockquote"]
+
+    def __init__(self, min_block_length=25, sibling_ratio=0.2, min_content_length=200):
+        """
+        Args:
+            min_block_length: text blocks shorter than it do not score their containers
+            sibling_ratio: siblings of the best container scoring above best * sibling_ratio are kept as well
+            min_content_length: fall back to every text block of the page when the main content is shorter
+        """
+        self.min_block_length = min_block_length
+        self.sibling_ratio = sibling_ratio
+        self.min_content_length = min_content_length
+
+    def _parse(self, html, encoding):
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding, remove_comments=True)
+        except LookupError:
+            parser = lxml.html.HTMLParser(remove_comments=True)
+        return lxml.html.document_fromstring(html, parser=parser)
+
+    def extract(self, html, encoding=None):
+        """Extract the main content text of the html page
+
+        Args:
+            html (bytes): The raw html
+            encoding (str): The encoding declared by the server, None to detect it
+
+        Returns:
+            str: The text of the page
+        """
+        root = self._parse(html, encoding)
+        etree.strip_elements(root, *self.BOILERPLATE_TAGS, with_tail=False)
+
+        scores = defaultdict(float)
+        for block in root.iter(*self.BLOCK_TAGS):
+            length = len(block.text_content().strip())
+            if length < self.min_block_length:
+                continue
+            link_length = sum(len(link.text_content()) for link in block.iter("a"))
+            score = length * max(0.0, 1 - link_length / length)
+            parent = block.getparent()
+            if parent is None:
+                continue
+            scores[parent] += score
+            grandparent = parent.getparent()
+            if grandparent is not None:
+                scores[grandparent] += score / 2
+
+        text = ""
+        if scores:
+            best = max(scores, key=scores.get)
+            threshold = scores[best] * self.sibling_ratio
+            parent = best.getparent()
+            candidates = [best] if parent is None else [
+                node for node in parent if node is best or scores.get(node, 0) > threshold]
+            text = self._join_blocks(candidates)
+            title = next(root.iter("h1"), None)
+            if title is not None and not any(next(node.iter("h1"), None) is not None for node in candidates):
+                text = title.text_content() + "\n" + text
+        if len(text) < self.min_content_length:
+            text = self._join_blocks([root])
+        return clean_text(text)
+
+    def _join_blocks(self, containers):
+        """ the text of the outermost scored blocks, a <p> inside an <li> is emitted once with its <li> """
+        parts = []
+        block_tags = set(self.BLOCK_TAGS)
+        for container in containers:
+            stack = [container]
+            while stack:
+                element = stack.pop()
+                if element.tag in block_tags:
+                    parts.append(element.text_content())
+                elif isinstance(element.tag, str):
+                    stack.extend(reversed(element))
+        return "\n".join(parts)
+
+
+def get_extractor(extractor):
+    """
+    Gets the html content extractor
+    Args:
+        extractor: extractor name, "lxml" or "bs"
+
+    Returns:
+        extractor instance
+    """
+    match extractor:
+        case "lxml":
+            return LxmlExtractor()
+        case "bs":
+            return BeautifulSoupExtractor()
+        case _:
+            raise Exception("Extractor not found.")
@@ -0,0 +1,47 @@
+from concurrent.futures import as_completed
+from concurrent.futures.thread import ThreadPoolExecutor
+from insight_researcher.utils.tracing import tracer
+from .scraper import failed_page
+
+
+class MockScraper:
+    """
+    Scraper stand-in for load tests, "downloads" the pages of the seeded synthetic corpus with the injected
+    latency, as concurrently as the real scraper
+    """
+    def __init__(self, cfg, corpus):
+        """
+        Args:
+            cfg: config, the scraper_max_connections of it bounds the concurrent downloads
+            corpus: SyntheticCorpus serving the pages
+        """
+        self.corpus = corpus
+        self.max_workers = cfg.scraper_max_connections
+
+    def run(self, urls):
+        """
+        Extracts the content from the links
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.extract_data_from_link, urls))
+
+    def iter_run(self, urls):
+        """
+        Extracts the content from the links, yielding each result as soon as its page is scraped
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.extract_data_from_link, url) for url in urls]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def extract_data_from_link(self, link, session=None):
+        with tracer.span("scraper.fetch", url=link, mock=True) as span:
+            self.corpus.delay(self.corpus.scrape_latency)
+            content = self.corpus.page(link)
+            span.set(chars=len(content) if content else 0)
+        if content is None:
+            # outside of the corpus, like a 404
+            return failed_page(link, permanent=True)
+        if len(content) < 100:
+            return failed_page(link)
+        return {'url': link, 'raw_content': content}
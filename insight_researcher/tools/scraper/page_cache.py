@@ -0,0 +1,65 @@
+import hashlib
+import sqlite3
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from insight_researcher.utils.cache import SqliteCache
+from insight_researcher.utils.url import canonicalize_url
+from insight_researcher import log
+
+CachedPage = namedtuple("CachedPage", ["content", "etag", "last_modified", "fresh"])
+
+
+class PageCache:
+    """
+    On-disk cache of the text extracted from scraped pages, keyed by canonical url, so the variants of a url share their entry.
+    Expired pages are kept with their ETag/Last-Modified validators so they can be revalidated
+    with a conditional request instead of being downloaded and parsed again.
+    The writes are best effort: a page that failed to be cached is still returned by the scraper.
+    """
+
+    def __init__(self, cache_dir, ttl, max_bytes):
+        self.cache = SqliteCache(Path(cache_dir) / "pages.sqlite", ttl=ttl, max_bytes=max_bytes)
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+    def get(self, url):
+        """
+        Returns: CachedPage (possibly stale, see CachedPage.fresh) or None if the url was never cached
+        """
+        entry = self.cache.get(self._key(url), allow_stale=True)
+        if entry is None:
+            return None
+        content = zlib.decompress(entry.value).decode("utf-8")
+        return CachedPage(content, entry.meta.get("etag"), entry.meta.get("last_modified"),
+                          self.cache.is_fresh(entry))
+
+    def put(self, url, content, etag=None, last_modified=None):
+        raw = content.encode("utf-8")
+        meta = {"url": url, "etag": etag, "last_modified": last_modified,
+                "content_sha256": hashlib.sha256(raw).hexdigest()}
+        try:
+            self.cache.put(self._key(url), zlib.compress(raw), meta)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to cache page {url}: {e}")
+
+    def revalidated(self, url):
+        """the server answered 304 Not Modified, restart the ttl of the cached page"""
+        try:
+            self.cache.touch(self._key(url), refresh=True)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to refresh cached page {url}: {e}")
+
+    @staticmethod
+    def conditional_headers(page):
+        headers = {}
+        if page is not None and page.etag:
+            headers["If-None-Match"] = page.etag
+        if page is not None and page.last_modified:
+            headers["If-Modified-Since"] = page.last_modified
+        return headers
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,10 +1,46 @@
+import asyncio
+import queue
+import socket
+from concurrent.futures import as_completed
 from concurrent.futures.thread import ThreadPoolExecutor
 from langchain.document_loaders import PyMuPDFLoader
 from langchain.retrievers import ArxivRetriever
 from functools import partial
 import requests
-from bs4 import BeautifulSoup
 from insight_researcher.utils.logs import log
+from insight_researcher.utils.tracing import tracer
+from .page_cache import PageCache
+from .async_engine import AsyncFetchEngine
+from .extractors import get_extractor
+
+# the page is gone for good, unlike timeouts, 5xx and connection errors that may pass
+PERMANENT_STATUSES = (404, 410)
+
+
+def failed_page(link, permanent=False):
+    """
+    Returns: the url-content pair of a url without content, permanent_failure marks a url not worth retrying
+    """
+    return {'url': link, 'raw_content': None, 'permanent_failure': permanent}
+
+
+def is_dns_failure(error):
+    """
+    Returns: whether the host of the url does not resolve, the cause may be wrapped by aiohttp, requests or urllib3
+    """
+    seen = set()
+    errors = [error]
+    while errors:
+        error = errors.pop()
+        if error is None or id(error) in seen:
+            continue
+        seen.add(id(error))
+        if isinstance(error, socket.gaierror) or type(error).__name__ == "NameResolutionError":
+            return True
+        errors += [error.__cause__, error.__context__, getattr(error, "os_error", None),
+                   getattr(error, "reason", None)]
+        errors += [arg for arg in error.args if isinstance(arg, BaseException)]
+    return False
 
 
 class Scraper:
@@ -16,6 +52,17 @@ class Scraper:
         self.session.headers.update({
             "User-Agent": cfg.user_agent
         })
+        self.max_workers = cfg.scraper_max_connections
+        self.timeout = cfg.scraper_timeout
+        self.extractor = get_extractor(cfg.scraper_extractor)
+        self.engine = None
+        if cfg.scraper_engine == "async":
+            self.engine = AsyncFetchEngine(cfg.user_agent, max_connections=cfg.scraper_max_connections,
+                                           max_per_host=cfg.scraper_max_per_host, timeout=cfg.scraper_timeout)
+        self.page_cache = None
+        if cfg.page_cache:
+            self.page_cache = PageCache(cfg.cache_dir, ttl=cfg.page_cache_ttl,
+                                        max_bytes=cfg.page_cache_max_mb * 1024 * 1024)
 
     def run(self, urls):
         """
@@ -23,47 +70,154 @@ class Scraper:
         """
         res = {}
         try:
-            partial_extract = partial(self.extract_data_from_link, session=self.session)
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                results = executor.map(partial_extract, urls)
-            res = [result for result in results]
+            if self.engine is not None:
+                res = self.engine.run(self._run_async(urls))
+            else:
+                partial_extract = partial(self.extract_data_from_link, session=self.session)
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    results = executor.map(partial_extract, urls)
+                res = [result for result in results]
         except Exception as e:
             log.error(f"Error in scrape_urls: {e}")
         return res
 
+    def iter_run(self, urls):
+        """
+        Extracts the content from the links, yielding each result as soon as its page is scraped
+        """
+        urls = list(urls)
+        if self.engine is not None:
+            results = queue.Queue()
+
+            async def extract_and_put(url):
+                results.put(await self.extract_data_from_link_async(url))
+
+            async def produce():
+                await asyncio.gather(*(extract_and_put(url) for url in urls))
+
+            future = self.engine.submit(produce())
+            for _ in urls:
+                yield results.get()
+            future.result()
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.extract_data_from_link, url, self.session) for url in urls]
+                for future in as_completed(futures):
+                    yield future.result()
+
+    async def _run_async(self, urls):
+        return await asyncio.gather(*(self.extract_data_from_link_async(url) for url in urls))
+
+    async def extract_data_from_link_async(self, link):
+        """
+        Extracts the data from the link with the async engine,
+        pdf/arxiv links, html parsing and the page cache (SQLite) run in the default executor of the engine loop,
+        so they never block the other fetches
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if not link or link.endswith(".pdf") or "arxiv.org" in link:
+                return await loop.run_in_executor(None, tracer.propagate(self.extract_data_from_link), link,
+                                                  self.session)
+            with tracer.span("scraper.fetch", url=link) as span:
+                cached = await loop.run_in_executor(None, self.page_cache.get, link) \
+                    if self.page_cache is not None else None
+                if cached is not None and cached.fresh:
+                    span.set(cached=True, chars=len(cached.content))
+                    return {'url': link, 'raw_content': cached.content}
+                response = await self.engine.fetch(link, headers=PageCache.conditional_headers(cached))
+                span.set(status=response.status, bytes=len(response.body))
+                if response.status in PERMANENT_STATUSES:
+                    return failed_page(link, permanent=True)
+                if response.status == 304 and cached is not None:
+                    await loop.run_in_executor(None, self.page_cache.revalidated, link)
+                    content = cached.content
+                else:
+                    with tracer.span("scraper.extract", url=link, bytes=len(response.body)):
+                        content = await loop.run_in_executor(None, self.html_to_text, response.body,
+                                                             response.encoding)
+                    if self.is_success(response.status):
+                        await loop.run_in_executor(None, self._cache_page, link, content, response.headers)
+                span.set(chars=len(content))
+
+            if len(content) < 100:
+                return failed_page(link)
+            return {'url': link, 'raw_content': content}
+        except Exception as e:
+            return failed_page(link, permanent=is_dns_failure(e))
+
     def extract_data_from_link(self, link, session):
         """
         Extracts the data from the link
         """
         content = ""
         try:
-            if link.endswith(".pdf"):
-                content = self.scrape_pdf_with_pymupdf(link)
-            elif "arxiv.org" in link:
-                doc_num = link.split("/")[-1]
-                content = self.scrape_pdf_with_arxiv(doc_num)
-            elif link:
-                content = self.scrape_text_with_bs(link, session)
+            with tracer.span("scraper.fetch", url=link) as span:
+                # consult the page cache before any network I/O
+                cached = self.page_cache.get(link) if self.page_cache is not None and link else None
+                if cached is not None and cached.fresh:
+                    span.set(cached=True, chars=len(cached.content))
+                    return {'url': link, 'raw_content': cached.content}
+                if link.endswith(".pdf"):
+                    content = self.scrape_pdf_with_pymupdf(link)
+                    self._cache_page(link, content)
+                elif "arxiv.org" in link:
+                    doc_num = link.split("/")[-1]
+                    content = self.scrape_pdf_with_arxiv(doc_num)
+                    self._cache_page(link, content)
+                elif link:
+                    content = self.scrape_text_with_bs(link, session, cached)
+                    if content is None:
+                        return failed_page(link, permanent=True)
+                span.set(chars=len(content))
 
             if len(content) < 100:
-                return {'url': link, 'raw_content': None}
+                return failed_page(link)
             return {'url': link, 'raw_content': content}
         except Exception as e:
-            return {'url': link, 'raw_content': None}
+            return failed_page(link, permanent=is_dns_failure(e))
 
-    def scrape_text_with_bs(self, link, session):
-        response = session.get(link, timeout=4)
-        soup = BeautifulSoup(response.content, 'lxml', from_encoding=response.encoding)
+    @staticmethod
+    def is_success(status):
+        """ only 2xx pages are cached, a bot wall (403), rate limit (429) or error page (5xx) is not the page """
+        return 200 <= status < 300
 
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.extract()
+    def _cache_page(self, link, content, headers=None):
+        if self.page_cache is None or len(content) < 100:
+            return
+        headers = headers or {}
+        self.page_cache.put(link, content, etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
 
-        raw_content = self.get_content_from_url(soup)
-        lines = (line.strip() for line in raw_content.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        content = "\n".join(chunk for chunk in chunks if chunk)
+    def scrape_text_with_bs(self, link, session, cached=None):
+        """
+        Returns: the text of the page, None if the page is gone (404/410)
+        """
+        # revalidate an expired cached page with a conditional request
+        response = session.get(link, timeout=self.timeout, headers=PageCache.conditional_headers(cached))
+        tracer.current().set(status=response.status_code, bytes=len(response.content))
+        if response.status_code in PERMANENT_STATUSES:
+            return None
+        if response.status_code == 304 and cached is not None:
+            self.page_cache.revalidated(link)
+            return cached.content
+        with tracer.span("scraper.extract", url=link, bytes=len(response.content)):
+            content = self.html_to_text(response.content, response.encoding)
+        if self.is_success(response.status_code):
+            self._cache_page(link, content, response.headers)
         return content
 
+    def html_to_text(self, html, encoding=None):
+        """Extract the readable text of the html page
+
+        Args:
+            html (bytes): The raw html
+            encoding (str): The encoding declared by the server, None to detect it
+
+        Returns:
+            str: The text of the page
+        """
+        return self.extractor.extract(html, encoding)
+
     def scrape_pdf_with_pymupdf(self, url) -> str:
         """Scrape a pdf with pymupdf
 
@@ -90,18 +244,3 @@ class Scraper:
         retriever = ArxivRetriever(load_max_docs=2, doc_content_chars_max=None)
         docs = retriever.get_relevant_documents(query=query)
         return docs[0].page_content
-
-    def get_content_from_url(self, soup):
-        """Get the text from the soup
-
-        Args:
-            soup (BeautifulSoup): The soup to get the text from
-
-        Returns:
-            str: The text from the soup
-        """
-        text = ""
-        tags = ['p', 'h1', 'h2', 'h3', 'h4', 'h5']
-        for element in soup.find_all(tags):  # Find all the <p> elements
-            text += element.text + "\n"
-        return text
@@ -1,14 +1,52 @@
-from .retrievers import get_retriever
-from .scraper import Scraper
+import sqlite3
+from functools import partial
+from .retrievers import get_retriever, CachedRetriever
+from .scraper import Scraper, MockScraper
+from .mock_corpus import SyntheticCorpus
+from .url_registry import get_url_registry
 from insight_researcher import log
+from insight_researcher.utils import tracer, EventEmitter
+
+
+def get_tool_retriever(cfg):
+    """
+    Returns: the retriever class (or a callable alike) configured by cfg, with the search cache if enabled
+    """
+    if cfg.mock_search:
+        # no search cache, a load test should pay the injected latency of every search
+        return partial(get_retriever("mock"), corpus=SyntheticCorpus.from_config(cfg))
+    retriever = get_retriever(cfg.retriever)
+    if cfg.search_cache:
+        retriever = CachedRetriever(retriever, cfg.retriever, cfg.cache_dir, cfg.search_cache_ttl)
+    return retriever
+
+
+def get_tool_scraper(cfg):
+    """
+    Returns: the scraper configured by cfg
+    """
+    if cfg.mock_scrape:
+        return MockScraper(cfg, SyntheticCorpus.from_config(cfg))
+    return Scraper(cfg)
 
 
 class Tool:
-    def __init__(self, cfg, memory):
+    def __init__(self, cfg, memory, retriever=None, scraper=None, url_registry=None, events=None):
+        """
+        Args:
+            cfg: config
+            memory: memory of the task
+            retriever: retriever shared with other tasks, built from cfg if None
+            scraper: scraper shared with other tasks (connection pools, page cache), built from cfg if None
+            url_registry: UrlRegistry shared with other tasks, built from cfg if None (None if it is disabled)
+            events: EventEmitter of the task, receives every url fetched
+        """
         self.cfg = cfg
-        self.retriever = get_retriever(cfg.retriever)
-        self.scraper = Scraper(cfg)
+        self.retriever = retriever if retriever is not None else get_tool_retriever(cfg)
+        self.scraper = scraper if scraper is not None else get_tool_scraper(cfg)
+        self.url_registry = url_registry if url_registry is not None else get_url_registry(cfg)
         self.memory = memory
+        self.events = events if events is not None else EventEmitter()
 
     def scrape_sites_by_query(self, sub_query):
         """
@@ -17,17 +55,78 @@ class Tool:
         Returns:
         TODO: 细品，返回值的逻辑有些许问题，后面再修复
         """
+        knowledge_base = self.memory.knowledge_base
+        if knowledge_base is not None:
+            known_urls = knowledge_base.search_sources(sub_query, k=self.cfg.max_search_results_per_query,
+                                                       similarity_threshold=self.cfg.similarity_threshold)
+            if known_urls and len(known_urls) >= self.cfg.knowledge_base_min_sources:
+                # the knowledge base covers the query with fresh sources, no search and no scraping
+                log.info(f"📚 Answering '{sub_query}' from {len(known_urls)} sources of the knowledge base")
+                return self._add_known_pages(self.memory.get_new_urls(known_urls))
+
         # Get Urls
-        retriever = self.retriever(sub_query)
-        search_results = retriever.search(max_results=self.cfg.max_search_results_per_query)
-        new_search_urls = self.memory.get_new_urls([url.get("href") for url in search_results])
+        with tracer.span("tool.search", query=sub_query, retriever=self.cfg.retriever) as span:
+            retriever = self.retriever(sub_query)
+            search_results = retriever.search(max_results=self.cfg.max_search_results_per_query)
+            span.set(results=len(search_results))
+        search_urls = [url.get("href") for url in search_results if url.get("href")]
+        if self.url_registry is not None:
+            # urls failing run after run are not retried until their failure ttl is over
+            search_urls = self.url_registry.filter_failing(search_urls)
+        new_search_urls = self.memory.get_new_urls(search_urls)
         if new_search_urls is None or 0 == len(new_search_urls):
             return []
 
+        known_pages = []
+        if knowledge_base is not None:
+            # only the gaps and the stale sources go to the web
+            known_urls = set(knowledge_base.fresh_sources(new_search_urls))
+            known_pages = self._add_known_pages([url for url in new_search_urls if url in known_urls])
+            new_search_urls = [url for url in new_search_urls if url not in known_urls]
+            if not new_search_urls:
+                return known_pages
+
         # Scrape Urls
         log.info(f"📝Scraping urls {new_search_urls}...")
-        scraped_url_content_list = self.scraper.run(new_search_urls)
-        self.memory.add_memory(scraped_url_content_list)
+        if self.cfg.streaming_ingest:
+            # pages are split and embedded as soon as each of them is scraped
+            scraped_url_content_list = self.memory.add_memory_stream(
+                self._emit_urls(self.scraper.iter_run(new_search_urls)))
+        else:
+            scraped_url_content_list = list(self._emit_urls(self.scraper.run(new_search_urls) or []))
+            self.memory.add_memory(scraped_url_content_list)
+        if self.url_registry is not None:
+            try:
+                self.url_registry.record(scraped_url_content_list)
+            except sqlite3.Error as e:
+                # the registry only saves later fetches, the pages are scraped already
+                log.warning(f"Failed to record the scraped urls: {e}")
         scraped_url_content_list = [url_content for url_content in scraped_url_content_list if
                                     url_content['raw_content'] is not None]
-        return scraped_url_content_list
+        return known_pages + scraped_url_content_list
+
+    def _add_known_pages(self, urls):
+        """
+        add the fresh copies of the urls in the knowledge base to the memory
+        Returns: the added url-content pairs
+        """
+        if not urls:
+            return []
+        with tracer.span("tool.knowledge_base", urls=len(urls)) as span:
+            pages, documents, vectors = self.memory.knowledge_base.get_pages(urls)
+            self.memory.add_known_pages(pages, documents, vectors)
+            span.set(pages=len(pages), chunks=len(documents))
+        for page in pages:
+            self.events.emit("url", url=page["url"], ok=True, chars=len(page["raw_content"]),
+                             source="knowledge_base")
+        return pages
+
+    def _emit_urls(self, url_content_iter):
+        """
+        yields the scraped url-content pairs, emitting a url event as each of them arrives
+        """
+        for url_content in url_content_iter:
+            content = url_content["raw_content"]
+            self.events.emit("url", url=url_content["url"], ok=content is not None,
+                             chars=len(content) if content is not None else 0, source="web")
+            yield url_content
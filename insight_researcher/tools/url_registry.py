@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List
+from insight_researcher.utils.url import canonicalize_url
+
+
+class UrlRegistry:
+    """
+    Persistent failed url set shared by the tasks and the processes using the same file.
+    A failing url is stored as the 64-bit hash of its canonical form (see canonicalize_url) with its consecutive
+    permanent failures (404/410, unknown host), so the variants of one address share an entry and millions of
+    urls take a few tens of MB. A url that failed max_failures times in a row is skipped for failure_ttl seconds,
+    then tried once more; a success removes its entry. Transient failures
+    (timeouts, 5xx, connection errors, pages too short) are not counted, a network outage blacklists nothing.
+    """
+
+    def __init__(self, path, max_failures=3, failure_ttl=30 * 24 * 3600, busy_timeout=30):
+        """
+        Args:
+            path: SQLite database file
+            max_failures: consecutive failures after which a url is skipped
+            failure_ttl: seconds a failing url is skipped
+            busy_timeout: seconds to wait for the lock of another connection before raising "database is locked"
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_failures = max_failures
+        self.failure_ttl = failure_ttl
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (key INTEGER PRIMARY KEY, "
+                           "failures INTEGER NOT NULL DEFAULT 0, failed_at REAL)")
+
+    @staticmethod
+    def key(url):
+        digest = hashlib.blake2b(canonicalize_url(url).encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def _rows(self, keys, columns):
+        rows = {}
+        keys = list(dict.fromkeys(keys))
+        # SQLite limits the number of bound variables of one statement
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows.update((row[0], row[1:]) for row in self._conn.execute(
+                f"SELECT key, {columns} FROM urls WHERE key IN ({','.join('?' * len(batch))})", batch))
+        return rows
+
+    def filter_failing(self, urls: List[str]) -> List[str]:
+        """
+        Returns: the urls that are not skipped for failing repeatedly, in the same order
+        """
+        now = time.time()
+        keys = [self.key(url) for url in urls]
+        with self._lock:
+            rows = self._rows(keys, "failures, failed_at")
+            kept = [url for url, key in zip(urls, keys) if key not in rows or rows[key][0] < self.max_failures
+                    or now - rows[key][1] >= self.failure_ttl]
+            self.skipped += len(urls) - len(kept)
+        return kept
+
+    def record(self, url_content_list):
+        """
+        Args:
+            url_content_list: scraped pages, a page with permanent_failure set (see failed_page) is a failure of its
+                url, the other pages without content are ignored
+        """
+        now = time.time()
+        succeeded = [(self.key(page["url"]),) for page in url_content_list if page["raw_content"] is not None]
+        failed = [(self.key(page["url"]), now) for page in url_content_list if page.get("permanent_failure")]
+        if not succeeded and not failed:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM urls WHERE key = ?", succeeded)
+                self._conn.executemany("INSERT INTO urls (key, failures, failed_at) VALUES (?, 1, ?) "
+                                       "ON CONFLICT(key) DO UPDATE SET failures = failures + 1, "
+                                       "failed_at = excluded.failed_at", failed)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # never leave the connection inside a transaction, every later BEGIN would fail
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            urls, failing = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(failures >= ?), 0) FROM urls",
+                                               (self.max_failures,)).fetchone()
+            return {"urls": urls, "failing": failing, "skipped": self.skipped}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_url_registry(cfg):
+    """
+    Returns: the url registry shared by the tasks, None if URL_REGISTRY is disabled
+    """
+    if not cfg.url_registry:
+        return None
+    return UrlRegistry(Path(cfg.cache_dir) / "urls.sqlite", max_failures=cfg.url_max_failures,
+                       failure_ttl=cfg.url_failure_ttl)
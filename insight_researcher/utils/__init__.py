@@ -1,3 +1,5 @@
 from .logs import log, PROJECT_ROOT, cur_timestamp
-from .util import write_report_to_file
-__all__ = [log, PROJECT_ROOT, cur_timestamp]
+from .util import write_report_to_file, new_task_id
+from .tracing import tracer
+from .events import Event, EventEmitter, TokenBuffer, EVENT_TYPES
+__all__ = [log, PROJECT_ROOT, cur_timestamp, new_task_id, tracer, Event, EventEmitter, TokenBuffer, EVENT_TYPES]
@@ -0,0 +1,164 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+CacheEntry = namedtuple("CacheEntry", ["key", "value", "meta", "created_at"])
+
+
+class SqliteCache:
+    """
+    Thread safe key-value cache persisted in SQLite, with TTL expiration and size-bounded LRU eviction.
+    The database file can be shared by several tasks and processes, a writer waits up to busy_timeout seconds
+    for the others.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=None, busy_timeout=30):
+        """
+        Args:
+            path: SQLite database file
+            ttl: seconds an entry stays fresh, None means never expire
+            max_bytes: upper bound of the stored values, least recently used entries are evicted beyond it
+            busy_timeout: seconds to wait for the lock of another connection before raising "database is locked"
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, meta TEXT, "
+                           "created_at REAL, accessed_at REAL, size INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def is_fresh(self, entry, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        return ttl is None or time.time() - entry.created_at < ttl
+
+    def get(self, key, allow_stale=False, ttl=None):
+        """
+        Args:
+            key: cache key
+            allow_stale: return expired entries as well, e.g. for conditional revalidation
+            ttl: overrides the default ttl of the cache
+
+        Returns: CacheEntry or None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value, meta, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            entry = CacheEntry(key, row[0], json.loads(row[1]) if row[1] else {}, row[2]) if row else None
+            if entry is None or not (allow_stale or self.is_fresh(entry, ttl)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return entry
+
+    def get_many(self, keys, ttl=None):
+        """
+        Returns: dict of key -> CacheEntry for the fresh entries found
+        """
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite limits the number of bound variables of one statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, meta, created_at FROM cache WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+                for key, value, meta, created_at in rows:
+                    entry = CacheEntry(key, value, json.loads(meta) if meta else {}, created_at)
+                    if self.is_fresh(entry, ttl):
+                        found[key] = entry
+            now = time.time()
+            self._conn.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key, value, meta=None):
+        self.put_many([(key, value, meta)])
+
+    def put_many(self, items):
+        """
+        Args:
+            items: iterable of (key, value, meta) tuples, value is bytes or str, meta is a json serializable dict
+        """
+        now = time.time()
+        rows = [(key, value, json.dumps(meta) if meta else None, now, now, len(value)) for key, value, meta in items]
+        if not rows:
+            return
+        with self._lock:
+            # IMMEDIATE takes the write lock up front and waits for it, a deferred transaction reading first
+            # fails at once when another process writes in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = 0
+                for row in rows:
+                    old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (row[0],)).fetchone()
+                    added += row[5] - (old[0] if old else 0)
+                    self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)", row)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                # never leave the connection inside a transaction, every later BEGIN would fail
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._total_bytes += added
+            self._evict()
+
+    def touch(self, key, refresh=False):
+        """
+        mark the entry as recently used, refresh=True also restarts its ttl (e.g. after a 304 Not Modified)
+        """
+        now = time.time()
+        with self._lock:
+            if refresh:
+                self._conn.execute("UPDATE cache SET accessed_at = ?, created_at = ? WHERE key = ?", (now, now, key))
+            else:
+                self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+    def delete(self, key):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._total_bytes -= old[0]
+
+    def _evict(self):
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+        # other processes may write the same file, recount before evicting
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        # evict down to 90% so that every put near the bound does not trigger an eviction again
+        target = self.max_bytes * 0.9
+        if self._total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall()
+        victims = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "entries": entries, "bytes": self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
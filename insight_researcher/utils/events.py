@@ -0,0 +1,117 @@
+import threading
+import time
+from .logs import log
+
+# type: data of the event
+EVENT_TYPES = {
+    "logs": "output: progress message",
+    "sub_queries": "queries: the sub queries researched",
+    "url": "url, ok: whether content was found, chars, source: web or knowledge_base",
+    "chunks": "chunks: chunks indexed, dropped: near duplicate chunks skipped",
+    "outline_token": "output: next piece of the outline text",
+    "chapter_token": "chapter, output: next piece of the chapter text",
+    "chapter": "chapter, output: the whole chapter once it is written",
+    "cost": "model, prompt_tokens, completion_tokens, cost: of the LLM call, total_cost: of the task so far",
+    "result": "output: the report, the last event of a successful run",
+    "error": "output: error message, the last event of a failed run",
+}
+
+
+class Event:
+    """
+    One typed progress event of a research task, see EVENT_TYPES for the data of every type
+    """
+    __slots__ = ("type", "task_id", "data", "time")
+
+    def __init__(self, type, task_id, data):
+        self.type = type
+        self.task_id = task_id
+        self.data = data
+        self.time = time.time()
+
+    def to_dict(self):
+        return {"type": self.type, "task_id": self.task_id, "time": self.time, **self.data}
+
+    def __repr__(self):
+        return f"Event({self.type}, {self.data})"
+
+
+class EventEmitter:
+    """
+    Sends the events of a task to its sinks: callables receiving the Event and objects with send_json(dict),
+    e.g. a websocket, receiving Event.to_dict(). Events are emitted from the research threads, the sinks must be
+    thread safe. Without sinks emit does nothing, so the components can emit unconditionally. A sink raising
+    is logged and skipped, it never aborts the task nor keeps the other sinks from the event.
+    """
+
+    def __init__(self, task_id=None, sinks=None):
+        self.task_id = task_id
+        self._sinks = [sink for sink in (sinks or []) if sink is not None]
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._sinks)
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self._sinks = [s for s in self._sinks if s is not sink]
+
+    def emit(self, type, **data):
+        sinks = self._sinks
+        if not sinks:
+            return
+        event = Event(type, self.task_id, data)
+        for sink in sinks:
+            try:
+                if callable(sink):
+                    sink(event)
+                else:
+                    sink.send_json(event.to_dict())
+            except Exception as e:
+                log.warning(f"Event sink {sink!r} failed on {type} event: {e}")
+
+
+class TokenBuffer:
+    """
+    Coalesces the streamed tokens of an LLM response into pieces worth sending: a piece is flushed at the end
+    of a line, once it holds max_chars characters, or when a token arrives max_delay seconds after its first one,
+    so a reader sees the text within a fraction of a second without an event per token. The pieces are joined once
+    instead of growing a string token by token. Call flush() at the end for the text after the last newline.
+    """
+
+    def __init__(self, on_flush, max_chars=200, max_delay=0.25):
+        """
+        Args:
+            on_flush: callable receiving every flushed piece of text
+            max_chars: characters buffered before a flush
+            max_delay: seconds a token may wait for a flush
+        """
+        self.on_flush = on_flush
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self._parts = []
+        self._chars = 0
+        self._since = None
+
+    def write(self, text):
+        if not text:
+            return
+        if not self._parts:
+            self._since = time.monotonic()
+        self._parts.append(text)
+        self._chars += len(text)
+        if "\n" in text or self._chars >= self.max_chars or time.monotonic() - self._since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if not self._parts:
+            return
+        text = "".join(self._parts)
+        self._parts = []
+        self._chars = 0
+        self.on_flush(text)
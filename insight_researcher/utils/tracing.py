@@ -0,0 +1,192 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# the span enclosing the running code, kept per thread and per asyncio task
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation, used as a context manager. Attributes can be added while it runs with set()
+    """
+    __slots__ = ("tracer", "name", "attributes", "span_id", "parent_id", "trace_id", "thread_id", "start_ns",
+                 "end_ns", "_token")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(tracer.ids)
+        self.parent_id = None
+        self.trace_id = None
+        self.thread_id = None
+        self.start_ns = None
+        self.end_ns = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        # a root span starts a trace, e.g. one research task, its descendants belong to the same trace
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.thread_id = threading.get_ident()
+        self._token = _current_span.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        if exc is not None:
+            self.attributes["error"] = repr(exc)
+        _current_span.reset(self._token)
+        self.tracer.record(self)
+        return False
+
+
+class _NoopSpan:
+    """ Returned by a disabled tracer, every operation does nothing """
+    trace_id = None
+
+    def set(self, **attributes):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects the spans of the research stages in memory and exports them as JSON lines or Chrome trace
+    (chrome://tracing, Perfetto). When disabled span() returns a shared no-op span, so the instrumented code
+    pays one attribute check per span.
+    """
+
+    def __init__(self, enabled=False, max_spans=200000):
+        """
+        Args:
+            enabled: record spans or not
+            max_spans: spans kept in memory until exported, the spans beyond it are dropped and counted
+        """
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.ids = itertools.count(1)
+        self.dropped = 0
+        self._spans = []
+        self._lock = threading.Lock()
+        # perf_counter has the resolution, the offset turns it into unix time for the exported timestamps
+        self._epoch_offset_ns = time.time_ns() - time.perf_counter_ns()
+
+    def configure(self, enabled):
+        self.enabled = enabled
+
+    def span(self, name, **attributes):
+        """
+        Args:
+            name: stage name, e.g. "scraper.fetch"
+            **attributes: attributes of the span, e.g. url
+
+        Returns: context manager timing the enclosed block
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def current(self):
+        """ Returns: the innermost running span, a no-op span if there is none """
+        span = _current_span.get()
+        return span if span is not None else NOOP_SPAN
+
+    def propagate(self, func):
+        """
+        make the spans of func, run on another thread (executor, thread target), children of the current span
+        Args:
+            func: callable
+
+        Returns: func running in a copy of the current context, func itself when disabled
+        """
+        if not self.enabled:
+            return func
+        context = contextvars.copy_context()
+
+        def run(*args, **kwargs):
+            # a context can only be entered by one thread at a time, so every call runs in its own copy
+            return context.copy().run(func, *args, **kwargs)
+
+        return run
+
+    def record(self, span):
+        with self._lock:
+            if len(self._spans) < self.max_spans:
+                self._spans.append(span)
+            else:
+                self.dropped += 1
+
+    def drain(self, trace_id=None):
+        """
+        Args:
+            trace_id: only take the spans of this trace, all the spans if None
+
+        Returns: the recorded spans, removing them from the tracer
+        """
+        with self._lock:
+            if trace_id is None:
+                spans, self._spans = self._spans, []
+            else:
+                spans = [span for span in self._spans if span.trace_id == trace_id]
+                self._spans = [span for span in self._spans if span.trace_id != trace_id]
+        return spans
+
+    def _to_record(self, span):
+        return {"name": span.name, "span_id": span.span_id, "parent_id": span.parent_id,
+                "trace_id": span.trace_id, "thread_id": span.thread_id,
+                "start_us": (span.start_ns + self._epoch_offset_ns) // 1000,
+                "duration_ms": round((span.end_ns - span.start_ns) / 1e6, 3), "attributes": span.attributes}
+
+    def _to_chrome_event(self, span):
+        return {"name": span.name, "cat": span.name.split(".", 1)[0], "ph": "X", "pid": os.getpid(),
+                "tid": span.thread_id, "ts": (span.start_ns + self._epoch_offset_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "args": dict(span.attributes, span_id=span.span_id, parent_id=span.parent_id,
+                             trace_id=span.trace_id)}
+
+    def export(self, path, fmt="jsonl", trace_id=None):
+        """
+        write the recorded spans to a file and remove them from the tracer
+        Args:
+            path: file path
+            fmt: "jsonl" for one span per line, "chrome" for the Chrome trace event format
+            trace_id: only export the spans of this trace, e.g. of one of several concurrent tasks
+
+        Returns: number of spans written
+        """
+        spans = sorted(self.drain(trace_id), key=lambda span: span.start_ns)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            match fmt:
+                case "jsonl":
+                    for span in spans:
+                        f.write(json.dumps(self._to_record(span), ensure_ascii=False, default=str) + "\n")
+                case "chrome":
+                    json.dump({"traceEvents": [self._to_chrome_event(span) for span in spans],
+                               "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+                case _:
+                    raise Exception("Trace format not found.")
+        return len(spans)
+
+
+tracer = Tracer()
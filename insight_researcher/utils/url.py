@@ -0,0 +1,55 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# query parameters that track the visitor or the campaign and never change the content
+TRACKING_PARAMS = {"gclid", "dclid", "gbraid", "wbraid", "fbclid", "msclkid", "yclid", "twclid", "igshid", "mc_cid",
+                   "mc_eid", "_hsenc", "_hsmi", "mkt_tok", "ref_src", "ref_url", "spm", "scm", "share_token",
+                   "vero_id", "oly_anon_id", "oly_enc_id", "rb_clickid", "s_cid", "__twitter_impression"}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_", "hmsr", "hmpl", "hmcu", "hmkw", "hmci")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize the url so that trivially different spellings of the same address map to one key:
+    lower-cased scheme and host, default port and fragment dropped, query parameters sorted.
+
+    Args:
+        url (str): The url to normalize
+
+    Returns:
+        str: The normalized url
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonical form of the url used as the identity of a page: normalized like normalize_url, plus http folded
+    into https, the "www." prefix, the trailing slash of the path and the tracking query parameters
+    (utm_*, gclid, fbclid, ...) dropped. Only meant as a key, the pages are still fetched by their own url.
+
+    Args:
+        url (str): The url to canonicalize
+
+    Returns:
+        str: The canonical url, the url itself if it can't be parsed (invalid port or IPv6 host)
+    """
+    try:
+        parts = urlsplit(normalize_url(url))
+    except ValueError:
+        return url
+    scheme = "https" if parts.scheme in ("http", "https") else parts.scheme
+    host = parts.netloc
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)])
+    return urlunsplit((scheme, host, path, query, ""))
@@ -1,8 +1,14 @@
+import uuid
 import markdown
-from .logs import PROJECT_ROOT
+from .logs import PROJECT_ROOT, get_cur_timestamp
 from pathlib import Path
 
 
+def new_task_id() -> str:
+    """ task id made of the current time and a random suffix, unique even for the tasks started in the same minute """
+    return f"{get_cur_timestamp()}_{uuid.uuid4().hex[:8]}"
+
+
 def write_report_to_file(task_id: str, text: str) -> None:
     path = Path(PROJECT_ROOT / "outputs/")
     path.mkdir(parents=True, exist_ok=True)
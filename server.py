@@ -0,0 +1,10 @@
+from insight_researcher.server import run_server
+
+
+def main():
+    # Serve research jobs over HTTP and websocket, see insight_researcher/server/server.py for the API
+    run_server()
+
+
+if __name__ == "__main__":
+    main()
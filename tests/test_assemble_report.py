@@ -0,0 +1,40 @@
+from insight_researcher.agent.agent import Agent
+
+OUTLINE = """# AI agents
+## Market
+- Market size
+- Market size by region
+## Players
+1. Startups
+2) Incumbents
+"""
+
+
+def test_leaves_are_replaced_in_order():
+    queries = ["Market size", "Market size by region", "Startups", "Incumbents"]
+    report = Agent._assemble_report(OUTLINE, queries, ["<size>", "<region>", "<startups>", "<incumbents>"])
+    assert report == """# AI agents
+## Market
+- <size>
+- <region>
+## Players
+1. <startups>
+2) <incumbents>
+"""
+
+
+def test_heading_leaf_is_replaced():
+    outline = "# Report\n## Intro\n### Background\n"
+    assert Agent._assemble_report(outline, ["Background"], ["<background>"]) == "# Report\n## Intro\n### <background>\n"
+
+
+def test_text_inside_a_line_is_not_a_leaf():
+    outline = "# Report on Startups\nSee the Startups below\n- Startups\n"
+    assert Agent._find_leaf(outline, "Startups", 0) == outline.rindex("Startups")
+    assert Agent._find_leaf("# Report on Startups\n", "Startups", 0) == -1
+
+
+def test_missing_leaves_are_appended():
+    outline = "# Report\n- Market size\n"
+    report = Agent._assemble_report(outline, ["Pricing", "Market size"], ["<pricing>", "<size>"])
+    assert report == "# Report\n- <size>\n\n\n<pricing>"
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+
+from insight_researcher.utils.cache import SqliteCache
+
+
+class FailingConnection:
+    """ sqlite connection whose inserts fail, like a full disk """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql.startswith("INSERT"):
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_put_and_get(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite")
+    cache.put("a", b"value", {"status": 200})
+    entry = cache.get("a")
+    assert (entry.key, entry.value, entry.meta) == ("a", b"value", {"status": 200})
+    assert cache.get("b") is None
+    assert cache.get_many(["a", "b", "a"]).keys() == {"a"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (2, 2, 1, 5)
+
+
+def test_expired_entries(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite", ttl=-1)
+    cache.put("a", b"value")
+    assert cache.get("a") is None
+    assert cache.get("a", allow_stale=True).value == b"value"
+    assert cache.get("a", ttl=60).value == b"value"
+    assert cache.get_many(["a"]) == {}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite", max_bytes=30)
+    cache.put_many([("a", b"x" * 10, None), ("b", b"x" * 10, None)])
+    cache.touch("a")
+    cache.put("c", b"x" * 15)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["bytes"] <= 30
+
+
+def test_replacing_an_entry_counts_its_size_once(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite")
+    cache.put("a", b"x" * 10)
+    cache.put("a", b"x" * 4)
+    assert cache.stats()["bytes"] == 4
+    cache.delete("a")
+    assert cache.stats()["bytes"] == 0
+
+
+def test_failed_put_is_rolled_back(tmp_path):
+    cache = SqliteCache(tmp_path / "cache.sqlite")
+    cache.put("a", b"value")
+    conn = cache._conn
+    cache._conn = FailingConnection(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        cache.put_many([("b", b"value", None)])
+    cache._conn = conn
+    assert not conn.in_transaction
+    assert cache.stats()["bytes"] == 5
+    cache.put("b", b"value")
+    assert cache.get("b").value == b"value"
+
+
+def test_entries_are_shared_through_the_file(tmp_path):
+    SqliteCache(tmp_path / "cache.sqlite").put("a", "text")
+    assert SqliteCache(tmp_path / "cache.sqlite").get("a").value == "text"
@@ -0,0 +1,97 @@
+import sqlite3
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from insight_researcher.memory.chunk_store import ChunkStore
+
+DIM = 4
+
+
+def make_chunks(start, n):
+    vectors = np.arange(start * DIM, (start + n) * DIM, dtype=np.float32).reshape(n, DIM)
+    ids = [f"id{i}" for i in range(start, start + n)]
+    documents = [Document(page_content=f"chunk {i}", metadata={"source": "http://a.com", "chunk_id": i})
+                 for i in range(start, start + n)]
+    return vectors, ids, documents
+
+
+class FailingConnection:
+    """ sqlite connection whose inserts of chunk rows fail, like a full disk or a locked database """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, sql, rows):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_append_and_load(tmp_path):
+    store = ChunkStore(tmp_path)
+    store.append(*make_chunks(0, 3))
+    store.append(*make_chunks(3, 2))
+    store.close()
+
+    store = ChunkStore(tmp_path)
+    vectors, docs = store.load()
+    assert store.count == 5
+    np.testing.assert_array_equal(vectors, make_chunks(0, 5)[0])
+    assert [_id for _id, _ in docs] == [f"id{i}" for i in range(5)]
+    assert docs[4][1].page_content == "chunk 4"
+    assert docs[4][1].metadata == {"source": "http://a.com", "chunk_id": 4}
+
+
+def test_torn_tail_is_cut_on_open(tmp_path):
+    store = ChunkStore(tmp_path)
+    store.append(*make_chunks(0, 3))
+    store.close()
+    # a crash between the fsync of the vectors and the commit of their rows
+    with open(store.vector_path, "ab") as f:
+        f.write(make_chunks(3, 2)[0].tobytes()[:-5])
+
+    store = ChunkStore(tmp_path)
+    assert store.vector_path.stat().st_size == 3 * DIM * 4
+    store.append(*make_chunks(3, 2))
+    vectors, docs = store.load()
+    np.testing.assert_array_equal(vectors, make_chunks(0, 5)[0])
+    assert len(docs) == 5
+
+
+def test_failed_append_leaves_no_orphan_vectors(tmp_path):
+    store = ChunkStore(tmp_path)
+    store.append(*make_chunks(0, 3))
+    conn = store._conn
+    store._conn = FailingConnection(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        store.append(*make_chunks(100, 2))
+    store._conn = conn
+    assert store.count == 3
+    assert store.vector_path.stat().st_size == 3 * DIM * 4
+
+    # the next append lands right after the committed vectors
+    store.append(*make_chunks(3, 2))
+    vectors, docs = store.load()
+    np.testing.assert_array_equal(vectors, make_chunks(0, 5)[0])
+    assert [_id for _id, _ in docs] == [f"id{i}" for i in range(5)]
+
+
+def test_failed_first_append_forgets_the_dimension(tmp_path):
+    store = ChunkStore(tmp_path)
+    conn = store._conn
+    store._conn = FailingConnection(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        store.append(*make_chunks(0, 2))
+    store._conn = conn
+    assert store.dim is None and store.count == 0
+    assert store.vector_path.stat().st_size == 0
+    store.close()
+
+    store = ChunkStore(tmp_path)
+    assert store.dim is None
+    store.append(*make_chunks(0, 2))
+    vectors, _ = store.load()
+    np.testing.assert_array_equal(vectors, make_chunks(0, 2)[0])
@@ -0,0 +1,34 @@
+from insight_researcher.memory.context_packer import ContextPacker
+from insight_researcher.llm.token_counter import count_strings_tokens
+
+MODEL = "gpt-3.5-turbo"
+
+
+def tokens(texts):
+    return sum(count_strings_tokens(texts, MODEL))
+
+
+def test_packs_by_relevance_within_the_budget():
+    texts = ["alpha " * 20, "beta " * 20, "gamma " * 20]
+    packer = ContextPacker(token_budget=tokens(texts[:2]), model=MODEL, diversity=0)
+    selected = packer.pack(texts, [0.1, 0.9, 0.5], [[1, 0], [0, 1], [1, 1]])
+    assert selected == [1, 2]
+
+
+def test_near_identical_chunks_give_way_to_novel_ones():
+    texts = ["rates rose " * 10, "rates went up " * 10, "earnings beat " * 10]
+    vectors = [[1, 0], [0.99, 0.01], [0, 1]]
+    packer = ContextPacker(token_budget=tokens(texts[:2]), model=MODEL, diversity=0.5)
+    assert packer.pack(texts, [0.9, 0.85, 0.6], vectors) == [0, 2]
+
+
+def test_smaller_chunks_fill_the_remaining_budget():
+    texts = ["long " * 100, "short one", "short two"]
+    packer = ContextPacker(token_budget=tokens(texts[1:]) + 5, model=MODEL, diversity=0)
+    assert packer.pack(texts, [0.9, 0.5, 0.4], [[1, 0], [0, 1], [1, 1]]) == [1, 2]
+
+
+def test_nothing_to_pack():
+    packer = ContextPacker(token_budget=100, model=MODEL)
+    assert packer.pack([], [], []) == []
+    assert packer.pack(["too long " * 100], [1.0], [[0, 0]]) == []
@@ -0,0 +1,50 @@
+import threading
+
+from insight_researcher.memory.embedding_executor import EmbeddingExecutor
+
+
+class RecordingEmbeddings:
+    """ embeddings whose vector is the length of the text, recording the size of every request """
+
+    model = "text-embedding-ada-002"
+
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.requests.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text))]
+
+
+def test_batches_by_size_and_keeps_the_order():
+    embeddings = RecordingEmbeddings()
+    executor = EmbeddingExecutor(embeddings, max_batch_size=3, max_concurrency=2)
+    texts = ["x" * i for i in range(1, 11)]
+    assert executor.embed_documents(texts) == [[float(i)] for i in range(1, 11)]
+    assert sorted(len(request) for request in embeddings.requests) == [1, 3, 3, 3]
+
+    metrics = executor.metrics()
+    assert metrics["requests"] == 4
+    assert metrics["texts"] == 10
+
+
+def test_batches_by_tokens():
+    embeddings = RecordingEmbeddings()
+    executor = EmbeddingExecutor(embeddings, max_batch_tokens=1)
+    texts = ["alpha", "beta", "gamma"]
+    assert executor.embed_documents(texts) == [[5.0], [4.0], [5.0]]
+    # a text over the token budget still goes out, alone in its request
+    assert all(len(request) == 1 for request in embeddings.requests)
+    assert len(embeddings.requests) == 3
+
+
+def test_no_texts_no_request():
+    embeddings = RecordingEmbeddings()
+    executor = EmbeddingExecutor(embeddings)
+    assert executor.embed_documents([]) == []
+    assert embeddings.requests == []
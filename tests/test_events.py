@@ -0,0 +1,64 @@
+from insight_researcher.utils.events import EventEmitter, TokenBuffer
+
+
+class WebsocketSink:
+    def __init__(self):
+        self.sent = []
+
+    def send_json(self, data):
+        self.sent.append(data)
+
+
+def failing_sink(event):
+    raise RuntimeError("sink closed")
+
+
+def test_events_reach_every_sink():
+    events, websocket = [], WebsocketSink()
+    emitter = EventEmitter("t1", [events.append, None, websocket])
+    emitter.emit("logs", output="hello")
+    assert [(event.type, event.task_id, event.data) for event in events] == [("logs", "t1", {"output": "hello"})]
+    assert websocket.sent[0]["type"] == "logs"
+    assert websocket.sent[0]["output"] == "hello"
+
+
+def test_failing_sink_is_isolated():
+    events = []
+    emitter = EventEmitter("t1", [failing_sink, events.append])
+    emitter.emit("logs", output="a")
+    emitter.emit("result", output="b")
+    assert [event.type for event in events] == ["logs", "result"]
+
+
+def test_removed_sink_gets_nothing():
+    events = []
+    sink = events.append
+    emitter = EventEmitter("t1")
+    assert not emitter.active
+    emitter.emit("logs", output="dropped")
+    emitter.add_sink(sink)
+    emitter.emit("logs", output="kept")
+    emitter.remove_sink(sink)
+    emitter.emit("logs", output="dropped")
+    assert [event.data["output"] for event in events] == ["kept"]
+
+
+def test_token_buffer_flushes_on_newline_and_size():
+    pieces = []
+    buffer = TokenBuffer(pieces.append, max_chars=10, max_delay=60)
+    for token in ["ab", "c\n", "de", "fghij", "klm", "no"]:
+        buffer.write(token)
+    assert pieces == ["abc\n", "defghijklm"]
+    buffer.flush()
+    assert pieces == ["abc\n", "defghijklm", "no"]
+    buffer.flush()
+    assert len(pieces) == 3
+
+
+def test_token_buffer_flushes_late_tokens():
+    pieces = []
+    buffer = TokenBuffer(pieces.append, max_chars=1000, max_delay=0)
+    buffer.write("a")
+    buffer.write("")
+    buffer.write("b")
+    assert pieces == ["a", "b"]
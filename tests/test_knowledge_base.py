@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+from langchain.schema import Document
+
+from insight_researcher.memory.knowledge_base import KnowledgeBase
+
+URL = "http://a.com"
+TEXT = "".join(f"word{i} " for i in range(200))
+
+
+class FakeEmbeddings:
+    model = "fake-embedding"
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [1.0, float(len(text) % 7)]
+
+
+class FailingConnection:
+    """ sqlite connection whose chunk inserts fail, like a full disk or a locked database """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if sql.startswith("INSERT INTO chunks"):
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def make_chunks(url=URL, text=TEXT, size=300, overlap=100):
+    chunks = [text[i:i + size] for i in range(0, len(text), size - overlap)]
+    return [Document(page_content=chunk, metadata={"source": url, "chunk_id": i, "title": "A"})
+            for i, chunk in enumerate(chunks)]
+
+
+def fetch(kb, documents, vectors=None, url=URL, text=TEXT):
+    kb.start_fetch([{"url": url, "raw_content": text}])
+    kb.add_chunks(documents, vectors or kb.embeddings.embed_documents([d.page_content for d in documents]))
+
+
+def test_get_pages_serves_the_page_text(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    documents = make_chunks()
+    fetch(kb, documents)
+
+    pages, served, vectors = kb.get_pages([URL, "http://unknown.com"])
+    assert pages == [{"url": URL, "raw_content": TEXT, "title": "A"}]
+    assert [d.page_content for d in served] == [d.page_content for d in documents]
+    for document in served:
+        start = document.metadata["start_index"]
+        assert TEXT[start:start + len(document.page_content)] == document.page_content
+    assert all(vector is not None for vector in vectors)
+
+
+def test_refetch_replaces_the_chunks(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    fetch(kb, make_chunks())
+    text = "a new version of the page " * 20
+    fetch(kb, make_chunks(text=text), text=text)
+
+    pages, served, _ = kb.get_pages([URL])
+    assert pages[0]["raw_content"] == text
+    assert "".join(d.page_content for d in served).startswith(text[:200])
+    assert len(served) == len(make_chunks(text=text))
+
+
+def test_vectorless_chunks_get_the_first_vector(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    documents = make_chunks()
+    fetch(kb, documents, vectors=[None] * len(documents))
+    assert kb.get_vectors([documents[0].page_content]) == [None]
+    assert kb.stats()["chunks"] == 0
+
+    kb.add_vectors(documents[:1], [[1.0, 2.0]])
+    assert list(kb.get_vectors([documents[0].page_content])[0]) == [1.0, 2.0]
+    assert kb.stats()["chunks"] == 1
+    assert kb.search_sources("query") == [URL]
+
+
+def test_stale_sources_are_not_served(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings(), ttl=-1)
+    fetch(kb, make_chunks())
+    assert kb.fresh_sources([URL]) == []
+    assert kb.get_pages([URL]) == ([], [], [])
+
+
+def test_failed_write_is_rolled_back(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    kb.start_fetch([{"url": URL, "raw_content": TEXT}])
+    conn = kb._conn
+    kb._conn = FailingConnection(conn)
+    documents = make_chunks()
+    with pytest.raises(sqlite3.OperationalError):
+        kb.add_chunks(documents, kb.embeddings.embed_documents([d.page_content for d in documents]))
+    kb._conn = conn
+    assert not conn.in_transaction
+    assert kb.fresh_sources([URL]) == []
+    assert kb.stats()["chunks"] == 0
+
+    # the connection is still usable
+    fetch(kb, documents)
+    assert kb.stats()["chunks"] == len(documents)
+
+
+def test_index_is_loaded_on_open(tmp_path):
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    fetch(kb, make_chunks())
+    kb.close()
+
+    kb = KnowledgeBase(tmp_path, FakeEmbeddings())
+    assert kb.stats()["chunks"] == len(make_chunks())
+    assert kb.search_sources("query", k=1) == [URL]
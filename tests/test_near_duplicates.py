@@ -0,0 +1,41 @@
+from insight_researcher.memory.near_duplicates import NearDuplicateFilter
+
+ARTICLE = ("The central bank raised interest rates by a quarter point on Wednesday, citing persistent inflation "
+           "in services and a labour market that remains tight despite a year of tightening.")
+
+
+def test_exact_and_near_duplicates_are_dropped():
+    near_duplicate_filter = NearDuplicateFilter(threshold=0.9)
+    texts = [ARTICLE, ARTICLE, ARTICLE.replace("Wednesday", "Thursday"), "  " + ARTICLE.upper() + "\n"]
+    assert near_duplicate_filter.filter(texts) == [0]
+    assert near_duplicate_filter.stats()["dropped"] == 3
+
+
+def test_different_texts_are_kept():
+    near_duplicate_filter = NearDuplicateFilter(threshold=0.9)
+    texts = [ARTICLE, "Quarterly earnings of the chip maker beat the estimates on strong demand for data center "
+                      "accelerators, and the company raised its outlook for the rest of the year."]
+    assert near_duplicate_filter.filter(texts) == [0, 1]
+
+
+def test_chunks_are_compared_with_the_previous_calls():
+    near_duplicate_filter = NearDuplicateFilter(threshold=0.9)
+    assert near_duplicate_filter.filter([ARTICLE]) == [0]
+    assert near_duplicate_filter.filter(["short", ARTICLE]) == [0]
+    stats = near_duplicate_filter.stats()
+    assert stats["checked"] == 3
+    assert stats["dropped_chars"] == len(ARTICLE)
+
+
+def test_threshold_one_drops_exact_duplicates_only():
+    near_duplicate_filter = NearDuplicateFilter(threshold=1.0)
+    assert near_duplicate_filter.max_distance == 0
+    fingerprint = near_duplicate_filter.fingerprint(ARTICLE)
+    assert fingerprint == near_duplicate_filter.fingerprint(ARTICLE.upper())
+    assert near_duplicate_filter.filter([ARTICLE, ARTICLE]) == [0]
+
+
+def test_empty_text():
+    near_duplicate_filter = NearDuplicateFilter()
+    assert near_duplicate_filter.fingerprint("") == 0
+    assert near_duplicate_filter.filter(["", ""]) == [0]
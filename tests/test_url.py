@@ -0,0 +1,31 @@
+import pytest
+
+from insight_researcher.utils.url import canonicalize_url, normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url(" HTTP://Example.COM:80/a?b=2&a=1#top ") == "http://example.com/a?a=1&b=2"
+    assert normalize_url("https://example.com:8443") == "https://example.com:8443/"
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/news/article",
+    "http://example.com/news/article",
+    "https://www.example.com/news/article/",
+    "https://EXAMPLE.com:443/news/article#comments",
+    "https://example.com/news/article?utm_source=x&utm_medium=y&gclid=123",
+    "https://example.com/news/article?fbclid=abc&pk_campaign=spring",
+])
+def test_variants_share_the_canonical_url(url):
+    assert canonicalize_url(url) == "https://example.com/news/article"
+
+
+def test_content_parameters_are_kept():
+    assert canonicalize_url("https://example.com/search?q=ai&utm_source=x&page=2") == \
+           "https://example.com/search?page=2&q=ai"
+    assert canonicalize_url("https://example.com/a?id=1") != canonicalize_url("https://example.com/a?id=2")
+
+
+@pytest.mark.parametrize("url", ["http://example.com:99999/a", "http://[::1/a"])
+def test_unparsable_url_is_its_own_key(url):
+    assert canonicalize_url(url) == url
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from insight_researcher.tools.url_registry import UrlRegistry
+
+
+def failed(url):
+    return {"url": url, "raw_content": None, "permanent_failure": True}
+
+
+def fetched(url):
+    return {"url": url, "raw_content": "content"}
+
+
+class FailingConnection:
+    """ sqlite connection whose writes of failures fail, like a full disk """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, sql, rows):
+        if sql.startswith("INSERT"):
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_url_is_skipped_after_max_failures(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=2)
+    registry.record([failed("http://a.com/page")])
+    assert registry.filter_failing(["http://a.com/page"]) == ["http://a.com/page"]
+    # a variant of the same address counts as the same url
+    registry.record([failed("https://www.a.com/page/?utm_source=x")])
+    assert registry.filter_failing(["http://b.com", "http://a.com/page"]) == ["http://b.com"]
+    assert registry.stats() == {"urls": 1, "failing": 1, "skipped": 1}
+
+
+def test_transient_failures_are_not_counted(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=1)
+    registry.record([{"url": "http://a.com", "raw_content": None}])
+    assert registry.filter_failing(["http://a.com"]) == ["http://a.com"]
+    assert registry.stats()["urls"] == 0
+
+
+def test_success_resets_the_failures(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=2)
+    registry.record([failed("http://a.com")])
+    registry.record([fetched("http://a.com")])
+    registry.record([failed("http://a.com")])
+    assert registry.filter_failing(["http://a.com"]) == ["http://a.com"]
+
+
+def test_failing_url_is_retried_after_the_ttl(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=1, failure_ttl=0)
+    registry.record([failed("http://a.com")])
+    assert registry.filter_failing(["http://a.com"]) == ["http://a.com"]
+
+
+def test_failures_are_shared_through_the_file(tmp_path):
+    UrlRegistry(tmp_path / "urls.sqlite", max_failures=1).record([failed("http://a.com")])
+    assert UrlRegistry(tmp_path / "urls.sqlite", max_failures=1).filter_failing(["http://a.com"]) == []
+
+
+def test_unparsable_url(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=1)
+    registry.record([failed("http://a.com:99999")])
+    assert registry.filter_failing(["http://a.com:99999", "http://a.com"]) == ["http://a.com"]
+
+
+def test_failed_write_is_rolled_back(tmp_path):
+    registry = UrlRegistry(tmp_path / "urls.sqlite", max_failures=1)
+    registry.record([failed("http://a.com")])
+    conn = registry._conn
+    registry._conn = FailingConnection(conn)
+    with pytest.raises(sqlite3.OperationalError):
+        registry.record([fetched("http://a.com"), failed("http://b.com")])
+    registry._conn = conn
+    assert not conn.in_transaction
+    # the deletion of a.com was rolled back with the failed insert
+    assert registry.filter_failing(["http://a.com", "http://b.com"]) == ["http://b.com"]